@@ -1,19 +1,33 @@
 from .api import (
     ConvertFormats,
+    batch_download,
+    batch_download_progress,
     convert,
     convert_progress,
     download,
     download_progress,
     load,
     process,
+    process_archive,
+    process_archive_progress,
     process_progress,
     query,
     save_metadata,
+    sync,
+    sync_progress,
+    update,
+    update_progress,
 )
-from .base import BaseChapter, BaseMetadata
+from .base import BaseChapter, BaseMetadata, ChapterIndex
 from .comic import BaseComic
+from .image_index import IMAGE_INDEX_FILE, ImageIndex, ImageInfo
 from .io import MD_METADATA_FILE
+from .library import LIBRARY_FILE, Library
+from .output_state import OUTPUT_STATE_FILE, OutputRecord, OutputState
+from .page_hashes import PAGE_HASH_FILE, REPEATED_PAGES_FOLDER, PageHashIndex
 from .processor import (
+    PROCESSED_STATE_FILE,
+    Pipeline,
     ProcessConfig,
     ProcessOps,
     ProcessOptionMismatchError,
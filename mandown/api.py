@@ -1,16 +1,44 @@
 # pylint: disable=invalid-name
 
+import dataclasses
+import os
+import queue
 import shutil
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
-from typing import Iterator
+from typing import Callable, Collection, Iterator, Sequence
 
 import comicon
+import requests
 
-from . import io, sources
+from . import batch, io, sources
+from .base import BaseChapter, fingerprint_images
 from .comic import BaseComic
-from .convert_utils import ConvertFormats, convert_one
+from .convert_utils import (
+    ConvertFormats,
+    append_chapters,
+    can_append,
+    convert_part,
+    write_comic,
+    write_ir,
+)
 from .errors import ChapterImageCountMismatchError, ImageDownloadError
-from .processor import ProcessConfig, ProcessOps, Processor
+from .image_index import ImageIndex
+from .library import Library
+from .output_state import OutputRecord, OutputState
+from .page_hashes import REPEATED_PAGES_FOLDER, PageHashIndex, find_repeated_pages
+from .processor import (
+    Pipeline,
+    ProcessConfig,
+    ProcessedState,
+    ProcessOps,
+    ProcessOptionMismatchError,
+)
 
 
 def query(url: str) -> BaseComic:
@@ -81,12 +109,227 @@ def init_parse_comic(
     return comic
 
 
+def _merge_progress(iterators: list[Iterator[str | int]]) -> Iterator[str | int]:
+    """
+    Run `iterators`, which each yield their length and then their progress, in a thread
+    each. The merged iterator yields their total length and then all of their progress
+    as it happens.
+    """
+    if len(iterators) == 1:
+        yield from iterators[0]
+        return
+
+    # (iterator index, item), where an item of None means the iterator is finished
+    events: queue.SimpleQueue[tuple[int, str | int | BaseException | None]] = queue.SimpleQueue()
+
+    def run(i: int, iterator: Iterator[str | int]) -> None:
+        try:
+            for item in iterator:
+                events.put((i, item))
+        except BaseException as err:  # pylint: disable=broad-exception-caught
+            events.put((i, err))
+        else:
+            events.put((i, None))
+
+    lengths: dict[int, int] = {}
+    # progress made before every length is known
+    early: list[str | int] = []
+    started = False
+    with ThreadPoolExecutor(len(iterators)) as executor:
+        for i, iterator in enumerate(iterators):
+            executor.submit(run, i, iterator)
+
+        finished = 0
+        while finished < len(iterators):
+            i, item = events.get()
+            if isinstance(item, BaseException):
+                raise item
+            if item is None:
+                finished += 1
+                lengths.setdefault(i, 0)
+            elif i not in lengths:
+                lengths[i] = int(item)
+            elif not started:
+                early.append(item)
+            else:
+                yield item
+
+            if not started and len(lengths) == len(iterators):
+                started = True
+                yield sum(lengths.values())
+                yield from early
+
+
+def _convert_incremental(
+    comic: comicon.Comic,
+    comic_path: Path,
+    to: ConvertFormats,
+    dest_folder: Path,
+    state: OutputState,
+    record: OutputRecord,
+    incremental: bool = True,
+    force: bool = False,
+) -> Iterator[str | int]:
+    """
+    Convert `comic`, whose chapters are in `comic_path` along with its comicon IR data.
+    Unless `force`, nothing is done if nothing changed since it was last converted,
+    as told by `state` and `record`. If `incremental` and the only change is new
+    chapters, they are appended to the existing file instead.
+    """
+    dest = dest_folder / f"{comic.metadata.title_slug}.{to.value}"
+
+    if not force and record.up_to_date(state.get(dest), dest):
+        yield 0
+        return
+
+    start = record.new_chapters(state.get(dest), dest) if incremental else None
+    if start is not None and can_append(dest, to):
+        yield from append_chapters(comic, comic_path, to, dest, start)
+    else:
+        yield from write_comic(comic, comic_path, to, dest)
+    state.record(dest, record)
+
+
+def _convert_formats(
+    comic: comicon.Comic,
+    comic_path: Path,
+    formats: list[ConvertFormats],
+    dest_folder: Path,
+    incremental: bool = True,
+    force: bool = False,
+) -> Iterator[str | int]:
+    """
+    Convert `comic`, whose chapters are in `comic_path`, to each of `formats` at once.
+    The IR data is written and the images are looked at once for every format.
+    What went into each file is recorded in `md-outputs.json`.
+    """
+    write_ir(comic, comic_path)
+    state = OutputState.load(comic_path)
+    record = OutputRecord.describe(comic, comic_path, formats[0].value)
+    yield from _merge_progress(
+        [
+            _convert_incremental(
+                comic,
+                comic_path,
+                to,
+                dest_folder,
+                state,
+                dataclasses.replace(record, format=to.value),
+                incremental,
+                force,
+            )
+            for to in formats
+        ]
+    )
+
+
+def _convert_parts(
+    comics: list[comicon.Comic],
+    comic_path: Path,
+    formats: list[ConvertFormats],
+    dest_folder: Path,
+    jobs: int | None = None,
+    force: bool = False,
+) -> Iterator[str]:
+    """
+    Convert each of `comics`, which are parts of the comic in `comic_path`, to each of
+    `formats` in parallel. Parts that were already converted are skipped unless `force`.
+
+    :returns An `Iterator` that yields the title of each part once it is converted, in order
+    """
+    jobs = jobs or os.cpu_count() or 1
+    existing_filenames = (
+        set() if force else {file.name for file in dest_folder.iterdir() if file.is_file()}
+    )
+    # do not overwrite existing cache
+    todo: dict[int, list[ConvertFormats]] = {}
+    for comicomic in comics:
+        missing = [
+            to
+            for to in formats
+            if f"{comicomic.metadata.title_slug}.{to.value}" not in existing_filenames
+        ]
+        if missing:
+            todo[id(comicomic)] = missing
+    convert = partial(convert_part, comic_path=comic_path, dest_folder=dest_folder)
+
+    if jobs == 1 or len(todo) <= 1:
+        for comicomic in comics:
+            yield comicomic.metadata.title
+            if id(comicomic) in todo:
+                convert(comicomic, formats=todo[id(comicomic)])
+        return
+
+    with ProcessPoolExecutor(min(jobs, len(todo))) as executor:
+        futures = {
+            id(comicomic): executor.submit(convert, comicomic, formats=todo[id(comicomic)])
+            for comicomic in comics
+            if id(comicomic) in todo
+        }
+        for comicomic in comics:
+            if (future := futures.get(id(comicomic))) is not None:
+                future.result()
+            yield comicomic.metadata.title
+
+
+def _convert_file(
+    comic_path: Path, formats: list[ConvertFormats], dest_folder: Path
+) -> Iterator[str | int]:
+    """
+    Convert the comic file `comic_path` to each of `formats` from one IR of it.
+
+    :returns An `Iterator` with the progress of reading the file, then the progress
+    of writing every format
+    """
+    with tempfile.TemporaryDirectory(prefix="mandown-") as ir_folder:
+        ir_path = Path(ir_folder)
+        yield from comicon.inputs.create_cir_progress(comic_path, ir_path)
+        comic = comicon.cirtools.read_metadata(ir_path)
+        yield from _merge_progress(
+            [
+                write_comic(comic, ir_path, to, dest_folder / f"{comic_path.stem}.{to.value}")
+                for to in formats
+            ]
+        )
+
+
+def _add_library_outputs(
+    comic_path: Path,
+    comic: BaseComic,
+    comicon_comics: list[comicon.Comic],
+    formats: list[ConvertFormats],
+    dest_folder: Path,
+) -> None:
+    """
+    Record the files that `comicon_comics`, made of chapters of `comic`, were converted
+    to in the library `comic_path` is in, if any.
+    """
+    if (library := Library.find(comic_path)) is None:
+        return
+    with library:
+        chapter_numbers = {chap.slug: i for i, chap in enumerate(comic.chapters, start=1)}
+        for comicomic in comicon_comics:
+            if not comicomic.chapters:
+                continue
+            for to in formats:
+                library.add_output(
+                    comic_path,
+                    dest_folder / f"{comicomic.metadata.title_slug}.{to.value}",
+                    to.value,
+                    chapter_numbers[comicomic.chapters[-1].slug],
+                )
+
+
 def convert_progress(
     comic_path: Path | str,
-    to: ConvertFormats,
+    to: ConvertFormats | Collection[ConvertFormats],
     dest_folder: Path | str | None = None,
     remove_after: bool = False,
     split_by_chapters: bool = False,
+    only_chapters: Collection[str] | None = None,
+    jobs: int | None = None,
+    incremental: bool = True,
+    force: bool = False,
 ) -> Iterator[str | int]:
     """
     Convert the comic located at `folder_path` to `convert_to`
@@ -94,11 +337,21 @@ def convert_progress(
 
     :param `comic_path`: The path to the comic to convert (may be in Mandown
     folder form or any of the `mandown.ConvertFormats` such as EPUB)
-    :param `convert_to`: The format to convert to
+    :param `convert_to`: The format to convert to, or several formats to convert to
+    at once from one read of the comic
     :param `dest_folder`: A folder to put the converted comic in
     :param `remove_after`: If `True`, delete the original file/folder after conversion
     :param `split_by_chapters`: Only applies to Mandown-created comics. If `True`,
     output a comic file per chapter. Existing comic files will not be overwritten.
+    :param `only_chapters`: Only applies to Mandown-created comics. If set, only
+    convert the chapters with these slugs.
+    :param `jobs`: Only applies with `split_by_chapters`. The number of chapters to
+    convert in parallel (defaults to the number of CPUs)
+    :param `incremental`: Only applies to Mandown-created comics converted to CBZ or
+    EPUB. If `True` and the only change since the comic was last converted to the same
+    file is new chapters, append them to the file instead of converting it again.
+    :param `force`: Only applies to Mandown-created comics. If `True`, convert the comic
+    even if the existing file was converted from the same chapters, images and metadata.
 
     :returns An `Iterator` representing a progress bar. The first iteration returns
     the remaining number of iterations. If converting between file formats, an
@@ -106,7 +359,9 @@ def convert_progress(
     number of the second number of iterations.
     """
     comic_path = Path(comic_path)
-    if to == ConvertFormats.NONE:
+    formats = [ConvertFormats(to)] if isinstance(to, str) else list(dict.fromkeys(to))
+    formats = [to for to in formats if to != ConvertFormats.NONE]
+    if not formats:
         return
 
     # default to working directory
@@ -137,38 +392,39 @@ def convert_progress(
                     [comicon.Chapter(chap.title, chap.slug)],
                 )
                 for i, chap in enumerate(comic.chapters, start=1)
+                if only_chapters is None or chap.slug in only_chapters
             ]
 
             yield len(comicon_comics)
-            existing_filenames = {file.name for file in dest_folder.iterdir() if file.is_file()}
-            for comicomic in comicon_comics:
-                yield comicomic.metadata.title
-
-                # do not overwrite existing cache
-                if f"{comicomic.metadata.title_slug}.{to.value}" in existing_filenames:
-                    continue
-                for _ in convert_one(comicomic, comic_path, to, dest_folder):
-                    ...
+            yield from _convert_parts(comicon_comics, comic_path, formats, dest_folder, jobs, force)
 
         else:
-            comicon_comic = comicon.Comic(
-                comicon.Metadata(
-                    title=comic.metadata.title,
-                    authors=comic.metadata.authors,
-                    description=comic.metadata.description,
-                    genres=comic.metadata.genres,
-                    cover_path_rel=cover,
-                ),
-                [comicon.Chapter(chap.title, chap.slug) for chap in comic.chapters],
+            comicon_comics = [
+                comicon.Comic(
+                    comicon.Metadata(
+                        title=comic.metadata.title,
+                        authors=comic.metadata.authors,
+                        description=comic.metadata.description,
+                        genres=comic.metadata.genres,
+                        cover_path_rel=cover,
+                    ),
+                    [
+                        comicon.Chapter(chap.title, chap.slug)
+                        for chap in comic.chapters
+                        if only_chapters is None or chap.slug in only_chapters
+                    ],
+                )
+            ]
+
+            yield from _convert_formats(
+                comicon_comics[0], comic_path, formats, dest_folder, incremental, force
             )
 
-            yield from convert_one(comicon_comic, comic_path, to, dest_folder)
+        _add_library_outputs(comic_path, comic, comicon_comics, formats, dest_folder)
 
     else:
         # it's a file, no conversion needed, let comicon do its inferencing
-        yield from comicon.convert_progress(
-            comic_path, dest_folder / f"{comic_path.stem}.{to.value}"
-        )
+        yield from _convert_file(comic_path, formats, dest_folder)
 
     if remove_after:
         shutil.rmtree(comic_path)
@@ -194,26 +450,288 @@ def convert(
         pass
 
 
+# the encoded images that processing an archive entry produced, if it changed
+EntryResult = dict[str, bytes] | None
+
+
+def _processed_files(images: list[Path]) -> list[Path]:
+    """
+    Return the files that processing `images` may have produced, including
+    pages split off of them and images converted to another format.
+    """
+    stems = {image.stem for image in images}
+    return [
+        file
+        for folder in {image.parent for image in images}
+        for file in folder.iterdir()
+        if file.is_file() and file.stem.rstrip("a") in stems
+    ]
+
+
+def _image_processor(pipeline: Pipeline, comic_path: Path) -> Callable[[Path], bool | None]:
+    """
+    Return the function that runs `pipeline` on an image of the comic in `comic_path`.
+    If the pipeline has a variant for each of several profiles, the folders that
+    the copy of the comic for each profile is written to are created first.
+    """
+    if not pipeline.variants:
+        return pipeline.process
+
+    variant_paths = {p: io.variant_path(comic_path, p) for p in pipeline.variants}
+    for variant_path in variant_paths.values():
+        variant_path.mkdir(exist_ok=True)
+        if (comic_path / io.MD_METADATA_FILE).exists():
+            shutil.copy(comic_path / io.MD_METADATA_FILE, variant_path)
+    return partial(pipeline.process_variants, comic_path=comic_path, variant_paths=variant_paths)
+
+
+def _drop_repeated_pages(
+    comic_path: Path,
+    images_by_chapter: dict[str, list[Path]],
+    max_repeats: int,
+    jobs: int,
+    move: bool = True,
+) -> dict[str, list[Path]]:
+    """
+    Remove the pages that are repeated in more than `max_repeats` chapters of a comic.
+
+    :param `comic_path`: The comic folder
+    :param `images_by_chapter`: The images of the comic (see `io.discover_local_images`)
+    :param `max_repeats`: The number of chapters a page can appear in
+    :param `jobs`: The number of processes to hash new pages with
+    :param `move`: Whether to also move the repeated pages out of their chapters, into
+    `<comic>/md-repeated-pages/<chapter>/`, so they can be restored
+    :returns `images_by_chapter` without the repeated pages
+    """
+    chapters = [images for slug, images in images_by_chapter.items() if slug != "cover"]
+    index = PageHashIndex.load(comic_path)
+    index.refresh((i for images in chapters for i in images), jobs)
+    index.save()
+
+    repeated = set(find_repeated_pages(chapters, index, max_repeats))
+    if move:
+        for image in repeated:
+            moved_path = comic_path / REPEATED_PAGES_FOLDER / image.parent.name / image.name
+            moved_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(image, moved_path)
+    return {
+        slug: [i for i in images if i not in repeated] for slug, images in images_by_chapter.items()
+    }
+
+
 def process_progress(
-    comic_path: Path | str, ops: list[ProcessOps], config: ProcessConfig | None = None
+    comic_path: Path | str,
+    ops: list[ProcessOps],
+    config: ProcessConfig | None = None,
+    jobs: int | None = None,
 ) -> Iterator[str]:
     """
     Process the comic in `comic_path` with `ops` in the order provided.
+    Images that were already processed with the same operations and config,
+    and have not changed since, are skipped.
 
     :param `comic_path`: A folder containing a image folders to process
     :param `ops`: A list of operations to perform on each image
     :param `config`: Options for processing operations
-    :returns An `Iterator` representing a progress bar up to the number of images in the comic.
+    :param `jobs`: The number of processes to use (defaults to the number of CPUs)
+    :returns An `Iterator` representing a progress bar up to the number of chapters
+    in the comic, yielding once each chapter is fully processed, in order.
+    :raises `ProcessOptionMismatchError` if `ops` cannot be run with `config`
+
+    If `config` has several `output_profiles`, the comic is left as is and a copy
+    for each profile is written next to it (see `io.variant_path`).
     """
-    data = io.discover_local_images(comic_path)
-    for _, images in data.items():
-        for i in images:
-            Processor(i, config).process(ops)
-        yield "Processing"
+    comic_path = Path(comic_path)
+    pipeline = Pipeline(ops, config)
+    process_image = _image_processor(pipeline, comic_path)
+    state = ProcessedState.load(comic_path)
+    jobs = jobs or os.cpu_count() or 1
+    images_by_chapter = io.discover_local_images(comic_path)
+    if pipeline.enabled and ProcessOps.DROP_DUPLICATE_PAGES in ops:
+        images_by_chapter = _drop_repeated_pages(
+            comic_path,
+            images_by_chapter,
+            pipeline.config.max_page_repeats,
+            jobs,
+            # copies for other profiles are made without the pages instead
+            move=not pipeline.variants,
+        )
+    data = list(images_by_chapter.values())
+
+    # images whose dimensions show they would not change are not opened at all
+    index = ImageIndex.load(comic_path)
+    index.refresh((i for images in data for i in images), jobs)
+    index.save()
+
+    def needs_processing(image: Path) -> bool:
+        if state.is_processed(image, pipeline.fingerprint):
+            return False
+        info = index.get(image)
+        return info is None or pipeline.may_change(info.size, info.mode)
+
+    def finish_chapter(images: list[Path]) -> str:
+        if pipeline.enabled and images:
+            # variants leave the original images unchanged
+            processed = images if pipeline.variants else _processed_files(images)
+            state.mark_all(processed, pipeline.fingerprint)
+        return "Processing"
+
+    try:
+        if jobs == 1:
+            for images in data:
+                for i in filter(needs_processing, images):
+                    process_image(i)
+                yield finish_chapter(images)
+            return
+
+        # only keep a few images per process queued so memory use stays bounded
+        max_queued = jobs * 4
+        queue: deque[tuple[int, Future[bool | None]]] = deque()
+        remaining: list[int] = []
+        next_chapter = 0
+
+        with ProcessPoolExecutor(jobs) as executor:
+
+            def finish_oldest() -> None:
+                chapter_num, future = queue.popleft()
+                future.result()
+                remaining[chapter_num] -= 1
+
+            for images in data:
+                todo = list(filter(needs_processing, images))
+                remaining.append(len(todo))
+                for i in todo:
+                    if len(queue) >= max_queued:
+                        finish_oldest()
+                    queue.append((len(remaining) - 1, executor.submit(process_image, i)))
+
+                    # yield chapters as soon as they are done, in order
+                    while next_chapter < len(remaining) - 1 and remaining[next_chapter] == 0:
+                        yield finish_chapter(data[next_chapter])
+                        next_chapter += 1
+
+            while queue:
+                finish_oldest()
+            for images in data[next_chapter:]:
+                yield finish_chapter(images)
+    finally:
+        # the state is only saved now and then while processing
+        if pipeline.enabled:
+            state.save()
+
+
+def process_archive_progress(
+    archive_path: Path | str,
+    ops: list[ProcessOps],
+    config: ProcessConfig | None = None,
+    dest: Path | str | None = None,
+    jobs: int | None = None,
+) -> Iterator[int | str]:
+    """
+    Process the images inside the CBZ (or any ZIP) archive at `archive_path` with `ops`
+    in the order provided, without extracting it. Images are read from the archive and
+    processed in memory in parallel, then written to a new archive in their original
+    order along with every other entry.
+
+    :param `archive_path`: The archive to process
+    :param `ops`: A list of operations to perform on each image
+    :param `config`: Options for processing operations
+    :param `dest`: The archive to write to (defaults to replacing `archive_path`)
+    :param `jobs`: The number of processes to use (defaults to the number of CPUs)
+    :returns An `Iterator` that yields the number of images in the archive, then
+    the name of each image once it is processed, in order.
+    :raises `ProcessOptionMismatchError` if `ops` cannot be run with `config`,
+    or cannot be run on an archive
+    """
+    archive_path = Path(archive_path)
+    dest = Path(dest or archive_path)
+    pipeline = Pipeline(ops, config)
+    if pipeline.variants or ProcessOps.DROP_DUPLICATE_PAGES in ops:
+        raise ProcessOptionMismatchError(
+            "output_profiles and drop_duplicate_pages cannot be used on archives"
+        )
+    jobs = jobs or os.cpu_count() or 1
+    tmp_path = dest.with_name(f".{dest.name}.tmp")
+
+    with (
+        zipfile.ZipFile(archive_path) as archive,
+        ProcessPoolExecutor(jobs) if jobs > 1 else nullcontext() as executor,
+    ):
+        entries = archive.infolist()
+        images = {
+            entry.filename
+            for entry in entries
+            if not entry.is_dir() and Path(entry.filename).suffix.lower() in io.IMAGE_SUFFIXES
+        }
+        yield len(images)
+        if not pipeline.enabled:
+            return
+
+        queue: deque[tuple[zipfile.ZipInfo, bytes, Future[EntryResult] | EntryResult]] = deque()
+
+        def finish_oldest(new_archive: zipfile.ZipFile) -> str:
+            entry, data, result = queue.popleft()
+            outputs = result.result() if isinstance(result, Future) else result
+            if outputs is None:
+                # unchanged entries are copied as they are
+                new_archive.writestr(entry, data)
+            for name, output in (outputs or {}).items():
+                info = zipfile.ZipInfo(name, entry.date_time)
+                info.compress_type = entry.compress_type
+                new_archive.writestr(info, output)
+            return entry.filename
+
+        try:
+            with zipfile.ZipFile(tmp_path, "w") as new_archive:
+                for entry in entries:
+                    data = archive.read(entry)
+                    result: Future[EntryResult] | EntryResult = None
+                    if entry.filename in images:
+                        if executor is None:
+                            result = pipeline.process_entry(data, entry.filename)
+                        else:
+                            result = executor.submit(pipeline.process_entry, data, entry.filename)
+                    queue.append((entry, data, result))
+
+                    # only keep a few images per process queued so memory use stays bounded
+                    while len(queue) > jobs * 4:
+                        if (name := finish_oldest(new_archive)) in images:
+                            yield name
+                while queue:
+                    if (name := finish_oldest(new_archive)) in images:
+                        yield name
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+    os.replace(tmp_path, dest)
+
+
+def process_archive(
+    archive_path: Path | str,
+    ops: list[ProcessOps],
+    config: ProcessConfig | None = None,
+    dest: Path | str | None = None,
+    jobs: int | None = None,
+) -> None:
+    """
+    Process the images inside the CBZ archive at `archive_path` with `ops` in the
+    order provided, without extracting it.
+
+    :param `archive_path`: The archive to process
+    :param `ops`: A list of operations to perform on each image
+    :param `config`: Options for processing operations
+    :param `dest`: The archive to write to (defaults to replacing `archive_path`)
+    :param `jobs`: The number of processes to use (defaults to the number of CPUs)
+    """
+    for _ in process_archive_progress(archive_path, ops, config, dest, jobs):
+        pass
 
 
 def process(
-    comic_path: Path | str, ops: list[ProcessOps], config: ProcessConfig | None = None
+    comic_path: Path | str,
+    ops: list[ProcessOps],
+    config: ProcessConfig | None = None,
+    jobs: int | None = None,
 ) -> None:
     """
     Process the comic in `comic_path` with `ops` in the order provided.
@@ -221,11 +739,27 @@ def process(
     :param `comic_path`: A folder containing a image folders to process
     :param `ops`: A list of operations to perform on each image
     :param `config`: Options for processing operations
+    :param `jobs`: The number of processes to use (defaults to the number of CPUs)
     """
-    for _ in process_progress(comic_path, ops, config):
+    for _ in process_progress(comic_path, ops, config, jobs):
         pass
 
 
+def _downloaded_images(chapter_path: Path) -> set[int]:
+    """
+    Return the numbers of the images already downloaded to `chapter_path`.
+    """
+    downloaded: set[int] = set()
+    for file in chapter_path.iterdir():
+        if file.stem == file.stem.rjust(io.NUM_LEFT_PAD_DIGITS, "0"):
+            try:
+                downloaded.add(int(file.stem))
+            except ValueError:
+                # expected if not an image file
+                pass
+    return downloaded
+
+
 def download_progress(
     comic: BaseComic | str,
     path: Path | str = ".",
@@ -235,6 +769,11 @@ def download_progress(
     threads: int = 4,
     only_download_missing: bool = True,
     raise_on_failed_download: bool = True,
+    executor: Executor | None = None,
+    session: requests.Session | None = None,
+    chapters: Sequence[BaseChapter] | None = None,
+    process_ops: list[ProcessOps] | None = None,
+    process_config: ProcessConfig | None = None,
 ) -> Iterator[str]:
     """
     Download comic or comic URL `comic` to `path` using `threads` threads.
@@ -246,17 +785,31 @@ def download_progress(
     :param `threads`: The number of threads to use
     :param `only_download_missing`: If `True`, do not download
     images already in the destination path
+    :param `executor`: An executor to download images with instead of
+    opening `threads` processes per chapter
+    :param `session`: A session to share connections with, used with `executor`
+    :param `chapters`: Only download these chapters of the comic instead of
+    every chapter between `start` and `end`
+    :param `process_ops`: Processing operations to run on each image as it is
+    downloaded, before it is first written to disk (see `process_progress`). Operations
+    on the whole comic, like `drop_duplicate_pages`, are not run: run `process_progress`
+    with the same operations after downloading
+    :param `process_config`: Options for processing operations
+    :raises `ProcessOptionMismatchError` if `process_ops` cannot be run with `process_config`
 
     :returns An `Iterator` representing a progress bar up to the number of chapters in the comic.
     """
     path = Path(path)
 
+    pipeline = Pipeline(process_ops, process_config) if process_ops else None
+
     # make var comic a BaseComic
     if isinstance(comic, str):
         comic = query(comic)
 
     full_path = path / comic.metadata.title_slug
     full_path.mkdir(exist_ok=True)
+    processed_state = ProcessedState.load(full_path) if pipeline is not None else None
 
     # save metadata json
     comic.set_chapter_range(start=start, end=end)
@@ -269,71 +822,93 @@ def download_progress(
             full_path,
             filestems=["cover"],
             headers=comic.source.headers,
+            executor=executor,
+            session=session,
+            pipeline=pipeline,
         ):
             pass
 
-    # for each chapter
-    for chap in comic.chapters[start:end]:
-        yield chap.title
-        image_urls = comic.get_chapter_image_urls(chap)
-        chapter_path = full_path / chap.slug
-        chapter_path.mkdir(exist_ok=True)
-
-        # expect that they're named by numbers only
-        skip_images: set[int] = set()
-        if only_download_missing:
-            for file in chapter_path.iterdir():
-                if file.stem == file.stem.rjust(io.NUM_LEFT_PAD_DIGITS, "0"):
-                    try:
-                        skip_images.add(int(file.stem))
-                    except ValueError:
-                        # expected if not an image file
-                        pass
-
-        if not image_urls or len(skip_images) == len(image_urls):
-            # move to next chapter if there's nothing to download for this one
-            continue
-
-        # name them 00001.png, 00002.png, etc
-        # skipping ones that already exist
-        try:
-            processed_image_urls, filestems = zip(
-                *(
-                    (link, str(i).rjust(io.NUM_LEFT_PAD_DIGITS, "0"))
-                    for i, link in enumerate(image_urls, start=1)
-                    if i not in skip_images
-                ),
-                strict=False,
-            )
-        except ValueError:
-            # ValueError is raised when `zip` is given no arguments and thus
-            # no images to download
-            processed_image_urls, filestems = [], []
-
-            raise ChapterImageCountMismatchError(
-                "There are more images in the filesystem than in present in the chapter index."
-                " You should never see this message."
-            ) from None
+    # looked up once, since opening a library sets up its database
+    library = Library.find(full_path)
+    try:
+        # for each chapter
+        for chap in comic.chapters[start:end] if chapters is None else chapters:
+            yield chap.title
+            image_urls = comic.get_chapter_image_urls(chap)
+            chapter_path = full_path / chap.slug
+            chapter_path.mkdir(exist_ok=True)
 
-        chapter_path = full_path / chap.slug
+            # expect that they're named by numbers only
+            skip_images = _downloaded_images(chapter_path) if only_download_missing else set()
 
-        for _ in io.download_images(
-            processed_image_urls,
-            chapter_path,
-            headers=comic.source.headers,
-            filestems=filestems,
-            threads=threads,
-        ):
-            pass
+            if not image_urls or len(skip_images) == len(image_urls):
+                # move to next chapter if there's nothing to download for this one. The images
+                # may be from an older version of the chapter, so it is not fingerprinted
+                if library is not None:
+                    library.update_chapter(full_path, chap.slug, len(skip_images))
+                continue
 
-        # check if every image was downloaded
-        if count := len([f for f in chapter_path.iterdir() if f.is_file()]) != len(
-            processed_image_urls
-        ):
-            if raise_on_failed_download:
-                raise ImageDownloadError(
-                    f"Failed to download {len(processed_image_urls) - count} images"
+            # name them 00001.png, 00002.png, etc
+            # skipping ones that already exist
+            try:
+                processed_image_urls, filestems = zip(
+                    *(
+                        (link, str(i).rjust(io.NUM_LEFT_PAD_DIGITS, "0"))
+                        for i, link in enumerate(image_urls, start=1)
+                        if i not in skip_images
+                    ),
+                    strict=False,
                 )
+            except ValueError:
+                # ValueError is raised when `zip` is given no arguments and thus
+                # no images to download
+                processed_image_urls, filestems = [], []
+
+                raise ChapterImageCountMismatchError(
+                    "There are more images in the filesystem than in present in the chapter index."
+                    " You should never see this message."
+                ) from None
+
+            chapter_path = full_path / chap.slug
+
+            existing_files = set(chapter_path.iterdir())
+            for _ in io.download_images(
+                processed_image_urls,
+                chapter_path,
+                headers=comic.source.headers,
+                filestems=filestems,
+                threads=threads,
+                executor=executor,
+                session=session,
+                pipeline=pipeline,
+            ):
+                pass
+
+            if pipeline is not None and processed_state is not None:
+                new_files = set(chapter_path.iterdir()) - existing_files
+                processed_state.mark_all(new_files, pipeline.fingerprint)
+
+            # only count the downloaded images, not extra pages created by processing
+            num_files = len([f for f in chapter_path.iterdir() if f.is_file() and f.stem.isdigit()])
+            if num_files >= len(image_urls):
+                chap.fingerprint = fingerprint_images(image_urls)
+
+            if library is not None:
+                library.update_chapter(full_path, chap.slug, num_files)
+
+            # check if every image was downloaded
+            if (missing := len(image_urls) - num_files) > 0:
+                if raise_on_failed_download:
+                    raise ImageDownloadError(f"Failed to download {missing} images")
+    finally:
+        # the processed state is only saved now and then while downloading
+        if processed_state is not None:
+            processed_state.save()
+        if library is not None:
+            library.close()
+
+    # save fingerprints of downloaded chapters
+    io.save_comic(comic, full_path)
 
 
 def download(
@@ -345,6 +920,8 @@ def download(
     threads: int = 4,
     only_download_missing: bool = True,
     raise_on_failed_download: bool = True,
+    process_ops: list[ProcessOps] | None = None,
+    process_config: ProcessConfig | None = None,
 ) -> None:
     """
     Download comic or comic URL `comic` to `path` using `threads` threads.
@@ -356,6 +933,8 @@ def download(
     :param `threads`: The number of threads to use
     :param `only_download_missing`: If `True`, do not download images
     already in the destination path
+    :param `process_ops`: Processing operations to run on each image as it is downloaded
+    :param `process_config`: Options for processing operations
     """
     for _ in download_progress(
         comic,
@@ -365,5 +944,283 @@ def download(
         threads=threads,
         only_download_missing=only_download_missing,
         raise_on_failed_download=raise_on_failed_download,
+        process_ops=process_ops,
+        process_config=process_config,
+    ):
+        pass
+
+
+def update_progress(
+    comic_path: Path | str,
+    *,
+    threads: int = 4,
+    convert_to: ConvertFormats = ConvertFormats.NONE,
+    dest_folder: Path | str | None = None,
+    raise_on_failed_download: bool = True,
+) -> Iterator[str | int]:
+    """
+    Download the chapters of the comic at `comic_path` that were released since
+    it was last downloaded. Only the chapter list is fetched from the source, and the
+    updated chapter list is saved to `md-metadata.json`.
+
+    :param `comic_path`: A folder where mandown has downloaded a comic
+    :param `threads`: The number of threads to use
+    :param `convert_to`: If set, also convert each new chapter into its own file
+    :param `dest_folder`: A folder to put converted chapters in (defaults to workdir)
+    :raises `ValueError` if the folder is not named after the comic's title slug
+
+    :returns An `Iterator` representing a progress bar. The first iteration returns the
+    number of new chapters, then the title of each chapter as it is downloaded. If
+    converting, the title of each chapter is yielded again as it is converted.
+    """
+    comic_path = Path(comic_path).resolve()
+    comic = load(comic_path)
+    if comic_path.name != comic.metadata.title_slug:
+        raise ValueError(
+            f"{comic_path} must be named {comic.metadata.title_slug} to download new chapters"
+        )
+
+    new_chapters = comic.fetch_new_chapters()
+
+    yield len(new_chapters)
+    if not new_chapters:
+        # still save renamed/removed chapters
+        io.save_comic(comic, comic_path)
+        return
+
+    yield from download_progress(
+        comic,
+        comic_path.parent,
+        threads=threads,
+        raise_on_failed_download=raise_on_failed_download,
+        chapters=new_chapters,
+    )
+
+    if convert_to != ConvertFormats.NONE:
+        for res in convert_progress(
+            comic_path,
+            convert_to,
+            dest_folder,
+            split_by_chapters=True,
+            only_chapters={chap.slug for chap in new_chapters},
+        ):
+            if isinstance(res, str):
+                yield res
+
+
+def update(
+    comic_path: Path | str,
+    *,
+    threads: int = 4,
+    convert_to: ConvertFormats = ConvertFormats.NONE,
+    dest_folder: Path | str | None = None,
+    raise_on_failed_download: bool = True,
+) -> None:
+    """
+    Download the chapters of the comic at `comic_path` that were released since
+    it was last downloaded. See `update_progress`.
+
+    :param `comic_path`: A folder where mandown has downloaded a comic
+    :param `threads`: The number of threads to use
+    :param `convert_to`: If set, also convert each new chapter into its own file
+    :param `dest_folder`: A folder to put converted chapters in (defaults to workdir)
+    """
+    for _ in update_progress(
+        comic_path,
+        threads=threads,
+        convert_to=convert_to,
+        dest_folder=dest_folder,
+        raise_on_failed_download=raise_on_failed_download,
+    ):
+        pass
+
+
+def sync_progress(
+    comic_path: Path | str,
+    *,
+    threads: int = 4,
+    raise_on_failed_download: bool = True,
+) -> Iterator[str | int]:
+    """
+    Re-download the chapters of the comic at `comic_path` whose image lists changed
+    on the source since they were downloaded, such as when a chapter is re-uploaded with
+    more or fixed pages. Changes are detected by comparing each chapter's stored
+    fingerprint (see `mandown.base.fingerprint_images`) with that of a fresh image list.
+
+    Changed chapters are downloaded into a staging folder which then replaces the old
+    chapter folder, so a failed download never leaves a chapter half-replaced.
+    Chapters downloaded before fingerprints were recorded are assumed to be up to date
+    if every image on the source was downloaded, ignoring pages split off by processing.
+
+    :param `comic_path`: A folder where mandown has downloaded a comic
+    :param `threads`: The number of threads to use
+
+    :returns An `Iterator` representing a progress bar. The first iteration returns the
+    number of chapters, then the title of each chapter as it is checked.
+    """
+    comic_path = Path(comic_path)
+    comic = load(comic_path)
+
+    yield len(comic.chapters)
+    library = Library.find(comic_path)
+    try:
+        for chap in comic.chapters:
+            yield chap.title
+            image_urls = comic.get_chapter_image_urls(chap)
+            fingerprint = fingerprint_images(image_urls)
+            if fingerprint == chap.fingerprint:
+                continue
+
+            chapter_path = comic_path / chap.slug
+            # pages split off by processing are not counted, like when downloading
+            if (
+                not chap.fingerprint
+                and chapter_path.is_dir()
+                and _downloaded_images(chapter_path) == set(range(1, len(image_urls) + 1))
+            ):
+                chap.fingerprint = fingerprint
+                continue
+
+            staging_path = comic_path / f".{chap.slug}.staging"
+            shutil.rmtree(staging_path, ignore_errors=True)
+            for _ in io.download_images(
+                image_urls,
+                staging_path,
+                headers=comic.source.headers,
+                filestems=[
+                    str(i).rjust(io.NUM_LEFT_PAD_DIGITS, "0") for i in range(1, len(image_urls) + 1)
+                ],
+                threads=threads,
+            ):
+                pass
+
+            if (count := len(list(staging_path.iterdir()))) != len(image_urls):
+                shutil.rmtree(staging_path)
+                if raise_on_failed_download:
+                    raise ImageDownloadError(
+                        f"Failed to download {len(image_urls) - count} images of {chap.title}"
+                    )
+                continue
+
+            io.replace_folder(staging_path, chapter_path)
+            chap.fingerprint = fingerprint
+
+            if library is not None:
+                library.update_chapter(comic_path, chap.slug, count)
+    finally:
+        io.save_comic(comic, comic_path)
+        if library is not None:
+            library.close()
+
+
+def sync(
+    comic_path: Path | str,
+    *,
+    threads: int = 4,
+    raise_on_failed_download: bool = True,
+) -> None:
+    """
+    Re-download the chapters of the comic at `comic_path` whose image lists changed
+    on the source since they were downloaded. See `sync_progress`.
+
+    :param `comic_path`: A folder where mandown has downloaded a comic
+    :param `threads`: The number of threads to use
+    """
+    for _ in sync_progress(
+        comic_path, threads=threads, raise_on_failed_download=raise_on_failed_download
     ):
         pass
+
+
+def batch_download_progress(
+    urls: list[str],
+    path: Path | str = ".",
+    *,
+    series_threads: int = 4,
+    host_threads: int = 4,
+    threads: int = 8,
+    only_download_missing: bool = True,
+    raise_on_failed_download: bool = True,
+    state_file: Path | str | None = None,
+) -> Iterator[tuple[str, str | None]]:
+    """
+    Download many comic URLs to `path` at once. The images of every comic are downloaded
+    by one shared pool of `threads` threads over one shared connection pool, which
+    sends at most `host_threads` requests to the same host at once. Pages and image
+    lists are fetched by each comic's source on its own connections.
+
+    Progress is checkpointed to `state_file` (defaults to `<path>/md-batch.json`) after
+    each comic finishes, and comics already downloaded by an interrupted run are skipped.
+
+    :param `urls`: The comic URLs to download
+    :param `path`: A folder to download the comics to
+    :param `series_threads`: The maximum number of comics to download at once
+    :param `host_threads`: The maximum number of images to download at once from the same
+    host, such as an image CDN shared by many comics
+    :param `threads`: The number of threads to download images with, shared by all comics
+    :param `only_download_missing`: If `True`, do not download
+    images already in the destination path
+    :param `state_file`: The file to checkpoint progress to
+
+    :returns An `Iterator` yielding each URL when it finishes, with an error message
+    if it failed or `None` if it succeeded. URLs finished in a previous run are not yielded.
+    """
+    path = Path(path)
+    state = batch.BatchState.load(state_file or path / batch.BATCH_STATE_FILE)
+    remaining = [url for url in urls if url not in state.done]
+
+    session = batch.create_session(threads, host_threads)
+    with ThreadPoolExecutor(threads) as executor, session:
+
+        def download_one(url: str) -> None:
+            for _ in download_progress(
+                url,
+                path,
+                only_download_missing=only_download_missing,
+                raise_on_failed_download=raise_on_failed_download,
+                executor=executor,
+                session=session,
+            ):
+                pass
+
+        for url, err in batch.schedule(
+            remaining,
+            download_one,
+            max_jobs=series_threads,
+            # the images, which are most of the load, are limited by their host instead
+            max_jobs_per_host=series_threads,
+        ):
+            state.mark(url, err)
+            yield url, err
+
+
+def batch_download(
+    urls: list[str],
+    path: Path | str = ".",
+    *,
+    series_threads: int = 4,
+    host_threads: int = 4,
+    threads: int = 8,
+    only_download_missing: bool = True,
+    raise_on_failed_download: bool = True,
+    state_file: Path | str | None = None,
+) -> dict[str, str]:
+    """
+    Download many comic URLs to `path` at once. See `batch_download_progress`.
+
+    :returns A dictionary of the URLs that failed to download and why
+    """
+    failed: dict[str, str] = {}
+    for url, err in batch_download_progress(
+        urls,
+        path,
+        series_threads=series_threads,
+        host_threads=host_threads,
+        threads=threads,
+        only_download_missing=only_download_missing,
+        raise_on_failed_download=raise_on_failed_download,
+        state_file=state_file,
+    ):
+        if err is not None:
+            failed[url] = err
+    return failed
@@ -1,9 +1,35 @@
+import hashlib
+import urllib.parse
 from dataclasses import dataclass
+from functools import lru_cache
+from itertools import pairwise
+from typing import Iterable, Iterator, Sequence, overload
 
 from comicon import SLUGIFY_ARGS
 from slugify import slugify
 
 
+@lru_cache(maxsize=4096)
+def slugify_title(title: str) -> str:
+    """
+    Return the filesystem slug of a comic or chapter title.
+    """
+    return slugify(title, **SLUGIFY_ARGS).strip()
+
+
+def fingerprint_images(image_urls: Iterable[str]) -> str:
+    """
+    Return a short fingerprint of a chapter's image list: the number of images
+    and a hash of their file names. Hosts, directories and query strings are ignored
+    because sources often rotate them (e.g. CDN nodes or signed URLs) for the same images.
+
+    :param `image_urls`: The image URLs of a chapter, in order
+    """
+    names = [urllib.parse.urlparse(url).path.rsplit("/", 1)[-1] for url in image_urls]
+    digest = hashlib.sha1("\n".join(names).encode("utf-8")).hexdigest()[:16]
+    return f"{len(names)}-{digest}"
+
+
 @dataclass(slots=True)
 class BaseMetadata:
     """
@@ -27,7 +53,7 @@ class BaseMetadata:
     title_slug: str = ""
 
     def __post_init__(self) -> None:
-        self.title_slug = slugify(self.title, **SLUGIFY_ARGS).strip()
+        self.title_slug = slugify_title(self.title)
 
     def asdict(self) -> dict[str, str | list[str]]:
         """
@@ -52,36 +78,242 @@ class BaseChapter:
     :param `title`: The title of the chapter
     :param `url`: The URL of the chapter
     :param `slug`: The slug of the chapter
+    :param `fingerprint`: The fingerprint of the downloaded images (see `fingerprint_images`)
     """
 
     title: str
     url: str
     slug: str = ""
+    fingerprint: str = ""
 
     def __post_init__(self) -> None:
         if not self.slug:
-            self.slug = slugify(self.title, **SLUGIFY_ARGS).strip()
+            self.slug = slugify_title(self.title)
 
     def asdict(self) -> dict:
         """
         Return a dictionary representation of the chapter.
         """
-        return {
+        data = {
             "title": self.title,
             "url": self.url,
             "slug": self.slug,
         }
+        if self.fingerprint:
+            data["fingerprint"] = self.fingerprint
+        return data
 
     @staticmethod
     def sync_slug_order(
-        chapters: list["BaseChapter"],
+        chapters: "list[BaseChapter] | ChapterIndex",
     ) -> None:
         """
         Given a list of chapters, prefix their slugs with their index in the list if they are not
         already sorted. This is useful for sorting chapters in a comic.
         """
-        if sorted(chapters, key=lambda c: c.slug) == chapters:
+        if isinstance(chapters, ChapterIndex):
+            chapters.sync_slug_order()
+            return
+
+        if all(prev.slug <= cur.slug for prev, cur in pairwise(chapters)):
             # already sorted, no need to prefix
             return
         for i, chapter in enumerate(chapters, start=1):
             chapter.slug = f"{i:05}. {chapter.slug}"
+
+
+class _ChapterColumns:
+    """
+    The parallel lists behind a `ChapterIndex`, shared by the index and its slices.
+    """
+
+    __slots__ = ("titles", "urls", "slugs", "fingerprints", "chapters", "unordered")
+
+    def __init__(
+        self, titles: list[str], urls: list[str], slugs: list[str], fingerprints: list[str]
+    ) -> None:
+        self.titles = titles
+        self.urls = urls
+        self.slugs = slugs
+        self.fingerprints = fingerprints
+        self.chapters: list[BaseChapter | None] = [None] * len(titles)
+        # rows whose slug order still has to be synced, see `ChapterIndex.sync_slug_order`
+        self.unordered: range | None = None
+
+    def slug(self, row: int) -> str:
+        """
+        Return the slug of the chapter in `row`, computing it from the title if it was
+        not stored.
+        """
+        if self.unordered is not None:
+            self.sync_slug_order()
+
+        chapter = self.chapters[row]
+        if chapter is not None:
+            return chapter.slug
+        if not self.slugs[row]:
+            self.slugs[row] = slugify_title(self.titles[row])
+        return self.slugs[row]
+
+    def sync_slug_order(self) -> None:
+        """
+        Prefix the slugs of the unordered rows with their position if they are not
+        already sorted.
+        """
+        rows, self.unordered = self.unordered, None
+        if rows is None:
+            return
+
+        slugs = [self.slug(row) for row in rows]
+        if all(prev <= cur for prev, cur in pairwise(slugs)):
+            return
+
+        for i, (row, slug) in enumerate(zip(rows, slugs, strict=True)):
+            new_slug = f"{i + 1:05}. {slug}"
+            self.slugs[row] = new_slug
+            if (chapter := self.chapters[row]) is not None:
+                chapter.slug = new_slug
+
+
+class ChapterIndex(Sequence[BaseChapter]):
+    """
+    A compact, read-mostly list of chapters backed by parallel lists of titles,
+    URLs and slugs. `BaseChapter` objects are only created when a chapter is
+    accessed, and missing slugs are only computed when they are needed.
+
+    Chapters returned by indexing are cached, so modifying them modifies the index.
+    Slices are views of the same lists, so they share their chapters with the index
+    and are created without copying anything.
+
+    :param `titles`: The titles of the chapters
+    :param `urls`: The URLs of the chapters
+    :param `slugs`: The slugs of the chapters, or empty strings to derive them from the title
+    :param `fingerprints`: The fingerprints of the chapters, or empty strings if unknown
+    """
+
+    __slots__ = ("_columns", "_rows")
+
+    def __init__(
+        self,
+        titles: list[str],
+        urls: list[str],
+        slugs: list[str],
+        fingerprints: list[str] | None = None,
+    ) -> None:
+        fingerprints = fingerprints if fingerprints is not None else [""] * len(titles)
+        if not len(titles) == len(urls) == len(slugs) == len(fingerprints):
+            raise ValueError("titles, urls, slugs and fingerprints must be the same length")
+
+        self._columns = _ChapterColumns(titles, urls, slugs, fingerprints)
+        self._rows = range(len(titles))
+
+    @classmethod
+    def from_dicts(cls, data: Iterable[dict[str, str]]) -> "ChapterIndex":
+        """
+        Create an index from chapter dictionaries such as those in `md-metadata.json`.
+        """
+        data = list(data)
+        return cls(
+            [c["title"] for c in data],
+            [c["url"] for c in data],
+            [c.get("slug", "") for c in data],
+            [c.get("fingerprint", "") for c in data],
+        )
+
+    @classmethod
+    def from_chapters(cls, chapters: Iterable[BaseChapter]) -> "ChapterIndex":
+        """
+        Create an index from existing chapters.
+        """
+        return cls.from_dicts(c.asdict() for c in chapters)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @overload
+    def __getitem__(self, i: int) -> BaseChapter: ...
+
+    @overload
+    def __getitem__(self, i: slice) -> "ChapterIndex": ...
+
+    def __getitem__(self, i: int | slice) -> "BaseChapter | ChapterIndex":
+        if isinstance(i, slice):
+            index = ChapterIndex.__new__(ChapterIndex)
+            index._columns = self._columns
+            index._rows = self._rows[i]
+            return index
+
+        row = self._rows[i]
+        columns = self._columns
+        if columns.unordered is not None:
+            columns.sync_slug_order()
+        chapter = columns.chapters[row]
+        if chapter is None:
+            chapter = BaseChapter(
+                columns.titles[row], columns.urls[row], columns.slug(row), columns.fingerprints[row]
+            )
+            columns.chapters[row] = chapter
+        return chapter
+
+    def __iter__(self) -> Iterator[BaseChapter]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def title(self, i: int) -> str:
+        """
+        Return the title of the chapter at index `i` without creating a `BaseChapter`.
+        """
+        row = self._rows[i]
+        chapter = self._columns.chapters[row]
+        return self._columns.titles[row] if chapter is None else chapter.title
+
+    def url(self, i: int) -> str:
+        """
+        Return the URL of the chapter at index `i` without creating a `BaseChapter`.
+        """
+        row = self._rows[i]
+        chapter = self._columns.chapters[row]
+        return self._columns.urls[row] if chapter is None else chapter.url
+
+    def slug(self, i: int) -> str:
+        """
+        Return the slug of the chapter at index `i` without creating a `BaseChapter`,
+        computing it from the title if it was not stored.
+        """
+        return self._columns.slug(self._rows[i])
+
+    def slugs(self) -> list[str]:
+        """
+        Return the slugs of every chapter.
+        """
+        return [self._columns.slug(row) for row in self._rows]
+
+    def asdicts(self) -> list[dict]:
+        """
+        Return a list of dictionary representations of the chapters.
+        """
+        columns = self._columns
+        dicts: list[dict] = []
+        for row in self._rows:
+            slug = columns.slug(row)
+            if (chapter := columns.chapters[row]) is not None:
+                dicts.append(chapter.asdict())
+                continue
+
+            data = {"title": columns.titles[row], "url": columns.urls[row], "slug": slug}
+            if columns.fingerprints[row]:
+                data["fingerprint"] = columns.fingerprints[row]
+            dicts.append(data)
+        return dicts
+
+    def sync_slug_order(self) -> None:
+        """
+        Prefix slugs with their position if they are not already sorted.
+        See `BaseChapter.sync_slug_order`.
+
+        Slugs are only checked once one of them is needed, so that loading a comic
+        does not compute every missing slug.
+        """
+        # an earlier request might cover other rows, so it is finished first
+        self._columns.sync_slug_order()
+        self._columns.unordered = self._rows
@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import urllib.parse
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import requests
+from requests.adapters import HTTPAdapter
+
+BATCH_STATE_FILE = "md-batch.json"
+
+
+def read_url_list(path: Path | str) -> list[str]:
+    """
+    Read a file of URLs, one per line. Blank lines and lines starting with `#` are ignored.
+
+    :param `path`: The file to read
+    :returns A list of URLs in the order they appear, without duplicates
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        lines = (line.strip() for line in file)
+        return list(dict.fromkeys(line for line in lines if line and not line.startswith("#")))
+
+
+@dataclass(slots=True)
+class BatchState:
+    """
+    The checkpointed state of a batch download, so an interrupted batch can resume.
+
+    :param `path`: The file the state is saved to
+    :param `done`: URLs that were downloaded successfully
+    :param `failed`: URLs that failed to download, and why
+    """
+
+    path: Path
+    done: set[str] = field(default_factory=set)
+    failed: dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: Path | str) -> "BatchState":
+        """
+        Load the state from `path`, or start a new one if it does not exist.
+        """
+        path = Path(path)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return cls(path)
+        return cls(path, set(data["done"]), data["failed"])
+
+    def save(self) -> None:
+        """
+        Atomically write the state to disk.
+        """
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({"done": sorted(self.done), "failed": self.failed}, file)
+        os.replace(tmp_path, self.path)
+
+    def mark(self, url: str, error: str | None) -> None:
+        """
+        Record the result of a download and save the state.
+
+        :param `url`: The URL that finished
+        :param `error`: Why the download failed, or `None` if it succeeded
+        """
+        if error is None:
+            self.done.add(url)
+            self.failed.pop(url, None)
+        else:
+            self.failed[url] = error
+        self.save()
+
+
+class _HostLimitAdapter(HTTPAdapter):
+    """
+    A transport adapter that sends at most `max_per_host` requests to the same host
+    at once, however many threads share it.
+    """
+
+    def __init__(self, max_per_host: int, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.max_per_host = max_per_host
+        self._lock = threading.Lock()
+        self._host_limits: dict[str, threading.BoundedSemaphore] = {}
+
+    def send(self, request: requests.PreparedRequest, **kwargs: Any) -> requests.Response:
+        host = urllib.parse.urlparse(request.url).netloc
+        with self._lock:
+            limit = self._host_limits.get(host)
+            if limit is None:
+                limit = self._host_limits[host] = threading.BoundedSemaphore(self.max_per_host)
+        with limit:
+            return super().send(request, **kwargs)
+
+
+def create_session(max_connections: int, max_per_host: int | None = None) -> requests.Session:
+    """
+    Create a session whose connection pool can serve `max_connections` threads at once.
+
+    :param `max_connections`: The number of threads that share the session
+    :param `max_per_host`: If set, the maximum number of requests sent to the same host
+    at once, such as an image CDN that serves many comics
+    """
+    session = requests.Session()
+    adapter = (
+        HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        if max_per_host is None
+        else _HostLimitAdapter(
+            max_per_host, pool_connections=max_connections, pool_maxsize=max_connections
+        )
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def schedule(
+    urls: list[str],
+    job: Callable[[str], None],
+    *,
+    max_jobs: int,
+    max_jobs_per_host: int,
+) -> Iterator[tuple[str, str | None]]:
+    """
+    Run `job` on every URL in `urls` with at most `max_jobs` running at once, and at most
+    `max_jobs_per_host` of those for the same host. URLs start in order whenever a slot
+    for their host is free, so one slow host does not hold up the others.
+
+    :returns An `Iterator` yielding each URL and the error it raised (or `None`)
+    as soon as its job finishes.
+    :raises `ValueError` if either limit is less than one
+    """
+    if max_jobs < 1 or max_jobs_per_host < 1:
+        raise ValueError("Concurrency limits must be at least 1")
+
+    pending = list(urls)
+    running: dict[Future[None], str] = {}
+    host_counts = Counter[str]()
+
+    def host_of(url: str) -> str:
+        return urllib.parse.urlparse(url).netloc
+
+    with ThreadPoolExecutor(max_jobs) as executor:
+        while pending or running:
+            # start every pending job whose host has capacity, in order
+            for url in list(pending):
+                if len(running) >= max_jobs:
+                    break
+                if host_counts[host_of(url)] >= max_jobs_per_host:
+                    continue
+                pending.remove(url)
+                host_counts[host_of(url)] += 1
+                running[executor.submit(job, url)] = url
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = running.pop(future)
+                host_counts[host_of(url)] -= 1
+
+                err = future.exception()
+                yield url, None if err is None else f"{type(err).__name__}: {err}"
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import os
+import zipfile
 from pathlib import Path
 from typing import cast
 
@@ -21,9 +23,14 @@ from . import (
     api,
     sources,
 )
+from .batch import read_url_list
 from .errors import ImageDownloadError
+from .library import LIBRARY_FILE, Library
+from .processor import COMIC_PROCESS_OPS, check_operations
 
 app = typer.Typer()
+library_app = typer.Typer(no_args_is_help=True)
+app.add_typer(library_app, name="library", help="Index and query a folder of downloaded comics.")
 
 
 def cli_init_metadata_interactive() -> None:
@@ -146,17 +153,28 @@ def cli_query(url: str) -> BaseComic:
 
 def cli_convert(
     comic_path: Path,
-    target_format: ConvertFormats,
+    target_formats: list[ConvertFormats],
     dest_folder: Path = Path.cwd(),
     remove_after: bool = False,
     split_by_chapters: bool = False,
+    jobs: int | None = None,
+    rebuild: bool = False,
+    force: bool = False,
 ) -> None:
     comic = api.load(comic_path)
     iterator = api.convert_progress(
-        comic_path, target_format, dest_folder, remove_after, split_by_chapters
+        comic_path,
+        target_formats,
+        dest_folder,
+        remove_after,
+        split_by_chapters,
+        jobs=jobs,
+        incremental=not rebuild,
+        force=force,
     )
 
     is_single_conversion = comic_path.is_dir()
+    format_names = ", ".join(to.value for to in target_formats)
 
     try:
         len_first_conv = cast(int, next(iterator))
@@ -177,7 +195,7 @@ def cli_convert(
     len_second_conv = -1
 
     first_convert_message = (
-        f"Packing {target_format.value}(s)" if is_single_conversion else "Pre-converting comic"
+        f"Packing {format_names}(s)" if is_single_conversion else "Pre-converting comic"
     )
 
     try:
@@ -203,7 +221,7 @@ def cli_convert(
             with typer.progressbar(
                 iterator,
                 length=len_second_conv,
-                label=f"Packing {target_format.value}",
+                label=f"Packing {format_names}",
             ) as progress:
                 for _ in progress:
                     ...
@@ -213,16 +231,27 @@ def cli_convert(
             raise typer.Abort() from None
 
     if not split_by_chapters:
-        dest_file = dest_folder / f"{comic.metadata.title_slug}.{target_format.value}"
-        typer.secho(f"Successfully converted to {dest_file}", fg=typer.colors.GREEN)
+        dest_files = ", ".join(
+            str(dest_folder / f"{comic.metadata.title_slug}.{to.value}") for to in target_formats
+        )
+        if is_single_conversion and len_first_conv == 0:
+            typer.secho(f"{dest_files} already up to date", fg=typer.colors.GREEN)
+        else:
+            typer.secho(f"Successfully converted to {dest_files}", fg=typer.colors.GREEN)
     else:
         typer.secho(f"Successfully converted to {dest_folder}", fg=typer.colors.GREEN)
 
 
-def cli_process(comic_path: Path, options: list[ProcessOps], config: ProcessConfig) -> None:
+def cli_process(
+    comic_path: Path, options: list[ProcessOps], config: ProcessConfig, jobs: int | None = None
+) -> None:
     if ProcessOps.NO_POSTPROCESSING in options:
         return
 
+    if comic_path.is_file():
+        cli_process_archive(comic_path, options, config, jobs)
+        return
+
     try:
         comic = api.load(comic_path)
     except FileNotFoundError as err:
@@ -235,7 +264,7 @@ def cli_process(comic_path: Path, options: list[ProcessOps], config: ProcessConf
     typer.secho(f"Applying processing options: {', '.join(options)}", fg=typer.colors.GREEN)
     try:
         with typer.progressbar(
-            api.process_progress(comic_path, options, config),
+            api.process_progress(comic_path, options, config, jobs),
             length=len(comic.chapters),
             label="Processing",
         ) as progress:
@@ -246,9 +275,24 @@ def cli_process(comic_path: Path, options: list[ProcessOps], config: ProcessConf
         raise typer.Exit(1) from err
 
 
+def cli_process_archive(
+    archive_path: Path, options: list[ProcessOps], config: ProcessConfig, jobs: int | None = None
+) -> None:
+    typer.secho(f"Applying processing options: {', '.join(options)}", fg=typer.colors.GREEN)
+    try:
+        progress_iter = api.process_archive_progress(archive_path, options, config, jobs=jobs)
+        num_images = cast(int, next(progress_iter))
+        with typer.progressbar(progress_iter, length=num_images, label="Processing") as progress:
+            for _ in progress:
+                pass
+    except (ProcessOptionMismatchError, zipfile.BadZipFile) as err:
+        typer.secho(f"Could not process {archive_path}: {err}", fg=typer.colors.RED)
+        raise typer.Exit(1) from err
+
+
 @app.command(no_args_is_help=True)
 def convert(
-    convert_to: ConvertFormats,
+    convert_to: list[ConvertFormats],
     folder_path: Path,
     dest: Path = typer.Option(
         Path.cwd(),
@@ -269,6 +313,27 @@ def convert(
         help="Instead of returning one large comic file, create one comic"
         "file for each chapter (applies only to Mandown-created comic folders)",
     ),
+    jobs: int | None = typer.Option(
+        None,
+        "--jobs",
+        "-j",
+        min=1,
+        show_default=False,
+        help="SPLIT BY CHAPTERS ONLY: The number of chapters to convert in parallel"
+        " [default: number of CPUs]",
+    ),
+    rebuild: bool = typer.Option(
+        False,
+        "--rebuild",
+        help="Convert the whole comic again instead of appending new chapters"
+        " to a CBZ or EPUB that was converted before",
+    ),
+    force: bool = typer.Option(
+        False,
+        "--force",
+        "-f",
+        help="Convert the comic even if nothing changed since it was last converted",
+    ),
 ) -> None:
     """
     Convert a comic OR comic folder into CBZ/EPUB/PDF.
@@ -276,11 +341,16 @@ def convert(
     eg. To convert to CBZ:
     mandown convert cbz /path/to/comic/folder
 
+    eg. To convert to CBZ and EPUB at once:
+    mandown convert cbz epub /path/to/comic/folder
+
     eg. To convert an existing PDF comic to EPUB:
     mandown convert epub /path/to/comic.pdf
     """
-    typer.echo(f"Converting to {convert_to}...")
-    cli_convert(folder_path, convert_to, dest, remove_after, split_by_chapters)
+    typer.echo(f"Converting to {', '.join(to.value for to in convert_to)}...")
+    cli_convert(
+        folder_path, convert_to, dest, remove_after, split_by_chapters, jobs, rebuild, force
+    )
 
 
 @app.command(no_args_is_help=True)
@@ -295,15 +365,55 @@ def process(
         show_default=False,
         help="RESIZE ONLY: The target size (width, height) (cannot be used with `profile`)",
     ),
-    size_profile: str | None = typer.Option(
-        None,
+    size_profiles: list[str] = typer.Option(
+        [],
         "--profile",
         "-o",
-        help="RESIZE ONLY: The device profile to use (cannot be used with `target-size`)",
+        show_default=False,
+        help="RESIZE ONLY: The device profile to use (cannot be used with `target-size`)."
+        " If given more than once, a copy of the comic is written next to it for each profile",
+    ),
+    jobs: int | None = typer.Option(
+        None,
+        "--jobs",
+        "-j",
+        min=1,
+        show_default=False,
+        help="The number of images to process in parallel [default: number of CPUs]",
+    ),
+    jpeg_quality: int = typer.Option(
+        75, "--jpeg-quality", min=1, max=95, help="The quality of written JPEG images"
+    ),
+    jpeg_progressive: bool = typer.Option(
+        False, "--progressive", help="Write progressive JPEG images"
+    ),
+    jpeg_optimize: bool = typer.Option(
+        False, "--optimize", help="Spend longer encoding JPEG images to make them smaller"
+    ),
+    png_compress_level: int = typer.Option(
+        6, "--png-compress-level", min=0, max=9, help="The compression level of written PNG images"
+    ),
+    webp_quality: int = typer.Option(
+        80, "--webp-quality", min=1, max=100, help="The quality of written WEBP images"
+    ),
+    grayscale: bool | None = typer.Option(
+        None,
+        "--grayscale/--color",
+        show_default=False,
+        help="Convert images to grayscale [default: if the profile's device is grayscale]",
+    ),
+    grayscale_levels: int = typer.Option(
+        256, "--gray-levels", min=2, max=256, help="The number of shades of gray to keep"
+    ),
+    max_page_repeats: int = typer.Option(
+        3,
+        "--max-repeats",
+        min=1,
+        help="DROP_DUPLICATE_PAGES ONLY: The number of chapters a page can appear in",
     ),
 ) -> None:
     """
-    Process a comic folder in-place.
+    Process a comic folder (or the images in a CBZ file) in-place.
 
     eg. To trim borders and resize to 800x1200:
     mandown process trim_borders resize -z 800 1200
@@ -311,23 +421,37 @@ def process(
     eg. To split double pages and resize to a Kindle Paperwhite 2 profile:
     mandown process split_double_pages resize -o paper
 
+    eg. To write copies resized for both a Kindle Paperwhite 2 and a Kobo Aura:
+    mandown process trim_borders resize -o paper -o aura
+
     All profiles can be listed with "mandown --list-profiles".
     """
     # work around typer bug (see mandown get)
     if target_size == (0, 0):
         target_size = None
 
-    size_profile = cast(SupportedProfiles | None, size_profile)
+    profiles = cast(list[SupportedProfiles], size_profiles)
+    size_profile = profiles[0] if len(profiles) == 1 else None
+    output_profiles = tuple(profiles) if len(profiles) > 1 else ()
 
     try:
         config = ProcessConfig(
             target_size=target_size,
             output_profile=size_profile,
+            output_profiles=output_profiles,
+            jpeg_quality=jpeg_quality,
+            jpeg_optimize=jpeg_optimize,
+            jpeg_progressive=jpeg_progressive,
+            png_compress_level=png_compress_level,
+            webp_quality=webp_quality,
+            grayscale=grayscale,
+            grayscale_levels=grayscale_levels,
+            max_page_repeats=max_page_repeats,
         )
     except Exception as err:
         typer.secho(f"Could not apply processing options: {err}", fg=typer.colors.RED)
         raise typer.Exit(1) from err
-    cli_process(folder_path, options, config)
+    cli_process(folder_path, options, config, jobs)
 
 
 @app.command(no_args_is_help=True)
@@ -356,7 +480,7 @@ def get(
         [],
         "--process",
         "-p",
-        help="Image processing options (in-place)",
+        help="Image processing options (applied to images as they are downloaded)",
         case_sensitive=True,
     ),
     target_size: tuple[int, int] | None = typer.Option(
@@ -373,6 +497,64 @@ def get(
         "-o",
         help="IF PROCESSING AND RESIZING: The device profile to use",
     ),
+    jobs: int | None = typer.Option(
+        None,
+        "--jobs",
+        "-j",
+        min=1,
+        show_default=False,
+        help="IF PROCESSING: The number of images to download and process in parallel"
+        " [default: number of CPUs]",
+    ),
+    jpeg_quality: int = typer.Option(
+        75,
+        "--jpeg-quality",
+        min=1,
+        max=95,
+        help="IF PROCESSING: The quality of written JPEG images",
+    ),
+    jpeg_progressive: bool = typer.Option(
+        False, "--progressive", help="IF PROCESSING: Write progressive JPEG images"
+    ),
+    jpeg_optimize: bool = typer.Option(
+        False,
+        "--optimize",
+        help="IF PROCESSING: Spend longer encoding JPEG images to make them smaller",
+    ),
+    png_compress_level: int = typer.Option(
+        6,
+        "--png-compress-level",
+        min=0,
+        max=9,
+        help="IF PROCESSING: The compression level of written PNG images",
+    ),
+    webp_quality: int = typer.Option(
+        80,
+        "--webp-quality",
+        min=1,
+        max=100,
+        help="IF PROCESSING: The quality of written WEBP images",
+    ),
+    grayscale: bool | None = typer.Option(
+        None,
+        "--grayscale/--color",
+        show_default=False,
+        help="IF PROCESSING: Convert images to grayscale"
+        " [default: if the profile's device is grayscale]",
+    ),
+    grayscale_levels: int = typer.Option(
+        256,
+        "--gray-levels",
+        min=2,
+        max=256,
+        help="IF PROCESSING: The number of shades of gray to keep",
+    ),
+    max_page_repeats: int = typer.Option(
+        3,
+        "--max-repeats",
+        min=1,
+        help="DROP_DUPLICATE_PAGES ONLY: The number of chapters a page can appear in",
+    ),
     remove_after: bool = typer.Option(
         False,
         "--remove-after",
@@ -413,6 +595,33 @@ def get(
 
     size_profile = cast(SupportedProfiles | None, size_profile)
 
+    # process while downloading, so every image is only decoded and written once
+    process_ops: list[ProcessOps] = []
+    config: ProcessConfig | None = None
+    if processing_options and ProcessOps.NO_POSTPROCESSING not in processing_options:
+        try:
+            config = ProcessConfig(
+                target_size=target_size,
+                output_profile=size_profile,
+                jpeg_quality=jpeg_quality,
+                jpeg_optimize=jpeg_optimize,
+                jpeg_progressive=jpeg_progressive,
+                png_compress_level=png_compress_level,
+                webp_quality=webp_quality,
+                grayscale=grayscale,
+                grayscale_levels=grayscale_levels,
+                max_page_repeats=max_page_repeats,
+            )
+            check_operations(processing_options, config)
+        except Exception as err:
+            typer.secho(f"Could not apply processing options: {err}", fg=typer.colors.RED)
+            raise typer.Exit(1) from err
+
+        process_ops = processing_options
+        # processing is CPU-bound, so use as many download processes as processing jobs
+        maxthreads = max(maxthreads, jobs or os.cpu_count() or 1)
+        typer.secho(f"Applying processing options: {', '.join(process_ops)}", fg=typer.colors.GREEN)
+
     # get and save metadata
     comic = cli_query(url)
 
@@ -433,7 +642,13 @@ def get(
     typer.echo(f"Downloading {end_chapter - start_chapter} chapter(s)...")
     try:
         with typer.progressbar(
-            api.download_progress(comic, dest, threads=maxthreads),
+            api.download_progress(
+                comic,
+                dest,
+                threads=maxthreads,
+                process_ops=process_ops,
+                process_config=config,
+            ),
             length=len(comic.chapters),
         ) as progress:
             for title in progress:
@@ -452,30 +667,155 @@ def get(
         fg=typer.colors.GREEN,
     )
 
-    # process
-    if processing_options:
-        try:
-            config = ProcessConfig(
-                target_size=target_size,
-                output_profile=size_profile,
-            )
-        except Exception as err:
-            typer.secho(f"Could not apply processing options: {err}", fg=typer.colors.RED)
-            raise typer.Exit(1) from err
-
-        cli_process(dest / comic.metadata.title_slug, processing_options, config)
+    # operations on the whole comic need every chapter, so they run after downloading.
+    # Images processed while downloading are skipped
+    if config is not None and COMIC_PROCESS_OPS.intersection(process_ops):
+        cli_process(dest / comic.metadata.title_slug, process_ops, config, jobs)
 
     # convert
     if convert_to != ConvertFormats.NONE:
         cli_convert(
             dest / comic.metadata.title_slug,
-            convert_to,
+            [convert_to],
             dest,
             remove_after,
             split_by_chapters,
         )
 
 
+@app.command(no_args_is_help=True)
+def update(
+    folder_path: Path,
+    dest: Path = typer.Option(
+        Path.cwd(),
+        "--dest",
+        "-d",
+        help="IF CONVERTING: The folder to save converted chapters to.",
+    ),
+    convert_to: ConvertFormats = typer.Option(
+        "none", "--convert", "-c", help="Convert each new chapter into its own file"
+    ),
+    maxthreads: int = typer.Option(
+        4,
+        "--threads",
+        "-t",
+        help="The maximum number of images to download in parallel",
+    ),
+    sync: bool = typer.Option(
+        False,
+        "--sync",
+        "-y",
+        help="Also check every existing chapter for changed images and re-download them",
+    ),
+) -> None:
+    """
+    Download the chapters of a downloaded comic that were released since it was last
+    downloaded, without downloading anything else again.
+
+    eg. To download new chapters and convert each of them to EPUB:
+    mandown update /path/to/comic -c epub
+
+    eg. To also re-download chapters that were re-uploaded with different pages:
+    mandown update /path/to/comic --sync
+    """
+    try:
+        iterator = api.update_progress(
+            folder_path, threads=maxthreads, convert_to=convert_to, dest_folder=dest
+        )
+        num_new = cast(int, next(iterator))
+    except FileNotFoundError as err:
+        typer.secho(
+            f"Comic not found at {folder_path}, is md-metadata.json missing?",
+            fg=typer.colors.RED,
+        )
+        raise typer.Exit(1) from err
+    except ValueError as err:
+        typer.secho(str(err), fg=typer.colors.RED)
+        raise typer.Exit(1) from err
+
+    try:
+        if num_new:
+            typer.echo(f"Downloading {num_new} new chapter(s)...")
+            with typer.progressbar(
+                iterator,
+                length=num_new * (1 if convert_to == ConvertFormats.NONE else 2),
+            ) as progress:
+                for title in progress:
+                    progress.label = str(title)
+            typer.secho(f"Successfully downloaded {num_new} new chapter(s).", fg=typer.colors.GREEN)
+        else:
+            typer.secho("No new chapters found.", fg=typer.colors.GREEN)
+
+        if sync:
+            iterator = api.sync_progress(folder_path, threads=maxthreads)
+            with typer.progressbar(
+                iterator, length=cast(int, next(iterator)), label="Checking chapters"
+            ) as progress:
+                for title in progress:
+                    progress.label = str(title)
+            typer.secho("All chapters are up to date.", fg=typer.colors.GREEN)
+    except ImageDownloadError as err:
+        typer.secho(f"Error: {err}", fg=typer.colors.RED)
+        raise typer.Abort(3) from err
+
+
+@app.command(no_args_is_help=True)
+def batch(
+    url_file: Path = typer.Argument(..., help="A file with one comic URL per line"),
+    dest: Path = typer.Argument(Path.cwd(), help="The destination folder to download to."),
+    maxthreads: int = typer.Option(
+        8,
+        "--threads",
+        "-t",
+        help="The maximum number of images to download in parallel across all comics",
+    ),
+    series_threads: int = typer.Option(
+        4, "--series", "-n", help="The maximum number of comics to download in parallel"
+    ),
+    host_threads: int = typer.Option(
+        4,
+        "--per-host",
+        "-H",
+        help="The maximum number of images to download in parallel from the same host",
+    ),
+) -> None:
+    """
+    Download every comic URL listed in a file. Progress is saved to md-batch.json in
+    the destination folder, so rerunning an interrupted batch resumes where it stopped.
+
+    eg. To download every comic in urls.txt to the current directory:
+    mandown batch urls.txt
+    """
+    if not dest.is_dir():
+        raise ValueError(f"{dest} is not a valid folder path.")
+
+    urls = read_url_list(url_file)
+    failed: dict[str, str] = {}
+
+    typer.echo(f"Downloading {len(urls)} comic(s)...")
+    with typer.progressbar(
+        api.batch_download_progress(
+            urls,
+            dest,
+            series_threads=series_threads,
+            host_threads=host_threads,
+            threads=maxthreads,
+        ),
+        length=len(urls),
+    ) as progress:
+        for url, err in progress:
+            progress.label = url
+            if err is not None:
+                failed[url] = err
+
+    for url, err in failed.items():
+        typer.secho(f"Failed to download {url}: {err}", fg=typer.colors.RED)
+
+    if failed:
+        raise typer.Exit(3)
+    typer.secho(f"Successfully downloaded all comics to {dest}.", fg=typer.colors.GREEN)
+
+
 @app.command(name="init-metadata")
 def init_metadata(
     path: Path | None = typer.Argument(None, help="The folder to initialise"),
@@ -519,6 +859,71 @@ def init_metadata(
     typer.echo(comic)
 
 
+def cli_open_library(path: Path) -> Library:
+    if not (path / LIBRARY_FILE).is_file():
+        typer.secho(
+            f"No library index found in {path}. Create one with `mandown library rebuild`.",
+            fg=typer.colors.RED,
+        )
+        raise typer.Exit(1)
+    return Library(path)
+
+
+@library_app.command(name="rebuild")
+def library_rebuild(
+    path: Path = typer.Argument(Path.cwd(), help="The folder containing downloaded comics"),
+    threads: int = typer.Option(
+        4, "--threads", "-t", help="The number of comics to read in parallel"
+    ),
+) -> None:
+    """
+    Create or rebuild the library index of a folder from the comics inside it.
+    Once created, the index is kept up to date by downloads and conversions.
+
+    eg. mandown library rebuild /path/to/library
+    """
+    with Library(path) as library:
+        count = 0
+        for _ in library.rebuild_progress(threads):
+            count += 1
+    typer.secho(f"Indexed {count} comic(s) in {path / LIBRARY_FILE}", fg=typer.colors.GREEN)
+
+
+@library_app.command(name="list")
+def library_list(
+    path: Path = typer.Argument(Path.cwd(), help="The folder containing downloaded comics"),
+) -> None:
+    """
+    List the comics in the library with their download and conversion state.
+    """
+    with cli_open_library(path) as library:
+        for row in library.comics():
+            typer.echo(
+                f"{row['title']} ({row['folder']}): {row['downloaded_count']}/"
+                f"{row['chapter_count']} chapter(s) downloaded, "
+                f"converted up to chapter {row['last_converted']}"
+            )
+
+
+@library_app.command(name="pending")
+def library_pending(
+    path: Path = typer.Argument(Path.cwd(), help="The folder containing downloaded comics"),
+    convert_to: ConvertFormats | None = typer.Option(
+        None, "--format", "-f", help="Only consider converted files of this format"
+    ),
+) -> None:
+    """
+    List the comics with downloaded chapters that have not been converted yet.
+    """
+    with cli_open_library(path) as library:
+        rows = library.unconverted(convert_to.value if convert_to else None)
+
+    for row in rows:
+        typer.echo(
+            f"{row['folder']}: chapters {row['last_converted'] + 1}-{row['last_downloaded']}"
+        )
+
+
 @app.callback(invoke_without_command=True, no_args_is_help=True)
 def callback(
     version: bool | None = typer.Option(
@@ -1,5 +1,5 @@
 from . import sources
-from .base import BaseChapter, BaseMetadata
+from .base import BaseChapter, BaseMetadata, ChapterIndex
 from .sources.base_source import BaseSource
 
 
@@ -8,13 +8,13 @@ class BaseComic:
     A comic with metadata and chapter data.
 
     :param `metadata`: Metadata of the comic
-    :param `chapters`: A list of chapters of the comic
+    :param `chapters`: A list or `ChapterIndex` of chapters of the comic
     """
 
     def __init__(
         self,
         metadata: BaseMetadata,
-        chapters: list[BaseChapter],
+        chapters: list[BaseChapter] | ChapterIndex,
     ):
         self.metadata = metadata
         self.chapters = chapters
@@ -35,7 +35,11 @@ class BaseComic:
 
         return {
             "metadata": self.metadata.asdict(),
-            "chapters": [c.asdict() for c in self.chapters],
+            "chapters": (
+                self.chapters.asdicts()
+                if isinstance(self.chapters, ChapterIndex)
+                else [c.asdict() for c in self.chapters]
+            ),
         }
 
     def get_chapter_image_urls(self, chapter: BaseChapter) -> list[str]:
@@ -73,6 +77,28 @@ class BaseComic:
         if metadata:
             self.metadata = self.source.fetch_metadata()
 
+    def fetch_new_chapters(self) -> list[BaseChapter]:
+        """
+        Refresh comic.chapters from the source without refreshing metadata, and return
+        the chapters that were not in the previous chapter list. Chapters are matched by
+        URL, falling back to their slug, and chapters matched by URL keep their previous
+        slug so that they still point to their existing folder.
+
+        :returns A list of chapters that are new, in chapter order
+        """
+        old_slugs_by_url = {c.url: c.slug for c in self.chapters if c.url}
+        old_slugs = {c.slug for c in self.chapters}
+
+        self.update(metadata=False)
+
+        new_chapters: list[BaseChapter] = []
+        for chapter in self.chapters:
+            if chapter.url and chapter.url in old_slugs_by_url:
+                chapter.slug = old_slugs_by_url[chapter.url]
+            elif chapter.slug not in old_slugs:
+                new_chapters.append(chapter)
+        return new_chapters
+
     def __str__(self) -> str:
         return f"""
 Title: {self.metadata.title},
@@ -1,8 +1,20 @@
+import shutil
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from enum import Enum
 from pathlib import Path
-from typing import Iterator
+from typing import Callable, Collection, Iterator
+from xml.sax.saxutils import escape
 
 import comicon
+from comicon.common.cbz import build_page_index
+from comicon.image import WITH_WEBP_ACCEPTED_IMAGE_EXTENSIONS, WITH_WEBP_EXTENSION_MIME_MAP
+from lxml import etree
+from lxml.builder import E
+
+from .image_index import ImageIndex
 
 
 class ConvertFormats(str, Enum):
@@ -18,12 +30,349 @@ class ConvertFormats(str, Enum):
     NONE = "none"
 
 
+def write_ir(comic: comicon.Comic, comic_path: Path) -> None:
+    """
+    Save `comic` as the comicon IR data of `comic_path`, which the format writers read.
+    """
+    (comic_path / comicon.cirtools.IR_DATA_FILE).write_text(comic.to_json())
+
+
+def write_comic(
+    comic: comicon.Comic, comic_path: Path, to: ConvertFormats, dest: Path
+) -> Iterator[str | int]:
+    """
+    Write `comic`, whose chapters and IR data are in `comic_path`, to the comic file `dest`.
+    CBZs are written by `write_cbz` and every other format by comicon.
+    """
+    if to != ConvertFormats.CBZ:
+        yield from comicon.outputs.create_comic_progress(comic_path, dest)
+        return
+
+    comicon.cirtools.validate_cir(comic_path)
+    yield from write_cbz(comic, comic_path, dest)
+
+
 def convert_one(
     comic: comicon.Comic, comic_path: Path, to: ConvertFormats, dest_folder: Path
 ) -> Iterator[str | int]:
     # save comicon.json
-    (comic_path / comicon.cirtools.IR_DATA_FILE).write_text(comic.to_json())
+    write_ir(comic, comic_path)
+
+    yield from write_comic(
+        comic, comic_path, to, dest_folder / f"{comic.metadata.title_slug}.{to.value}"
+    )
+
+
+def _link(src: Path, dest: Path) -> None:
+    try:
+        dest.symlink_to(src.resolve(), target_is_directory=src.is_dir())
+    except OSError:
+        # symlinks need extra permissions on Windows
+        if src.is_dir():
+            shutil.copytree(src, dest)
+        else:
+            shutil.copy2(src, dest)
+
+
+def convert_part(
+    comic: comicon.Comic,
+    comic_path: Path,
+    formats: Collection[ConvertFormats],
+    dest_folder: Path,
+) -> str:
+    """
+    Convert `comic`, which is made of some of the chapters of the comic in `comic_path`,
+    in a folder of its own that links to those chapters. Unlike `convert_one`, this does
+    not write to `comic_path`, so several parts of a comic can be converted at once.
+
+    :param `comic`: The part of the comic to convert
+    :param `comic_path`: The comic folder containing the chapters of `comic`
+    :param `formats`: The formats to convert to
+    :param `dest_folder`: The folder to write the converted comic to
+    :returns The title of `comic`
+    """
+    with tempfile.TemporaryDirectory(prefix="mandown-") as ir_folder:
+        ir_path = Path(ir_folder)
+        for chapter in comic.chapters:
+            _link(comic_path / chapter.slug, ir_path / chapter.slug)
+        if comic.metadata.cover_path_rel:
+            _link(
+                comic_path / comic.metadata.cover_path_rel, ir_path / comic.metadata.cover_path_rel
+            )
+
+        for to in formats:
+            for _ in convert_one(comic, ir_path, to, dest_folder):
+                pass
+    return comic.metadata.title
+
+
+# the entries after the chapters of a CBZ, which are rewritten when chapters are appended
+CBZ_TAIL_ENTRIES = ("ComicInfo.xml", comicon.cirtools.IR_DATA_FILE)
+
+# the entries of an EPUB that list its pages, which are rewritten when chapters are appended
+EPUB_TAIL_ENTRIES = (
+    "EPUB/toc.ncx",
+    "EPUB/nav.xhtml",
+    "EPUB/static/style.css",
+    f"EPUB/static/{comicon.cirtools.IR_DATA_FILE}",
+    "EPUB/content.opf",
+)
+
+APPENDABLE_FORMATS = {ConvertFormats.CBZ, ConvertFormats.EPUB}
+
+# images are copied into CBZs in reads of this size
+_COPY_BUFFER_SIZE = 1024 * 1024
+
+_OPF = "{http://www.idpf.org/2007/opf}"
+_NCX = "{http://www.daisy.org/z3986/2005/ncx/}"
+_XHTML = "{http://www.w3.org/1999/xhtml}"
+
+# the same page that comicon writes for each image
+EPUB_PAGE_TEMPLATE = """<?xml version='1.0' encoding='utf-8'?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" \
+epub:prefix="z3998: http://www.daisy.org/z3998/2012/vocab/structure/#" lang="en" xml:lang="en">
+  <head>
+    <title>{title}</title>
+  </head>
+  <body><img src="{src}"/>
+  </body>
+</html>
+"""
+
+
+def _is_cbz_tail(name: str) -> bool:
+    return name in CBZ_TAIL_ENTRIES or name.startswith("..cover")
+
+
+@contextmanager
+def _rewrite(
+    dest: Path, is_tail: Callable[[str], bool]
+) -> Iterator[tuple[zipfile.ZipFile, dict[str, bytes]]]:
+    """
+    Copy every entry of the ZIP archive `dest` that `is_tail` does not match into a new
+    archive, which replaces `dest` once the caller is done adding to it. Images are
+    stored, since compressing them again would take long and save next to nothing.
+
+    :returns The new archive, and the contents of the entries that were left out
+    """
+    tmp_path = dest.with_name(f".{dest.name}.tmp")
+    try:
+        with (
+            zipfile.ZipFile(dest) as source,
+            zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as archive,
+        ):
+            tail: dict[str, bytes] = {}
+            for info in source.infolist():
+                if is_tail(info.filename):
+                    tail[info.filename] = source.read(info)
+                    continue
+
+                copied = zipfile.ZipInfo(info.filename, info.date_time)
+                copied.external_attr = info.external_attr
+                copied.file_size = info.file_size
+                is_image = Path(info.filename).suffix.lower() in WITH_WEBP_ACCEPTED_IMAGE_EXTENSIONS
+                copied.compress_type = zipfile.ZIP_STORED if is_image else info.compress_type
+                with source.open(info) as src, archive.open(copied, "w") as dst:
+                    shutil.copyfileobj(src, dst, _COPY_BUFFER_SIZE)
+            yield archive, tail
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    tmp_path.replace(dest)
+
 
-    yield from comicon.outputs.create_comic_progress(
-        comic_path, dest_folder / f"{comic.metadata.title_slug}.{to.value}"
+def can_append(dest: Path, to: ConvertFormats) -> bool:
+    """
+    Return whether chapters can be appended to the comic file `dest`, which needs
+    the entries that list its pages.
+    """
+    if to not in APPENDABLE_FORMATS or not zipfile.is_zipfile(dest):
+        return False
+    with zipfile.ZipFile(dest) as archive:
+        names = set(archive.namelist())
+    if to == ConvertFormats.CBZ:
+        return any(_is_cbz_tail(name) for name in names)
+    return names.issuperset(EPUB_TAIL_ENTRIES)
+
+
+def comic_info_xml(comic: comicon.Comic, comic_path: Path, index: ImageIndex | None = None) -> str:
+    """
+    Return the ComicInfo.xml of a CBZ of `comic`, whose chapters are in `comic_path`.
+
+    :param `index`: If set, the dimensions of each page that is in it and did not
+    change since it was indexed are included
+    """
+    page_index = build_page_index(comic_path, comic)
+    if index is not None:
+        # the same pages that build_page_index lists
+        images = [
+            image
+            for chap in comic.chapters
+            for image in sorted((comic_path / chap.slug).iterdir())
+            if image.suffix.lower() in WITH_WEBP_ACCEPTED_IMAGE_EXTENSIONS
+        ]
+        for page, image in zip(page_index, images, strict=True):
+            info = index.get(image)
+            stat = image.stat()
+            if info is not None and (info.file_size, info.mtime_ns) == (
+                stat.st_size,
+                stat.st_mtime_ns,
+            ):
+                page.image_width = str(info.width)
+                page.image_height = str(info.height)
+    tree = E.ComicInfo(
+        E.Title(comic.metadata.title),
+        E.Summary(comic.metadata.description),
+        E.Writer(", ".join(comic.metadata.authors)),
+        E.Genre(", ".join(comic.metadata.genres)),
+        E.PageCount(str(len(page_index))),
+        E.Pages(*[E.Page(**page.build_lxml_kwargs()) for page in page_index]),
     )
+    return etree.tostring(tree, pretty_print=True, encoding="utf-8", xml_declaration=True).decode()
+
+
+def append_chapters(
+    comic: comicon.Comic, comic_path: Path, to: ConvertFormats, dest: Path, start: int
+) -> Iterator[str | int]:
+    """
+    Append the chapters of `comic` from index `start` onwards to the CBZ or EPUB `dest`,
+    which already holds the chapters before them. The pages already in `dest` are copied
+    as they are, and only the entries that list its pages are rebuilt. Check
+    `can_append` first.
+
+    :param `comic`: The whole comic, including the chapters already in `dest`
+    :param `comic_path`: The comic folder containing the chapters of `comic`
+    :param `to`: The format of `dest`
+    :param `dest`: The comic file to append to
+    :param `start`: The index of the first chapter of `comic` that is not in `dest`
+    :returns An `Iterator` that yields the number of new chapters, then the title
+    of each chapter once it is appended
+    """
+    if to == ConvertFormats.CBZ:
+        yield from _append_cbz(comic, comic_path, dest, start)
+    else:
+        yield from _append_epub(comic, comic_path, dest, start)
+
+
+def write_cbz(comic: comicon.Comic, comic_path: Path, dest: Path) -> Iterator[str | int]:
+    """
+    Write `comic`, whose chapters are in `comic_path`, to the CBZ `dest`. Images are
+    already compressed, so they are copied into the archive as they are without being
+    decoded or compressed again. The archive is laid out like comicon's CBZs, with the
+    entries that `append_chapters` rewrites at the end.
+
+    :returns An `Iterator` that yields the number of chapters, then the title
+    of each chapter once it is written
+    """
+    yield len(comic.chapters)
+    tmp_path = dest.with_name(f".{dest.name}.tmp")
+    try:
+        with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as archive:
+            yield from _write_cbz_chapters(archive, comic, comic_path, 0)
+            _write_cbz_tail(archive, comic, comic_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    tmp_path.replace(dest)
+
+
+def _store(archive: zipfile.ZipFile, path: Path, name: str) -> None:
+    info = zipfile.ZipInfo.from_file(path, name)
+    info.compress_type = zipfile.ZIP_STORED
+    with open(path, "rb") as src, archive.open(info, "w") as dest:
+        shutil.copyfileobj(src, dest, _COPY_BUFFER_SIZE)
+
+
+def _write_cbz_chapters(
+    archive: zipfile.ZipFile, comic: comicon.Comic, comic_path: Path, start: int
+) -> Iterator[str]:
+    for i, chap in enumerate(comic.chapters[start:], start=start + 1):
+        for image in sorted((comic_path / chap.slug).iterdir()):
+            _store(archive, image, f"{i:05}-{chap.slug}/{image.name}")
+        yield chap.title
+
+
+def _write_cbz_tail(archive: zipfile.ZipFile, comic: comicon.Comic, comic_path: Path) -> None:
+    if comic.metadata.cover_path_rel:
+        cover_path = Path(comic.metadata.cover_path_rel)
+        # renamed to sort before the chapters
+        _store(archive, comic_path / cover_path, cover_path.with_stem("..cover").as_posix())
+
+    try:
+        index: ImageIndex | None = ImageIndex.load(comic_path)
+    except ImportError:
+        index = None
+    archive.writestr("ComicInfo.xml", comic_info_xml(comic, comic_path, index))
+    archive.writestr(comicon.cirtools.IR_DATA_FILE, comic.to_json())
+
+
+def _append_cbz(
+    comic: comicon.Comic, comic_path: Path, dest: Path, start: int
+) -> Iterator[str | int]:
+    yield len(comic.chapters) - start
+    with _rewrite(dest, _is_cbz_tail) as (archive, _):
+        yield from _write_cbz_chapters(archive, comic, comic_path, start)
+        _write_cbz_tail(archive, comic, comic_path)
+
+
+def _append_epub(
+    comic: comicon.Comic, comic_path: Path, dest: Path, start: int
+) -> Iterator[str | int]:
+    yield len(comic.chapters) - start
+    with _rewrite(dest, EPUB_TAIL_ENTRIES.__contains__) as (archive, tail):
+        opf = etree.fromstring(tail["EPUB/content.opf"])
+        ncx = etree.fromstring(tail["EPUB/toc.ncx"])
+        nav = etree.fromstring(tail["EPUB/nav.xhtml"])
+
+        manifest = opf.find(f"{_OPF}manifest")
+        spine = opf.find(f"{_OPF}spine")
+        # new pages go before the table of contents, like the pages already there
+        toc_item = manifest.find(f"{_OPF}item[@id='ncx']")
+        nav_map = ncx.find(f"{_NCX}navMap")
+        nav_list = nav.find(f".//{_XHTML}nav/{_XHTML}ol")
+
+        for j, chapter in enumerate(comic.chapters[start:], start=start):
+            images = sorted(f for f in (comic_path / chapter.slug).iterdir() if f.is_file())
+            for i, image in enumerate(images):
+                image_name = f"img/{chapter.slug}/{image.name}"
+                page_name = f"pages/{chapter.slug}-{i}.xhtml"
+                _store(archive, image, f"EPUB/{image_name}")
+                archive.writestr(
+                    f"EPUB/{page_name}",
+                    EPUB_PAGE_TEMPLATE.format(title=escape(chapter.title), src=f"../{image_name}"),
+                )
+
+                image_item = etree.Element(f"{_OPF}item", href=image_name)
+                image_item.set("id", f"{chapter.slug}-{image.name}")
+                image_item.set("media-type", WITH_WEBP_EXTENSION_MIME_MAP[image.suffix.lower()])
+                page_item = etree.Element(f"{_OPF}item", href=page_name, id=f"chap{j}-{i}")
+                page_item.set("media-type", "application/xhtml+xml")
+                toc_item.addprevious(image_item)
+                toc_item.addprevious(page_item)
+                etree.SubElement(spine, f"{_OPF}itemref", idref=f"chap{j}-{i}")
+
+            first_page = f"pages/{chapter.slug}-0.xhtml"
+            nav_point = etree.SubElement(nav_map, f"{_NCX}navPoint", id=chapter.slug)
+            label = etree.SubElement(nav_point, f"{_NCX}navLabel")
+            etree.SubElement(label, f"{_NCX}text").text = chapter.title
+            etree.SubElement(nav_point, f"{_NCX}content", src=first_page)
+            item = etree.SubElement(nav_list, f"{_XHTML}li")
+            etree.SubElement(item, f"{_XHTML}a", href=first_page).text = chapter.title
+            yield chapter.title
+
+        for meta in opf.iter(f"{_OPF}meta"):
+            if meta.get("property") == "dcterms:modified":
+                meta.text = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+        tail["EPUB/toc.ncx"] = _xml_bytes(ncx)
+        tail["EPUB/nav.xhtml"] = _xml_bytes(nav, doctype="<!DOCTYPE html>")
+        tail[f"EPUB/static/{comicon.cirtools.IR_DATA_FILE}"] = comic.to_json().encode()
+        tail["EPUB/content.opf"] = _xml_bytes(opf)
+        for name in EPUB_TAIL_ENTRIES:
+            archive.writestr(name, tail[name])
+
+
+def _xml_bytes(tree: etree._Element, doctype: str | None = None) -> bytes:
+    etree.indent(tree, "  ")
+    return etree.tostring(tree, encoding="utf-8", xml_declaration=True, doctype=doctype)
@@ -0,0 +1,156 @@
+"""
+A per-comic index of the dimensions, format and mode of every image, read from
+image headers only. It lives in `<comic>/md-images.json` and is refreshed by
+re-reading only the images that changed on disk since they were indexed.
+"""
+
+import json
+import multiprocessing as mp
+import os
+from dataclasses import astuple, dataclass, field
+from pathlib import Path
+from typing import Iterable
+
+try:
+    from PIL import Image, UnidentifiedImageError
+
+    HAS_PILLOW = True
+except ImportError:
+    HAS_PILLOW = False
+
+IMAGE_INDEX_FILE = "md-images.json"
+
+# refreshing fewer images than this is not worth starting processes for
+_MIN_PARALLEL_IMAGES = 64
+
+
+@dataclass(frozen=True, slots=True)
+class ImageInfo:
+    """
+    What an image looks like, without decoding it.
+
+    :param `width`: The width of the image in pixels
+    :param `height`: The height of the image in pixels
+    :param `format`: The file format, such as `JPEG`
+    :param `mode`: The Pillow image mode, such as `RGB`
+    :param `file_size`: The size of the file in bytes
+    :param `mtime_ns`: When the file was last modified
+    """
+
+    width: int
+    height: int
+    format: str
+    mode: str
+    file_size: int
+    mtime_ns: int
+
+    @property
+    def size(self) -> tuple[int, int]:
+        """
+        The dimensions of the image as (width, height).
+        """
+        return (self.width, self.height)
+
+
+def read_image_info(path: Path) -> ImageInfo | None:
+    """
+    Read the header of the image at `path`.
+
+    :returns The image's info, or `None` if it is not an image Pillow can read
+    """
+    try:
+        stat = path.stat()
+        with Image.open(path) as image:
+            return ImageInfo(
+                *image.size, image.format or "", image.mode, stat.st_size, stat.st_mtime_ns
+            )
+    except (OSError, UnidentifiedImageError):
+        return None
+
+
+@dataclass(slots=True)
+class ImageIndex:
+    """
+    The image info of every image in a comic.
+
+    :param `comic_path`: The comic folder, which the index is saved in
+    :param `images`: The info of each image, by its path relative to `comic_path`
+    :raises `ImportError`: If Pillow is not installed
+    """
+
+    comic_path: Path
+    images: dict[str, ImageInfo] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        if not HAS_PILLOW:
+            raise ImportError("Pillow was not found and is needed to read images. Is it installed?")
+
+    @classmethod
+    def load(cls, comic_path: Path | str) -> "ImageIndex":
+        """
+        Load the index of the comic in `comic_path`, or start a new one if it does not exist.
+        """
+        comic_path = Path(comic_path)
+        try:
+            with open(comic_path / IMAGE_INDEX_FILE, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return cls(comic_path)
+        return cls(comic_path, {key: ImageInfo(*info) for key, info in data.items()})
+
+    def save(self) -> None:
+        """
+        Atomically write the index to disk.
+        """
+        path = self.comic_path / IMAGE_INDEX_FILE
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({key: astuple(info) for key, info in self.images.items()}, file)
+        os.replace(tmp_path, path)
+
+    def _key(self, image: Path) -> str:
+        return image.relative_to(self.comic_path).as_posix()
+
+    def get(self, image: Path) -> ImageInfo | None:
+        """
+        Return the indexed info of `image`, or `None` if it is not indexed.
+        This does not check whether the image changed since it was indexed.
+        """
+        return self.images.get(self._key(image))
+
+    def refresh(self, images: Iterable[Path], threads: int = 4) -> None:
+        """
+        Make the index match `images`, reading the headers of the images that are
+        new or changed since they were indexed in parallel. Images that are not
+        in `images` are removed from the index.
+
+        :param `images`: Every image in the comic
+        :param `threads`: The number of processes to read headers with
+        """
+        current: dict[str, ImageInfo] = {}
+        stale: list[Path] = []
+        for image in images:
+            key = self._key(image)
+            info = self.images.get(key)
+            try:
+                stat = image.stat()
+            except FileNotFoundError:
+                continue
+            if info is not None and (info.file_size, info.mtime_ns) == (
+                stat.st_size,
+                stat.st_mtime_ns,
+            ):
+                current[key] = info
+            else:
+                stale.append(image)
+
+        if threads > 1 and len(stale) >= _MIN_PARALLEL_IMAGES:
+            with mp.Pool(threads) as pool:
+                infos = pool.map(read_image_info, stale, chunksize=16)
+        else:
+            infos = [read_image_info(image) for image in stale]
+
+        for image, new_info in zip(stale, infos, strict=True):
+            if new_info is not None:
+                current[self._key(image)] = new_info
+        self.images = current
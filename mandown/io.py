@@ -1,7 +1,12 @@
+import ctypes
 import json
 import multiprocessing as mp
 import os
+import shutil
+import sys
 import urllib.parse
+from concurrent.futures import Executor, as_completed
+from functools import partial
 from pathlib import Path
 from time import sleep
 from typing import Iterator, Sequence
@@ -10,21 +15,32 @@ import filetype
 import requests as RealRequests
 from natsort import natsorted
 
-from .base import BaseChapter, BaseMetadata
+from .base import BaseChapter, BaseMetadata, ChapterIndex
 from .comic import BaseComic
+from .library import Library
+from .page_hashes import REPEATED_PAGES_FOLDER
+from .processor import Pipeline
 
 NUM_LEFT_PAD_DIGITS = 5
 FILE_PADDING = f"0{NUM_LEFT_PAD_DIGITS}"
 MD_METADATA_FILE = "md-metadata.json"
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp"}
 
 AsyncDownloadImageInput = tuple[str, Path | str, str | None, dict[str, str] | None]
 
 
-def async_download_image(data: AsyncDownloadImageInput) -> None:
+def async_download_image(
+    data: AsyncDownloadImageInput,
+    session: RealRequests.Session | None = None,
+    pipeline: Pipeline | None = None,
+) -> None:
     """
     Download an image from a URL to a destination folder, fixing the file extension if necessary.
 
     :param `data`: A tuple of the url, destination folder, filename, and headers.
+    :param `session`: A session to reuse connections from
+    :param `pipeline`: Processing operations to run on the image before it is
+    written, so that it is only decoded and written once
     """
     url, dest_folder, filename, headers = data
     dest_folder = Path(dest_folder)
@@ -33,7 +49,8 @@ def async_download_image(data: AsyncDownloadImageInput) -> None:
     dest_file = dest_folder / name
 
     times = 0
-    while (res := RealRequests.get(url, headers=headers, timeout=5)).status_code == 429:
+    getter = session or RealRequests
+    while (res := getter.get(url, headers=headers, timeout=5)).status_code == 429:
         # there is no clean way to raise an error in a pool
         # so we just return early and check it later
         times += 1
@@ -41,14 +58,18 @@ def async_download_image(data: AsyncDownloadImageInput) -> None:
         if times >= 3:
             return
 
-    with open(dest_file, "wb") as file:
-        file.write(res.content)
-
     # if the file extension is lying
-    # rename it so epubcheck doesn't yell at us
-    ext = filetype.guess(dest_file)
+    # fix it so epubcheck doesn't yell at us
+    ext = filetype.guess(res.content)
     if ext is not None and ext.extension in ["jpg", "png", "gif"]:
-        dest_file.rename(dest_file.with_suffix(f".{ext.extension}"))
+        dest_file = dest_file.with_suffix(f".{ext.extension}")
+
+    if pipeline is not None and pipeline.process_bytes(res.content, dest_file):
+        return
+
+    # unprocessed images are written as they were downloaded
+    with open(dest_file, "wb") as file:
+        file.write(res.content)
 
 
 def download_images(
@@ -58,6 +79,9 @@ def download_images(
     filestems: Sequence[str] | None = None,
     headers: dict[str, str] | None = None,
     threads: int = 1,
+    executor: Executor | None = None,
+    session: RealRequests.Session | None = None,
+    pipeline: Pipeline | None = None,
 ) -> Iterator[None]:
     """
     Download one or multiple URLs to a destination folder.
@@ -68,6 +92,11 @@ def download_images(
     :param `filestems`: Specify the name of each downloaded file instead of the default.
     :param `headers`: Request headers
     :param `threads`: The number of processes to open
+    :param `executor`: An existing executor to download with instead of opening
+    `threads` new processes, so that it can be shared between downloads
+    :param `session`: A session to share connections with. Only used with `executor`.
+    :param `pipeline`: Processing operations to run on each image in memory before it
+    is written to disk
     :returns An Iterator that yields `None` for each downloaded file.
     """
     dest_folder = Path(dest_folder)
@@ -85,8 +114,16 @@ def download_images(
         _, ext = os.path.splitext(urllib.parse.urlparse(url).path)
         map_pool.append((url, dest_folder, f"{stem}{ext}", headers))
 
+    download = partial(async_download_image, pipeline=pipeline)
+
+    if executor is not None:
+        download = partial(download, session=session)
+        for future in as_completed([executor.submit(download, data) for data in map_pool]):
+            yield future.result()
+        return
+
     with mp.Pool(threads) as pool:
-        yield from pool.imap_unordered(async_download_image, map_pool)
+        yield from pool.imap_unordered(download, map_pool)
 
 
 def read_comic(path: Path | str) -> BaseComic:
@@ -109,7 +146,7 @@ def read_comic(path: Path | str) -> BaseComic:
 
     return BaseComic(
         BaseMetadata(**data["metadata"]),
-        [BaseChapter(**c) for c in data["chapters"]],
+        ChapterIndex.from_dicts(data["chapters"]),
     )
 
 
@@ -136,7 +173,7 @@ def parse_comic(path: Path | str, donor_comic: BaseComic | None = None) -> BaseC
     chapters = [
         BaseChapter(inode.stem, "", inode.stem)
         for inode in natsorted(path.iterdir(), key=lambda i: i.stem)
-        if inode.is_dir()
+        if _is_chapter_folder(inode)
     ]
 
     if donor_comic:
@@ -164,6 +201,14 @@ def save_comic(comic: BaseComic, path: Path | str) -> None:
     with open(json_path, "w", encoding="utf-8") as file:
         json.dump(comic.asdict(), file)
 
+    if (library := Library.find(path)) is not None:
+        with library:
+            library.update_comic(comic, path)
+
+
+def _is_chapter_folder(path: Path) -> bool:
+    return path.is_dir() and path.name != REPEATED_PAGES_FOLDER
+
 
 def discover_local_images(path: Path | str) -> dict[str, list[Path]]:
     """
@@ -178,5 +223,69 @@ def discover_local_images(path: Path | str) -> dict[str, list[Path]]:
     return {
         chap.stem: sorted(chap.iterdir())
         for chap in sorted(path.iterdir())  # iterdir does not guarantee any order
-        if chap.is_dir()
+        if _is_chapter_folder(chap)
     } | {"cover": [cover for cover in path.iterdir() if cover.is_file() and cover.stem == "cover"]}
+
+
+def variant_path(comic_path: Path | str, profile: str) -> Path:
+    """
+    Return the folder that the copy of a comic processed for `profile` is saved in,
+    which is next to the comic.
+
+    :param `comic_path`: The folder of the comic
+    :param `profile`: The name of the device profile
+    """
+    comic_path = Path(comic_path)
+    return comic_path.with_name(f"{comic_path.name} [{profile}]")
+
+
+# renameat2 arguments, from <fcntl.h> and <linux/fs.h>
+_AT_FDCWD = -100
+_RENAME_EXCHANGE = 2
+
+
+def _exchange(src: Path, dest: Path) -> bool:
+    """
+    Atomically swap the paths `src` and `dest` with `renameat2(RENAME_EXCHANGE)`.
+
+    :returns Whether they were swapped, which needs Linux 3.15+ and a filesystem
+    that supports it
+    """
+    if sys.platform != "linux":
+        return False
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):
+        # glibc before 2.28 does not wrap the syscall
+        return False
+    return (
+        renameat2(_AT_FDCWD, os.fsencode(src), _AT_FDCWD, os.fsencode(dest), _RENAME_EXCHANGE) == 0
+    )
+
+
+def replace_folder(src: Path | str, dest: Path | str) -> None:
+    """
+    Replace the folder `dest` with the folder `src`. Both must be on the same filesystem.
+
+    Where the system supports it (see `_exchange`), the folders are swapped atomically,
+    so `dest` always exists and is either the old or the new folder. Otherwise, the old
+    folder is renamed away before `src` is renamed into place, so `dest` does not exist
+    for a moment in between, but is never left partially written.
+
+    :param `src`: The folder to move
+    :param `dest`: The folder to replace
+    """
+    src = Path(src)
+    dest = Path(dest)
+
+    if dest.exists() and _exchange(src, dest):
+        # `src` is now the old folder
+        shutil.rmtree(src, ignore_errors=True)
+        return
+
+    backup = dest.with_name(f".{dest.name}.old")
+    shutil.rmtree(backup, ignore_errors=True)
+    if dest.exists():
+        os.replace(dest, backup)
+    os.replace(src, dest)
+    shutil.rmtree(backup, ignore_errors=True)
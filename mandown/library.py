@@ -0,0 +1,298 @@
+"""
+A SQLite index of every comic in a download directory, so that questions about
+the whole library can be answered without reading each `md-metadata.json`.
+
+The index lives in `<library root>/md-library.sqlite3`, where each comic is a
+folder directly inside the library root. Once the index exists, it is kept up to
+date by `save_comic`, `download_progress` and `convert_progress`.
+"""
+
+import json
+import multiprocessing as mp
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterator
+
+from .base import slugify_title
+
+if TYPE_CHECKING:
+    from .comic import BaseComic
+
+LIBRARY_FILE = "md-library.sqlite3"
+
+# the same as io.MD_METADATA_FILE, which cannot be imported here
+# without a circular import
+_MD_METADATA_FILE = "md-metadata.json"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS comics (
+    folder TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    url TEXT NOT NULL,
+    chapter_count INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS chapters (
+    folder TEXT NOT NULL REFERENCES comics (folder) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    url TEXT NOT NULL,
+    slug TEXT NOT NULL,
+    image_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (folder, idx)
+);
+
+CREATE INDEX IF NOT EXISTS chapters_by_slug ON chapters (folder, slug);
+
+CREATE TABLE IF NOT EXISTS outputs (
+    file TEXT PRIMARY KEY,
+    folder TEXT NOT NULL REFERENCES comics (folder) ON DELETE CASCADE,
+    format TEXT NOT NULL,
+    last_chapter INTEGER NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+ScannedComic = tuple[str, dict[str, Any], list[dict[str, str]], list[int]]
+
+
+def _chapter_slug(chapter: dict[str, str]) -> str:
+    # slugs are optional in md-metadata.json, like in ChapterIndex.from_dicts
+    return chapter.get("slug") or slugify_title(chapter["title"])
+
+
+def _scan_comic(folder: Path) -> ScannedComic | None:
+    """
+    Read the metadata and count the images of each chapter of a comic folder.
+    Runs in a worker process.
+
+    :returns The folder name, metadata, chapters and image counts of the comic,
+    or `None` if its metadata cannot be read
+    """
+    try:
+        with open(folder / _MD_METADATA_FILE, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        metadata = {"title": data["metadata"]["title"], "url": data["metadata"]["url"]}
+        chapters = [
+            {"title": c["title"], "url": c["url"], "slug": _chapter_slug(c)}
+            for c in data["chapters"]
+        ]
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+    image_counts: list[int] = []
+    for chapter in chapters:
+        try:
+            with os.scandir(folder / chapter["slug"]) as entries:
+                image_counts.append(sum(1 for entry in entries if entry.is_file()))
+        except OSError:
+            image_counts.append(0)
+    return folder.name, metadata, chapters, image_counts
+
+
+class Library:
+    """
+    A SQLite index of the comics in a library folder. Use it as a context manager
+    to make sure the connection is closed.
+
+    :param `root`: The folder containing comic folders
+    """
+
+    def __init__(self, root: Path | str) -> None:
+        self.root = Path(root)
+        self.db_path = self.root / LIBRARY_FILE
+        self.conn = sqlite3.connect(self.db_path, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(_SCHEMA)
+
+    @classmethod
+    def find(cls, comic_path: Path | str) -> "Library | None":
+        """
+        Return the library that the comic at `comic_path` belongs to,
+        or `None` if its parent folder has no library index.
+        """
+        root = Path(comic_path).absolute().parent
+        if not (root / LIBRARY_FILE).is_file():
+            return None
+        return cls(root)
+
+    def __enter__(self) -> "Library":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close the database connection.
+        """
+        self.conn.close()
+
+    def _folder(self, comic_path: Path | str) -> str:
+        return Path(comic_path).absolute().name
+
+    def _write_comic(
+        self, folder: str, metadata: dict[str, Any], chapters: list[dict[str, str]]
+    ) -> None:
+        # keep download state for chapters that still exist
+        image_counts = dict(
+            self.conn.execute(
+                "SELECT slug, image_count FROM chapters WHERE folder = ?", (folder,)
+            ).fetchall()
+        )
+        self.conn.execute(
+            "INSERT INTO comics (folder, title, url, chapter_count, updated)"
+            " VALUES (?, ?, ?, ?, ?) ON CONFLICT (folder) DO UPDATE SET"
+            " title = excluded.title, url = excluded.url,"
+            " chapter_count = excluded.chapter_count, updated = excluded.updated",
+            (folder, metadata["title"], metadata["url"], len(chapters), time.time()),
+        )
+        self.conn.execute("DELETE FROM chapters WHERE folder = ?", (folder,))
+        rows = []
+        for i, chapter in enumerate(chapters):
+            slug = _chapter_slug(chapter)
+            rows.append(
+                (folder, i, chapter["title"], chapter["url"], slug, image_counts.get(slug, 0))
+            )
+        self.conn.executemany(
+            "INSERT INTO chapters (folder, idx, title, url, slug, image_count)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+    def update_comic(self, comic: "BaseComic", comic_path: Path | str) -> None:
+        """
+        Add or replace a comic and its chapter list in the index.
+
+        :param `comic`: The comic to record
+        :param `comic_path`: The folder the comic is saved in
+        """
+        data = comic.asdict()
+        with self.conn:
+            self._write_comic(self._folder(comic_path), data["metadata"], data["chapters"])
+
+    def update_chapter(self, comic_path: Path | str, slug: str, image_count: int) -> None:
+        """
+        Record how many images of a chapter are on disk.
+
+        :param `comic_path`: The folder the comic is saved in
+        :param `slug`: The slug of the chapter
+        :param `image_count`: The number of images in the chapter folder
+        """
+        with self.conn:
+            self.conn.execute(
+                "UPDATE chapters SET image_count = ? WHERE folder = ? AND slug = ?",
+                (image_count, self._folder(comic_path), slug),
+            )
+
+    def add_output(
+        self, comic_path: Path | str, output_file: Path | str, fmt: str, last_chapter: int
+    ) -> None:
+        """
+        Record a file converted from a comic.
+
+        :param `comic_path`: The folder the comic is saved in
+        :param `output_file`: The converted file
+        :param `fmt`: The format of the converted file, such as `epub`
+        :param `last_chapter`: The number (one-indexed) of the last chapter in the converted file
+        """
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO outputs (file, folder, format, last_chapter, created)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (
+                    str(Path(output_file).absolute()),
+                    self._folder(comic_path),
+                    fmt,
+                    last_chapter,
+                    time.time(),
+                ),
+            )
+
+    def rebuild_progress(self, threads: int = 4) -> Iterator[str]:
+        """
+        Replace the index with the comics found on disk, reading comic folders in parallel.
+        Outputs are kept for comics that still exist. Comics whose metadata cannot be
+        read are skipped.
+
+        :param `threads`: The number of processes to read comics with
+        :returns An `Iterator` yielding the folder name of each indexed comic.
+        """
+        folders = [entry for entry in self.root.iterdir() if (entry / _MD_METADATA_FILE).is_file()]
+
+        with self.conn, mp.Pool(threads) as pool:
+            # a table rather than query parameters, which are limited in number
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS found (folder TEXT PRIMARY KEY)")
+            self.conn.execute("DELETE FROM found")
+            self.conn.executemany("INSERT INTO found VALUES (?)", ((f.name,) for f in folders))
+            self.conn.execute("DELETE FROM comics WHERE folder NOT IN (SELECT folder FROM found)")
+            for res in pool.imap_unordered(_scan_comic, folders):
+                if res is None:
+                    continue
+
+                folder, metadata, chapters, image_counts = res
+                self._write_comic(folder, metadata, chapters)
+                self.conn.executemany(
+                    "UPDATE chapters SET image_count = ? WHERE folder = ? AND idx = ?",
+                    ((count, folder, i) for i, count in enumerate(image_counts)),
+                )
+                yield folder
+
+    def rebuild(self, threads: int = 4) -> None:
+        """
+        Replace the index with the comics found on disk. See `rebuild_progress`.
+
+        :param `threads`: The number of processes to read comics with
+        """
+        for _ in self.rebuild_progress(threads):
+            pass
+
+    def comics(self) -> list[sqlite3.Row]:
+        """
+        Return every comic in the library with the number of chapters
+        downloaded and the number of the last chapter that was converted.
+        """
+        return self.conn.execute(
+            "SELECT c.folder, c.title, c.url, c.chapter_count,"
+            " (SELECT COUNT(*) FROM chapters ch WHERE ch.folder = c.folder"
+            "  AND ch.image_count > 0) AS downloaded_count,"
+            " (SELECT COALESCE(MAX(o.last_chapter), 0) FROM outputs o"
+            "  WHERE o.folder = c.folder) AS last_converted"
+            " FROM comics c ORDER BY c.folder"
+        ).fetchall()
+
+    def unconverted(self, fmt: str | None = None) -> list[sqlite3.Row]:
+        """
+        Return the comics with downloaded chapters after the last chapter that was converted.
+
+        :param `fmt`: Only consider converted files of this format, such as `epub`
+        """
+        return self.conn.execute(
+            "SELECT c.folder, c.title, d.last_downloaded,"
+            " COALESCE(o.last_converted, 0) AS last_converted FROM comics c"
+            " JOIN (SELECT folder, MAX(idx) + 1 AS last_downloaded FROM chapters"
+            "  WHERE image_count > 0 GROUP BY folder) d ON d.folder = c.folder"
+            " LEFT JOIN (SELECT folder, MAX(last_chapter) AS last_converted FROM outputs"
+            "  WHERE ?1 IS NULL OR format = ?1 GROUP BY folder) o ON o.folder = c.folder"
+            " WHERE d.last_downloaded > COALESCE(o.last_converted, 0)"
+            " ORDER BY c.folder",
+            (fmt,),
+        ).fetchall()
+
+    def missing_chapters(self, comic_path: Path | str) -> list[str]:
+        """
+        Return the slugs of the chapters of a comic that have no downloaded images.
+
+        :param `comic_path`: The folder the comic is saved in
+        """
+        return [
+            row[0]
+            for row in self.conn.execute(
+                "SELECT slug FROM chapters WHERE folder = ? AND image_count = 0 ORDER BY idx",
+                (self._folder(comic_path),),
+            )
+        ]
@@ -0,0 +1,188 @@
+"""
+What went into each file that a comic was converted to, so that a later conversion
+can tell which chapters are new. It lives in `<comic>/md-outputs.json`.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from dataclasses import asdict, dataclass, field
+from importlib import metadata as importlib_metadata
+from pathlib import Path
+
+import comicon
+
+OUTPUT_STATE_FILE = "md-outputs.json"
+
+# files written by another version of comicon are converted again
+try:
+    _WRITER_VERSION = importlib_metadata.version("comicon")
+except importlib_metadata.PackageNotFoundError:
+    _WRITER_VERSION = ""
+
+
+def chapter_digest(chapter_path: Path) -> str:
+    """
+    Return a digest of the name, size and modification time of every file in
+    `chapter_path`, which changes whenever an image is added, removed or rewritten.
+    """
+    digest = hashlib.sha1()
+    for image in sorted(chapter_path.iterdir()):
+        stat = image.stat()
+        digest.update(f"{image.name}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode())
+    return digest.hexdigest()[:16]
+
+
+@dataclass(slots=True)
+class OutputRecord:
+    """
+    What a converted file was made from.
+
+    :param `format`: The format the comic was converted to
+    :param `metadata`: A digest of the comic's metadata, its cover and the comicon version
+    :param `chapters`: The slug, title and `chapter_digest` of each chapter, in order
+    :param `file_size`: The size of the converted file
+    :param `mtime_ns`: When the converted file was last modified
+    """
+
+    format: str
+    metadata: str
+    chapters: list[tuple[str, str, str]] = field(default_factory=list)
+    file_size: int = 0
+    mtime_ns: int = 0
+
+    @classmethod
+    def describe(cls, comic: comicon.Comic, comic_path: Path, to: str) -> "OutputRecord":
+        """
+        Describe converting `comic`, whose chapters are in `comic_path`, to `to`.
+        The file itself is described by `with_file` once it is written.
+        """
+        metadata = comic.metadata
+        cover = comic_path / metadata.cover_path_rel if metadata.cover_path_rel else None
+        cover_stat = cover.stat() if cover is not None and cover.exists() else None
+        metadata_digest = hashlib.sha1(
+            json.dumps(
+                [
+                    metadata.title,
+                    metadata.authors,
+                    metadata.description,
+                    metadata.genres,
+                    metadata.cover_path_rel,
+                    cover_stat and (cover_stat.st_size, cover_stat.st_mtime_ns),
+                    _WRITER_VERSION,
+                ]
+            ).encode()
+        ).hexdigest()[:16]
+
+        return cls(
+            to,
+            metadata_digest,
+            [
+                (chap.slug, chap.title, chapter_digest(comic_path / chap.slug))
+                for chap in comic.chapters
+            ],
+        )
+
+    def with_file(self, dest: Path) -> "OutputRecord":
+        """
+        Return this record with the size and modification time of the converted file `dest`.
+        """
+        stat = dest.stat()
+        return OutputRecord(
+            self.format, self.metadata, self.chapters, stat.st_size, stat.st_mtime_ns
+        )
+
+    def _extends(self, previous: "OutputRecord | None", dest: Path) -> bool:
+        # whether `dest` is still exactly the file that `previous` describes and
+        # this record only adds chapters after its chapters, if any
+        if previous is None or not dest.is_file():
+            return False
+        stat = dest.stat()
+        return (
+            (previous.format, previous.metadata) == (self.format, self.metadata)
+            and (previous.file_size, previous.mtime_ns) == (stat.st_size, stat.st_mtime_ns)
+            and self.chapters[: len(previous.chapters)] == previous.chapters
+        )
+
+    def up_to_date(self, previous: "OutputRecord | None", dest: Path) -> bool:
+        """
+        Return whether `previous`, the record of the existing file `dest`,
+        describes exactly the same conversion as this record.
+        """
+        return (
+            previous is not None
+            and self._extends(previous, dest)
+            and len(self.chapters) == len(previous.chapters)
+        )
+
+    def new_chapters(self, previous: "OutputRecord | None", dest: Path) -> int | None:
+        """
+        Return the number of chapters that `previous`, the record of the existing file
+        `dest`, was made from, if this record only adds chapters after them.
+
+        :returns The index of the first new chapter, or `None` if the file must be
+        converted again from scratch
+        """
+        if previous is None or not self._extends(previous, dest):
+            return None
+        if len(self.chapters) <= len(previous.chapters):
+            return None
+        return len(previous.chapters)
+
+
+@dataclass(slots=True)
+class OutputState:
+    """
+    The records of every file that a comic was converted to.
+
+    :param `comic_path`: The comic folder, which the state is saved in
+    :param `outputs`: The record of each converted file, by its absolute path
+    """
+
+    comic_path: Path
+    outputs: dict[str, OutputRecord] = field(default_factory=dict)
+    # several formats may be converted and recorded at once
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    @classmethod
+    def load(cls, comic_path: Path | str) -> "OutputState":
+        """
+        Load the state of the comic in `comic_path`, or start a new one if it does not exist.
+        """
+        comic_path = Path(comic_path)
+        try:
+            with open(comic_path / OUTPUT_STATE_FILE, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return cls(comic_path)
+
+        outputs = {}
+        for dest, record in data.items():
+            record["chapters"] = [tuple(chapter) for chapter in record["chapters"]]
+            outputs[dest] = OutputRecord(**record)
+        return cls(comic_path, outputs)
+
+    def save(self) -> None:
+        """
+        Atomically write the state to disk.
+        """
+        path = self.comic_path / OUTPUT_STATE_FILE
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({dest: asdict(record) for dest, record in self.outputs.items()}, file)
+        os.replace(tmp_path, path)
+
+    def get(self, dest: Path) -> OutputRecord | None:
+        """
+        Return the record of the converted file `dest`, if it has one.
+        """
+        return self.outputs.get(str(dest.resolve()))
+
+    def record(self, dest: Path, record: OutputRecord) -> None:
+        """
+        Record that `dest` was converted as described by `record`, and save the state.
+        """
+        with self._lock:
+            self.outputs[str(dest.resolve())] = record.with_file(dest)
+            self.save()
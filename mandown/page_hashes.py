@@ -0,0 +1,224 @@
+"""
+A per-comic index of a perceptual hash (dHash) of every page, used to find pages
+such as credits that are repeated across chapters. It lives in `<comic>/md-hashes.json`
+and is refreshed by hashing only the images that changed on disk since they were indexed.
+"""
+
+import json
+import multiprocessing as mp
+import os
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable, Sequence
+
+try:
+    from PIL import Image, ImageChops, UnidentifiedImageError
+
+    HAS_PILLOW = True
+except ImportError:
+    HAS_PILLOW = False
+
+PAGE_HASH_FILE = "md-hashes.json"
+
+# hashes are HASH_SIZE * HASH_SIZE bits
+HASH_SIZE = 8
+
+# pages whose hashes differ in at most this many bits are copies of each other
+MAX_HASH_DISTANCE = 6
+
+# hashes with fewer set or unset bits than this are of pages with too little detail
+# to tell apart, such as text on a blank background
+MIN_HASH_BITS = 16
+
+# repeated pages are moved into this folder in the comic, by chapter
+REPEATED_PAGES_FOLDER = "md-repeated-pages"
+
+# hashes are split into this many bands to find candidate copies, so any two hashes
+# within MAX_HASH_DISTANCE bits of each other have at least one equal band
+_HASH_BANDS = MAX_HASH_DISTANCE + 2
+_BAND_BITS = HASH_SIZE * HASH_SIZE // _HASH_BANDS
+
+# hashing fewer images than this is not worth starting processes for
+_MIN_PARALLEL_IMAGES = 64
+
+
+def dhash(path: Path) -> int | None:
+    """
+    Return the difference hash of the image at `path`: whether each pixel of a
+    (HASH_SIZE + 1) x HASH_SIZE thumbnail is darker than the pixel to its right.
+
+    :returns The hash, or `None` if it is not an image Pillow can read
+    """
+    try:
+        with Image.open(path) as image:
+            # JPEGs only need to be decoded at 1/8 scale
+            image.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+            if image.mode not in ("L", "RGB"):
+                image = image.convert("RGB")
+            thumb = image.resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX).convert("L")
+    except (OSError, UnidentifiedImageError):
+        return None
+
+    # compare every column with the next at once
+    left = thumb.crop((0, 0, HASH_SIZE, HASH_SIZE))
+    right = thumb.crop((1, 0, HASH_SIZE + 1, HASH_SIZE))
+    bits = ImageChops.subtract(right, left).point(lambda value: 255 if value else 0, "1")
+    return int.from_bytes(bits.tobytes(), "big")
+
+
+def _hash_entry(path: Path) -> tuple[int, int, int] | None:
+    stat = path.stat()
+    if (page_hash := dhash(path)) is None:
+        return None
+    return (page_hash, stat.st_size, stat.st_mtime_ns)
+
+
+@dataclass(slots=True)
+class PageHashIndex:
+    """
+    The perceptual hash of every page in a comic.
+
+    :param `comic_path`: The comic folder, which the index is saved in
+    :param `hashes`: The hash, file size and modification time of each page,
+    by its path relative to `comic_path`
+    :raises `ImportError`: If Pillow is not installed
+    """
+
+    comic_path: Path
+    hashes: dict[str, tuple[int, int, int]] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        if not HAS_PILLOW:
+            raise ImportError("Pillow was not found and is needed to read images. Is it installed?")
+
+    @classmethod
+    def load(cls, comic_path: Path | str) -> "PageHashIndex":
+        """
+        Load the index of the comic in `comic_path`, or start a new one if it does not exist.
+        """
+        comic_path = Path(comic_path)
+        try:
+            with open(comic_path / PAGE_HASH_FILE, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return cls(comic_path)
+        return cls(comic_path, {key: tuple(entry) for key, entry in data.items()})
+
+    def save(self) -> None:
+        """
+        Atomically write the index to disk.
+        """
+        path = self.comic_path / PAGE_HASH_FILE
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.hashes, file)
+        os.replace(tmp_path, path)
+
+    def _key(self, image: Path) -> str:
+        return image.relative_to(self.comic_path).as_posix()
+
+    def get(self, image: Path) -> int | None:
+        """
+        Return the indexed hash of `image`, or `None` if it is not indexed.
+        This does not check whether the image changed since it was indexed.
+        """
+        entry = self.hashes.get(self._key(image))
+        return entry[0] if entry is not None else None
+
+    def refresh(self, images: Iterable[Path], threads: int = 4) -> None:
+        """
+        Make the index match `images`, hashing the images that are new or changed
+        since they were indexed in parallel. Images that are not in `images` are
+        removed from the index.
+
+        :param `images`: Every page in the comic
+        :param `threads`: The number of processes to hash images with
+        """
+        current: dict[str, tuple[int, int, int]] = {}
+        stale: list[Path] = []
+        for image in images:
+            key = self._key(image)
+            entry = self.hashes.get(key)
+            try:
+                stat = image.stat()
+            except FileNotFoundError:
+                continue
+            if entry is not None and entry[1:] == (stat.st_size, stat.st_mtime_ns):
+                current[key] = entry
+            else:
+                stale.append(image)
+
+        if threads > 1 and len(stale) >= _MIN_PARALLEL_IMAGES:
+            with mp.Pool(threads) as pool:
+                entries = pool.map(_hash_entry, stale, chunksize=16)
+        else:
+            entries = [_hash_entry(image) for image in stale]
+
+        for image, new_entry in zip(stale, entries, strict=True):
+            if new_entry is not None:
+                current[self._key(image)] = new_entry
+        self.hashes = current
+
+
+def is_informative(page_hash: int) -> bool:
+    """
+    Return whether `page_hash` has enough set and unset bits to be compared with
+    other hashes. Blank or mostly blank pages, such as pages with a few lines of
+    text on white, hash to nearly 0 whatever their content, so they are never
+    considered copies of each other.
+    """
+    return MIN_HASH_BITS <= page_hash.bit_count() <= HASH_SIZE * HASH_SIZE - MIN_HASH_BITS
+
+
+def find_repeated_pages(
+    chapters: Sequence[Sequence[Path]], index: PageHashIndex, max_repeats: int
+) -> list[Path]:
+    """
+    Find the pages that appear, as exact or near copies, in more than `max_repeats`
+    chapters. Each distinct hash is compared with the first hash of every group found
+    so far, so pages are only grouped if they are all close to the same page. Only
+    groups that share a band of the hash are compared, so this does not compare
+    every pair of pages.
+
+    :param `chapters`: The pages of each chapter, which must all be in `index`
+    :param `index`: The hashes of the pages
+    :param `max_repeats`: The number of chapters a page can appear in
+    :returns Every copy of each repeated page, in the order of `chapters`
+    """
+    # distinct hashes, in the order they first appear
+    chapters_by_hash: dict[int, set[int]] = {}
+    for chapter_num, images in enumerate(chapters):
+        for image in images:
+            page_hash = index.get(image)
+            if page_hash is not None and is_informative(page_hash):
+                chapters_by_hash.setdefault(page_hash, set()).add(chapter_num)
+
+    mask = (1 << _BAND_BITS) - 1
+    # the representative of each group, which is the hash it was started by, by band
+    buckets: defaultdict[tuple[int, int], list[int]] = defaultdict(list)
+    group_chapters: dict[int, set[int]] = {}
+    group_of: dict[int, int] = {}
+    for page_hash, chapter_nums in chapters_by_hash.items():
+        bands = [(band, (page_hash >> (band * _BAND_BITS)) & mask) for band in range(_HASH_BANDS)]
+        candidates = {rep for band in bands for rep in buckets.get(band, ())}
+        nearest = min(
+            candidates, key=lambda rep: ((page_hash ^ rep).bit_count(), rep), default=None
+        )
+        if nearest is not None and (page_hash ^ nearest).bit_count() <= MAX_HASH_DISTANCE:
+            group = nearest
+        else:
+            # start a new group with this hash as its representative
+            group = page_hash
+            group_chapters[group] = set()
+            for band in bands:
+                buckets[band].append(group)
+        group_of[page_hash] = group
+        group_chapters[group] |= chapter_nums
+
+    repeated = {
+        page_hash
+        for page_hash, group in group_of.items()
+        if len(group_chapters[group]) > max_repeats
+    }
+    return [image for images in chapters for image in images if index.get(image) in repeated]
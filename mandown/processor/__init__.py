@@ -1,8 +1,21 @@
+import hashlib
+import json
+import math
+import shutil
+from dataclasses import asdict
 from enum import Enum
+from io import BytesIO
 from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Callable, cast
 
-from .ops import OutputProcessContainer, ProcessConfig, ProcessContainer
+from .ops import (
+    Box,
+    OutputProcessContainer,
+    ProcessConfig,
+    ProcessContainer,
+    tall_page_height,
+)
+from .state import PROCESSED_STATE_FILE, ProcessedState
 
 try:
     from PIL import Image, ImageFile
@@ -36,9 +49,21 @@ class ProcessOps(str, Enum):
     RESIZE = "resize"
     """Resize images to a maximum width and height."""
 
+    SPLIT_TALL_PAGES = "split_tall_pages"
+    """Cut pages much taller than the target size into pages of the target aspect ratio."""
+
+    GRAYSCALE = "grayscale"
+    """Convert images to grayscale, for e-ink screens."""
+
     WEBP_TO_PNG = "webp_to_png"
     """Convert any WEBP images to PNG."""
 
+    WEBP_TO_JPEG = "webp_to_jpeg"
+    """Convert any WEBP images to JPEG."""
+
+    DROP_DUPLICATE_PAGES = "drop_duplicate_pages"
+    """Remove pages, such as credits, that are repeated in many chapters."""
+
 
 """A list of operations that can be chained."""
 IN_MEM_PROCESS_OPS = {
@@ -46,42 +71,417 @@ IN_MEM_PROCESS_OPS = {
     ProcessOps.SPLIT_DOUBLE_PAGES,
     ProcessOps.TRIM_BORDERS,
     ProcessOps.RESIZE,
+    ProcessOps.SPLIT_TALL_PAGES,
+    ProcessOps.GRAYSCALE,
 }
 
 """A list of operations that must be run last."""
 OUTPUT_PROCESS_OPS = {
     ProcessOps.WEBP_TO_PNG,
+    ProcessOps.WEBP_TO_JPEG,
 }
 
 
+"""Operations that run on the whole comic before any image is processed."""
+COMIC_PROCESS_OPS = {
+    ProcessOps.DROP_DUPLICATE_PAGES,
+}
+
+ProcessResult = Image.Image | tuple[Image.Image, ...] | None
+
+
 class ProcessOptionMismatchError(Exception):
     """Raised when an option is not valid for a given operation or
     there are missing options."""
 
 
+"""Operations that only change images that are wider than they are tall."""
+DIMENSION_OPS = {
+    ProcessOps.ROTATE_DOUBLE_PAGES,
+    ProcessOps.SPLIT_DOUBLE_PAGES,
+}
+
+"""
+Operations that only crop or resize, so `Processor` can defer their crops and
+fold them into the next operation that needs the pixels.
+"""
+DEFERRED_CROP_OPS = {
+    ProcessOps.SPLIT_DOUBLE_PAGES,
+    ProcessOps.TRIM_BORDERS,
+    ProcessOps.RESIZE,
+}
+
+"""Operations that depend on the output profile."""
+PROFILE_OPS = {
+    ProcessOps.RESIZE,
+    ProcessOps.SPLIT_TALL_PAGES,
+}
+
+"""
+Operations that may run before `resize` when decoding a smaller draft of the image,
+mapped to how much larger than the target size the decoded image must be so that
+`resize` still downscales. Rotated pages may be resized in either orientation, split
+pages are half as wide, and trimmed borders are assumed to be less than 20% of each side.
+"""
+DRAFT_SAFE_OPS: dict[ProcessOps, Callable[[tuple[float, float]], tuple[float, float]]] = {
+    ProcessOps.ROTATE_DOUBLE_PAGES: lambda size: (max(size), max(size)),
+    ProcessOps.SPLIT_DOUBLE_PAGES: lambda size: (size[0] * 2, size[1]),
+    ProcessOps.TRIM_BORDERS: lambda size: (size[0] * 1.25, size[1] * 1.25),
+    ProcessOps.GRAYSCALE: lambda size: size,
+}
+
+
+def draft_size(
+    operations: list[ProcessOps], target_size: tuple[int, int] | None
+) -> tuple[int, int] | None:
+    """
+    Return the smallest size an image can be decoded at so that `operations` produce the
+    same result as at full resolution, or `None` if it must be decoded at full resolution.
+
+    :param operations: The operations that will be run on the image
+    :param target_size: The size images are resized to
+    """
+    if target_size is None or ProcessOps.RESIZE not in operations:
+        return None
+
+    before_resize = operations[: operations.index(ProcessOps.RESIZE)]
+    size: tuple[float, float] = target_size
+    for op in reversed(before_resize):
+        if op not in DRAFT_SAFE_OPS:
+            return None
+        size = DRAFT_SAFE_OPS[op](size)
+    return (math.ceil(size[0]), math.ceil(size[1]))
+
+
+def check_operations(operations: list[ProcessOps], config: ProcessConfig) -> None:
+    """
+    Check that `operations` can be run with `config`.
+
+    :raises ProcessOptionMismatchError: If an option is not valid for a
+    given operation or there are missing options
+    """
+    resize_op_valid = bool(
+        config.output_profile or config.target_size or config.output_profiles
+    ) ^ bool(ProcessOps.RESIZE in operations or ProcessOps.SPLIT_TALL_PAGES in operations)
+    if resize_op_valid:
+        # if any of the following is true:
+        # - target_size is set and neither resize nor split_tall_pages are
+        # - profile is set and neither resize nor split_tall_pages are
+        # - resize or split_tall_pages is set and neither target_size nor profile is set
+        # testing if only one of them is set is done in the resize op itself
+        raise ProcessOptionMismatchError(
+            "resize and split_tall_pages must be used with target_size or profile"
+        )
+
+    output_ops = [op for op in operations if op in OUTPUT_PROCESS_OPS]
+    if len(output_ops) > 1:
+        # only one output operation can be run
+        raise ProcessOptionMismatchError(
+            "Only one output operation can be run. "
+            f"{output_ops[0]} and {output_ops[1]} were both found."
+        )
+
+
+class Pipeline:
+    """
+    A list of operations that is checked and resolved once, so it can be run on
+    many images without repeating that work for each one. Pipelines can be
+    pickled to run in other processes.
+
+    :param `operations`: The operations to run on each image, in order.
+    If "none" is in `operations`, no post-processing will be done.
+    :param `config`: Options for processing operations
+    :raises `NotImplementedError`: If an operation is not implemented
+    :raises `ProcessOptionMismatchError`: If an option is not valid for
+    a given operation or there are missing options
+    """
+
+    __slots__ = (
+        "config",
+        "enabled",
+        "steps",
+        "writer",
+        "draft_size",
+        "draft_mode",
+        "fingerprint",
+        "variants",
+    )
+
+    def __init__(self, operations: list[ProcessOps], config: ProcessConfig | None = None) -> None:
+        self.config = config or ProcessConfig()
+        self.enabled = ProcessOps.NO_POSTPROCESSING not in operations
+
+        self.steps: list[tuple[ProcessOps, Callable[..., ProcessResult]]] = []
+        self.writer: Callable[[OutputProcessContainer], None] = OutputProcessContainer.default
+        self.draft_size: tuple[int, int] | None = None
+        self.draft_mode: str | None = None
+        self.fingerprint = ""
+        self.variants: dict[str, Pipeline] = {}
+        if not self.enabled:
+            return
+
+        check_operations(operations, self.config)
+
+        if self.config.output_profiles:
+            self._split_variants(operations)
+            return
+
+        if self.config.wants_grayscale and ProcessOps.GRAYSCALE not in operations:
+            # converting first means every later operation only works on one band
+            operations = [ProcessOps.GRAYSCALE, *operations]
+
+        for func in operations:
+            try:
+                op = ProcessOps(func)
+                if op in OUTPUT_PROCESS_OPS:
+                    self.writer = getattr(OutputProcessContainer, op)
+                elif op not in COMIC_PROCESS_OPS:
+                    self.steps.append((op, getattr(ProcessContainer, op)))
+            except (ValueError, AttributeError) as err:
+                raise NotImplementedError(
+                    f"{func} is not a valid post-processing function."
+                ) from err
+
+        self.draft_size = draft_size([op for op, _ in self.steps], self.config.target_size)
+        # JPEGs can be decoded straight to grayscale, skipping the colour conversion
+        if self.steps and self.steps[0][0] == ProcessOps.GRAYSCALE:
+            self.draft_mode = "L"
+
+        self._set_fingerprint()
+
+    def _set_fingerprint(self) -> None:
+        # identifies what images processed by this pipeline look like
+        self.fingerprint = hashlib.sha1(
+            json.dumps(
+                [[op for op, _ in self.steps], self.writer.__name__, asdict(self.config)]
+            ).encode()
+        ).hexdigest()[:16]
+
+    def _split_variants(self, operations: list[ProcessOps]) -> None:
+        """
+        Build a pipeline for each of `config.output_profiles`, and move the steps at the
+        start that are the same for every profile into this one so they only run once.
+        """
+        self.variants = {
+            profile: Pipeline(operations, config)
+            for profile, config in self.config.variants().items()
+        }
+        variants = list(self.variants.values())
+
+        shared = 0
+        for steps in zip(*(variant.steps for variant in variants)):
+            ops = {op for op, _ in steps}
+            if len(ops) > 1 or ops & PROFILE_OPS:
+                break
+            shared += 1
+
+        self.steps = variants[0].steps[:shared]
+        self.writer = variants[0].writer
+        for variant in variants:
+            variant.steps = variant.steps[shared:]
+
+        # decode at the largest size and the most bands that any variant needs
+        if all(variant.draft_size for variant in variants):
+            self.draft_size = cast(
+                tuple[int, int],
+                tuple(map(max, *(cast(tuple[int, int], v.draft_size) for v in variants))),
+            )
+        if {variant.draft_mode for variant in variants} == {"L"}:
+            self.draft_mode = "L"
+        self._set_fingerprint()
+
+    def may_change(self, size: tuple[int, int], mode: str | None = None) -> bool:
+        """
+        Return whether the pipeline may change an image with dimensions `size`. If it
+        returns `False`, processing the image would neither decode nor write it.
+
+        :param `size`: The (width, height) of the image
+        :param `mode`: The Pillow mode of the image, or `None` if it is not known
+        """
+        if not self.enabled:
+            return False
+        if self.variants or self.writer is not OutputProcessContainer.default:
+            return True
+
+        width, height = size
+        for op, _ in self.steps:
+            if op == ProcessOps.RESIZE:
+                if size != self.config.target_size:
+                    return True
+            elif op in DIMENSION_OPS:
+                if width > height:
+                    return True
+            elif op == ProcessOps.SPLIT_TALL_PAGES:
+                if tall_page_height(size, self.config.target_size) is not None:
+                    return True
+            elif op == ProcessOps.GRAYSCALE:
+                if mode is None or not self.config.is_grayscale(mode):
+                    return True
+            else:
+                return True
+        return False
+
+    def process(self, image_path: Path | str, filename: Path | str | None = None) -> bool:
+        """
+        Run the pipeline on the image at `image_path` and save it to disk.
+
+        :param `image_path`: The image to process
+        :param `filename`: The filename to save the image as, instead of `image_path`
+        :returns Whether the image was written to disk (it is not if nothing changed)
+        :raises `OSError`: If there is an error in reading or saving the image
+        """
+        if not self.enabled:
+            return False
+        with Processor(image_path, self.config) as processor:
+            return processor.run(self, filename)
+
+    def process_variants(
+        self, image_path: Path | str, comic_path: Path | str, variant_paths: dict[str, Path]
+    ) -> None:
+        """
+        Run the pipeline on the image at `image_path` once for each of its output
+        profiles, decoding the image and running the shared steps only once.
+
+        :param `image_path`: The image to process, inside `comic_path`
+        :param `comic_path`: The comic folder containing `image_path`
+        :param `variant_paths`: The folder to save each profile's copy of the comic in
+        :raises `OSError`: If there is an error in reading or saving the image
+        """
+        relative_path = Path(image_path).relative_to(comic_path)
+        with Processor(image_path, self.config) as processor:
+            processor.draft(self)
+            try:
+                split_off = processor._run_steps(self.steps)
+            except OSError as err:
+                raise OSError(f"Error in {image_path}") from err
+            pages = [processor.image, *split_off]
+
+            for profile, variant in self.variants.items():
+                filename = variant_paths[profile] / relative_path
+                filename.parent.mkdir(parents=True, exist_ok=True)
+
+                outputs: list[Image.Image] = []
+                is_modified = processor.is_modified
+                for page in pages:
+                    page_processor = Processor(image_path, variant.config, image=page)
+                    page_split_off = page_processor._run_steps(variant.steps)
+                    outputs.extend((page_processor.image, *page_split_off))
+                    is_modified = is_modified or page_processor.is_modified
+
+                if not is_modified and not variant.converts(filename):
+                    # copy unchanged images instead of encoding them again
+                    shutil.copyfile(image_path, filename)
+                    continue
+
+                writer = Processor(image_path, variant.config, image=outputs[0])
+                writer.new_images = outputs[1:]
+                writer._write(filename, variant.writer)
+
+    def converts(self, filename: Path | str) -> bool:
+        """
+        Return whether the output operation changes the image saved as `filename`
+        even if no other operation changed it.
+        """
+        # every output operation converts WEBP images, and writes anything else as is
+        return (
+            self.writer is not OutputProcessContainer.default and Path(filename).suffix == ".webp"
+        )
+
+    def process_bytes(self, data: bytes, image_path: Path | str) -> bool:
+        """
+        Run the pipeline on an encoded image in memory and save it to `image_path`.
+
+        :param `data`: The encoded image
+        :param `image_path`: The path to save the processed image to
+        :returns Whether the image was written to disk (it is not if nothing changed)
+        :raises `OSError`: If there is an error in reading or saving the image
+        """
+        if not self.enabled:
+            return False
+        with Processor.from_bytes(data, image_path, self.config) as processor:
+            return processor.run(self)
+
+    def process_entry(self, data: bytes, name: str) -> dict[str, bytes] | None:
+        """
+        Run the pipeline on an encoded image in memory, such as an entry of an archive,
+        and return the encoded results instead of writing them to disk.
+
+        :param `data`: The encoded image
+        :param `name`: The name of the image, which the results are named after
+        :returns The encoded images by name (several if the image was split, or renamed
+        if its format changed), or `None` if nothing changed
+        :raises `OSError`: If there is an error in reading or encoding the image
+        """
+        if not self.enabled:
+            return None
+        outputs: dict[str, bytes] = {}
+        with Processor.from_bytes(data, name, self.config) as processor:
+            return outputs if processor.run(self, outputs=outputs) else None
+
+
 class Processor(ProcessContainer):
     """
-    A class for processing images.
+    A class for processing images. Use it as a context manager
+    to close the image file when processing is done.
 
-    :param `image_path`: The path to the image to process
+    :param `image_path`: The path to the image to process, and to save it to
+    :param `config`: Options for processing operations
+    :param `image`: An already opened image to process instead of reading `image_path`
     :raises `ImportError`: If Pillow is not installed
     :raises `ProcessOptionMismatchError`: If an option is not valid for
     a given operation or there are missing options
     """
 
-    def __init__(self, image_path: Path | str, config: ProcessConfig | None = None) -> None:
+    def __init__(
+        self,
+        image_path: Path | str,
+        config: ProcessConfig | None = None,
+        image: Image.Image | None = None,
+    ) -> None:
         if not HAS_PILLOW:
             raise ImportError("Pillow was not found and is needed for processing. Is it installed?")
 
         super().__init__(config)
         self.image_path = Path(image_path)
-        self._image = Image.open(self.image_path)
+        self._image = image if image is not None else Image.open(self.image_path)
+        self._source = self._image
         self.is_modified = False
 
         # WARN: dangerous if there are multiple types of operations
         # that would add new image files to be written
         self.new_images: list[Image.Image] = []
 
+    @classmethod
+    def from_bytes(
+        cls, data: bytes, image_path: Path | str, config: ProcessConfig | None = None
+    ) -> "Processor":
+        """
+        Create a processor for an image that is in memory, such as one that was just
+        downloaded. The processed image is saved to `image_path`.
+
+        :param `data`: The encoded image
+        :param `image_path`: The path to save the processed image to
+        :param `config`: Options for processing operations
+        :raises `ImportError`: If Pillow is not installed
+        """
+        if not HAS_PILLOW:
+            raise ImportError("Pillow was not found and is needed for processing. Is it installed?")
+        return cls(image_path, config, image=Image.open(BytesIO(data)))
+
+    def __enter__(self) -> "Processor":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close the opened image and drop the processed images.
+        """
+        self._source.close()
+        self._image = self._source
+        self.new_images.clear()
+
     @property
     def image(self) -> Image.Image:
         """
@@ -101,84 +501,168 @@ class Processor(ProcessContainer):
         self, filename: Path | str | None = None, output_process_op: ProcessOps | None = None
     ) -> None:
         """Save the processed image(s) manually"""
-        filename = Path(filename or self.image_path)
+        self._write(filename, getattr(OutputProcessContainer, output_process_op or "default"))
 
-        writer = OutputProcessContainer(self.image, filename)
-        getattr(writer, output_process_op or "default")()  # this is so janky
+    def _write(
+        self,
+        filename: Path | str | None,
+        writer: Callable[[OutputProcessContainer], None],
+        outputs: dict[str, bytes] | None = None,
+    ) -> None:
+        filename = Path(filename or self.image_path)
+        writer(OutputProcessContainer(self.image, filename, self.config, outputs))
 
         for image in self.new_images:
             # increment by one "a" each time
             filename = filename.with_stem(filename.stem + "a")
-            writer = OutputProcessContainer(image, filename)
-            getattr(writer, output_process_op or "default")()
+            writer(OutputProcessContainer(image, filename, self.config, outputs))
 
-    def process(self, operations: list[ProcessOps], filename: Path | str | None = None) -> None:
+    def process(self, operations: list[ProcessOps], filename: Path | str | None = None) -> bool:
         """
         Perform the operations in `operations` on the image in sequence
         and save it to disk. If `filename` is not None, it will be saved
         with that filename instead. If "none" is in `operations`, no
-        post-processing will be done.
+        post-processing will be done. To run the same operations on many
+        images, create a `Pipeline` once and use `run` instead.
 
         :param operations: A list of operations to perform on the image
         :param filename: The filename to save the image as
+        :returns Whether the image was written to disk (it is not if nothing changed)
         :raises NotImplementedError: If an operation is not implemented
         :raises OSError: If there is an error in saving the image
         :raises ProcessOptionMismatchError: If an option is not valid for a
         given operation or there are missing options
         """
-        if ProcessOps.NO_POSTPROCESSING in operations:
-            return
+        return self.run(Pipeline(operations, self.config), filename)
+
+    def run(
+        self,
+        pipeline: Pipeline,
+        filename: Path | str | None = None,
+        outputs: dict[str, bytes] | None = None,
+    ) -> bool:
+        """
+        Run a `Pipeline` on the image and save it to disk. If `filename`
+        is not None, it will be saved with that filename instead.
 
-        # TODO: move all the checks together
-        # there are some in ProcessConfig rn
-        resize_op_valid = bool(self.config.output_profile or self.config.target_size) ^ bool(
-            ProcessOps.RESIZE in operations
-        )
-        if resize_op_valid:
-            # if any of the following is true:
-            # - target_size is set and resize is not
-            # - profile is set and resize is not
-            # - resize is set and neither target_size nor profile is set
-            # testing if only one of them is set is done in the resize op itself
-            raise ProcessOptionMismatchError("resize must be used with target_size or profile")
+        :param pipeline: The operations to perform on the image
+        :param filename: The filename to save the image as
+        :param outputs: If not None, the encoded images are stored in it by
+        filename instead of being written to disk
+        :returns Whether the image was written to disk (it is not if nothing changed)
+        :raises OSError: If there is an error in saving the image
+        """
+        if not pipeline.enabled:
+            return False
 
-        output_op: ProcessOps | None = None
+        self.draft(pipeline)
+        try:
+            self.new_images.extend(self._run_steps(pipeline.steps))
+        except OSError as err:
+            raise OSError(f"Error in {self.image_path}") from err
 
-        for func in operations:
-            if func in OUTPUT_PROCESS_OPS:
-                if output_op:
-                    # only one output operation can be run
-                    raise ProcessOptionMismatchError(
-                        "Only one output operation can be run."
-                        f"{output_op} and {func} were both found."
-                    )
-                output_op = func
+        if self.is_modified or pipeline.converts(filename or self.image_path):
+            # only write to disk if something has actually changed
+            self._write(filename, pipeline.writer, outputs)
+            return True
+        return False
+
+    def draft(self, pipeline: Pipeline) -> None:
+        """
+        If the image is a JPEG, only decode as many pixels (and bands) as `pipeline` will keep.
+        """
+        if (pipeline.draft_size or pipeline.draft_mode) and self.image.format == "JPEG":
+            full_size, full_mode = self.image.size, self.image.mode
+            self.image.draft(pipeline.draft_mode or full_mode, pipeline.draft_size or full_size)
+            # a draft that is already the target size would otherwise not be written
+            self.is_modified = (self.image.size, self.image.mode) != (full_size, full_mode)
+
+    def _run_steps(
+        self, steps: list[tuple[ProcessOps, Callable[..., ProcessResult]]]
+    ) -> list[Image.Image]:
+        """
+        Run `steps` on the image. Pages that are split off of it are run through
+        the steps after the one that split them off.
+
+        :returns The pages that were split off, in page order
+        """
+        # a crop of self.image that has not been made yet, so that a chain like
+        # trim_borders -> resize only copies and resamples the image once
+        box: Box | None = None
+        # pages that were split off, and the step to continue processing them from
+        split_off: list[tuple[int, list[Image.Image]]] = []
+
+        for i, (op, func) in enumerate(steps, start=1):
+            if op in DEFERRED_CROP_OPS:
+                box, extra = self._process_deferred(op, box)
+                if extra is not None:
+                    split_off.append((i, [extra]))
                 continue
 
-            try:
-                images: tuple[Image.Image, ...] | Image.Image | None = getattr(self, func)(
-                    self.image
-                )
+            if box is not None:
+                self.image = self.image.crop(box)
+                box = None
 
-                if images is None:
-                    continue
+            images = func(self, self.image)
 
-                if isinstance(images, Image.Image):
-                    images = (images,)
+            if images is None:
+                continue
 
-                self.image = images[0]
+            if isinstance(images, Image.Image):
+                images = (images,)
 
-                if len(images) > 1:
-                    self.new_images.extend(images[1:])
+            self.image = images[0]
 
-                self.is_modified = True
-            except AttributeError as err:
-                raise NotImplementedError(
-                    f"{func} is not a valid post-processing function."
-                ) from err
-            except OSError as err:
-                raise OSError(f"Error in {self.image_path}") from err
+            if len(images) > 1:
+                split_off.append((i, list(images[1:])))
 
-        if self.is_modified or output_op:
-            # only write to disk if something has actually changed
-            self.write(filename, output_op)
+            # drop the previous image now rather than at the next op
+            del images
+            self.is_modified = True
+
+        if box is not None:
+            self.image = self.image.crop(box)
+
+        # pages split off by later steps come from the part of the page that was
+        # kept by earlier ones, so they come first
+        pages: list[Image.Image] = []
+        for start, images in reversed(split_off):
+            for image in images:
+                page = Processor(self.image_path, self.config, image=image)
+                extra_pages = page._run_steps(steps[start:])
+                pages.extend((page.image, *extra_pages))
+        return pages
+
+    def _process_deferred(
+        self, func: ProcessOps, box: Box | None
+    ) -> tuple[Box | None, Image.Image | None]:
+        """
+        Run an operation from `DEFERRED_CROP_OPS` on the region `box` of the image
+        without copying it, where possible.
+
+        :returns The region of the image that is left to crop, if any,
+        and the page that was split off of it, if any
+        """
+        if func == ProcessOps.RESIZE:
+            if self.config.target_size is None:
+                return box, None
+            if (resized := self.resize(self.image, box)) is not None:
+                self.image = resized
+            return None, None
+
+        left, upper, right, lower = box or (0, 0, *self.image.size)
+
+        if func == ProcessOps.SPLIT_DOUBLE_PAGES:
+            if not right - left > lower - upper:
+                return box, None
+            middle = left + (right - left) // 2
+            self.is_modified = True
+            return (left, upper, middle, lower), self.image.crop((middle, upper, right, lower))
+
+        # trim_borders needs the pixels of the region
+        if box is not None:
+            self.image = self.image.crop(box)
+        bbox = self.border_bbox(self.image)
+        if bbox is not None:
+            self.is_modified = True
+        return bbox, None
@@ -1,14 +1,19 @@
-from dataclasses import dataclass
+import math
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from io import BytesIO
+from itertools import pairwise
 from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any
 
 from .profiles import SupportedProfiles, all_profiles
 
 try:
-    from PIL import Image, ImageChops
+    from PIL import Image, ImageChops, ImageStat
 
     if not hasattr(Image, "Resampling"):  # Pillow<9.0
         Image.Resampling = Image
+        Image.Transpose = Image
 except ImportError:
     if not TYPE_CHECKING:
 
@@ -19,6 +24,114 @@ except ImportError:
         class ImageChops:
             pass
 
+        class ImageStat:
+            pass
+
+
+Box = tuple[int, int, int, int]
+"""A region of an image, as (left, upper, right, lower)."""
+
+REDUCING_GAP = 3.0
+"""How much larger than the target size an image must be before it is reduced by whole factors."""
+
+TALL_PAGE_RATIO = 1.2
+"""How much taller than the target aspect ratio a page must be for `split_tall_pages` to cut it."""
+
+MIN_SPLIT_PAGE_HEIGHT = 32
+"""
+How tall the pages `split_tall_pages` would cut must be, at least. Very narrow strips,
+like spacers between webtoon panels, are left whole.
+"""
+
+BORDER_THRESHOLD = 100
+"""How much a pixel must differ from the background colour to not be part of the border."""
+
+BORDER_PROXY_PIXELS = 250_000
+"""How many pixels the reduced copy of an image used to find its borders has, at most."""
+
+MAX_BORDER_PROXY_FACTOR = 10
+"""
+How much the copy of an image used to find its borders is reduced by, at most, so that
+a single content pixel still differs from the background by at least 1 in the copy.
+"""
+
+REDUCIBLE_MODES = {"L", "LA", "RGB", "RGBA", "RGBa", "La", "CMYK", "YCbCr", "I", "F"}
+"""The image modes that `Image.reduce` supports."""
+
+
+def _content_bbox(
+    image: Image.Image, background: Any, threshold: int = BORDER_THRESHOLD
+) -> Box | None:
+    """
+    Return the box of the pixels in `image` that differ from `background`
+    by more than `threshold` in any band.
+    """
+    bg = Image.new(image.mode, image.size, background)
+    diff = ImageChops.difference(image, bg)
+    diff = ImageChops.add(diff, diff, 2.0, -threshold)
+    return diff.getbbox()
+
+
+def _flattest_row(image: Image.Image, upper: int, lower: int) -> int:
+    """
+    Return the row between `upper` and `lower` with the least variation in brightness,
+    preferring lower rows. Only that band of the image is converted and measured.
+    """
+    band = image.crop((0, upper, image.width, lower)).convert("L")
+    # each row only needs to be measured roughly
+    if (factor := band.width // 128) > 1:
+        band = band.reduce((factor, 1))
+
+    variances = [
+        ImageStat.Stat(band.crop((0, row, band.width, row + 1))).var[0]
+        for row in range(band.height)
+    ]
+    flattest = min(variances)
+    # rows that are practically as flat, like the rest of a gutter, are just as good
+    return upper + max(row for row, variance in enumerate(variances) if variance <= flattest + 1)
+
+
+def tall_page_height(size: tuple[int, int], target_size: tuple[int, int] | None) -> int | None:
+    """
+    Return the height of the pages that `split_tall_pages` cuts an image into,
+    or `None` if the image is not cut.
+
+    :param `size`: The (width, height) of the image
+    :param `target_size`: The (width, height) whose aspect ratio pages are cut to
+    """
+    if target_size is None:
+        return None
+    width, height = size
+    page_height = round(width * target_size[1] / target_size[0])
+    if page_height < MIN_SPLIT_PAGE_HEIGHT or height <= page_height * TALL_PAGE_RATIO:
+        return None
+    return page_height
+
+
+def _has_alpha(image: Image.Image) -> bool:
+    return image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+
+
+def _on_white(image: Image.Image, mode: str) -> Image.Image:
+    """
+    Return `image` in `mode` (`RGB` or `L`) with its transparent areas put on white,
+    since converting it would otherwise drop the transparency and leave them black.
+    """
+    image = image.convert("RGBA" if mode == "RGB" else "LA")
+    background = Image.new(mode, image.size, "white")
+    background.paste(image, mask=image.getchannel("A"))
+    return background
+
+
+@lru_cache(maxsize=None)
+def _gray_levels_lut(levels: int) -> list[int]:
+    """
+    Return a lookup table mapping each shade of gray to the nearest of `levels` evenly
+    spaced shades, without dithering so flat areas stay flat.
+    """
+    step = 255 / (levels - 1)
+    return [round(round(value / step) * step) for value in range(256)]
+
 
 @dataclass(kw_only=True, slots=True)
 class ProcessConfig:
@@ -29,6 +142,18 @@ class ProcessConfig:
     used if `resize` is enabled. Mutually exclusive with `output_profile`.
     :param `output_profile`: The output size profile to use for
     the image. Only used if `resize` is enabled. Mutually exclusive with `target_size`.
+    :param `jpeg_quality`: The quality (1-95) of written JPEG images
+    :param `jpeg_optimize`: Whether to optimise the encoder settings of written JPEG images
+    :param `jpeg_progressive`: Whether to write progressive JPEG images
+    :param `png_compress_level`: The compression level (0-9) of written PNG images
+    :param `webp_quality`: The quality (1-100) of written WEBP images
+    :param `grayscale`: Whether to always convert images to grayscale
+    (defaults to whether the device of `output_profile` is grayscale)
+    :param `grayscale_levels`: The number of shades of gray (2-256) to reduce images to
+    :param `output_profiles`: Several output size profiles to process images for at
+    once. Mutually exclusive with `target_size` and `output_profile`.
+    :param `max_page_repeats`: The number of chapters a page can appear in before
+    `drop_duplicate_pages` removes it
     :raises `ValueError`: If incompatible options are supplied
     :raises `KeyError`: `output_profile` is not a real key (see mandown/processor/profiles.py).
     """
@@ -45,9 +170,67 @@ class ProcessConfig:
     used if `resize` is enabled. Mutually exclusive with `target_size`.
     """
 
+    jpeg_quality: int = 75
+    """The quality (1-95) of written JPEG images."""
+
+    jpeg_optimize: bool = False
+    """Whether to make an extra pass to choose smaller JPEG encoder settings."""
+
+    jpeg_progressive: bool = False
+    """Whether to write progressive JPEG images."""
+
+    png_compress_level: int = 6
+    """The zlib compression level (0-9) of written PNG images."""
+
+    webp_quality: int = 80
+    """The quality (1-100) of written WEBP images."""
+
+    grayscale: bool | None = None
+    """
+    Whether to convert images to grayscale even if `grayscale` is not one of the
+    operations. Defaults to whether the device of `output_profile` is grayscale.
+    """
+
+    grayscale_levels: int = 256
+    """The number of shades of gray (2-256) that `grayscale` reduces images to."""
+
+    output_profiles: tuple[SupportedProfiles, ...] = ()
+    """
+    Several output size profiles to process each image for at once, writing each
+    variant to its own folder. Mutually exclusive with `target_size` and `output_profile`.
+    """
+
+    max_page_repeats: int = 3
+    """
+    The number of chapters a page (or a near copy of it) can appear in before
+    `drop_duplicate_pages` removes every copy of it.
+    """
+
     def __post_init__(self) -> None:
         if self.target_size is not None and self.output_profile is not None:
             raise ValueError("Only one of `target_size` or `output_profile` can be specified.")
+        if self.output_profiles and (self.target_size or self.output_profile):
+            raise ValueError(
+                "`output_profiles` cannot be used with `target_size` or `output_profile`."
+            )
+        self.output_profiles = tuple(dict.fromkeys(self.output_profiles))
+        for profile in self.output_profiles:
+            if profile not in all_profiles:
+                raise KeyError(
+                    f"Invalid output profile: {profile}. See mandown."
+                    "all_profiles or mandown --list-profiles for a list of valid profiles."
+                )
+
+        if not 1 <= self.jpeg_quality <= 95:
+            raise ValueError("`jpeg_quality` must be between 1 and 95.")
+        if not 0 <= self.png_compress_level <= 9:
+            raise ValueError("`png_compress_level` must be between 0 and 9.")
+        if not 1 <= self.webp_quality <= 100:
+            raise ValueError("`webp_quality` must be between 1 and 100.")
+        if not 2 <= self.grayscale_levels <= 256:
+            raise ValueError("`grayscale_levels` must be between 2 and 256.")
+        if self.max_page_repeats < 1:
+            raise ValueError("`max_page_repeats` must be at least 1.")
 
         if self.output_profile is not None:
             if self.output_profile not in all_profiles:
@@ -57,6 +240,33 @@ class ProcessConfig:
                 )
             self.target_size = all_profiles[self.output_profile].size
 
+    def variants(self) -> dict[SupportedProfiles, "ProcessConfig"]:
+        """
+        Return a config for each of `output_profiles`, with the other options of this one.
+        """
+        return {
+            profile: replace(self, target_size=None, output_profile=profile, output_profiles=())
+            for profile in self.output_profiles
+        }
+
+    @property
+    def wants_grayscale(self) -> bool:
+        """
+        Whether images should be converted to grayscale automatically.
+        """
+        if self.grayscale is not None:
+            return self.grayscale
+        return self.output_profile is not None and all_profiles[self.output_profile].grayscale
+
+    def is_grayscale(self, mode: str) -> bool:
+        """
+        Whether images in `mode` are already grayscale with at most `grayscale_levels`
+        shades, so `grayscale` leaves them as they are.
+
+        :param `mode`: The Pillow image mode, such as `L`
+        """
+        return mode == "L" and self.grayscale_levels == 256
+
 
 class ProcessContainer:
     """
@@ -82,7 +292,8 @@ class ProcessContainer:
         """
         width, height = image.size
         if width > height:
-            return image.rotate(90, expand=1)
+            # transposing moves pixels without resampling them like rotate does
+            return image.transpose(Image.Transpose.ROTATE_90)
         return None
 
     def split_double_pages(self, image: Image.Image) -> tuple[Image.Image, Image.Image] | None:
@@ -97,30 +308,143 @@ class ProcessContainer:
         right = image.crop((int(width / 2), 0, width, height))
         return (left, right)
 
+    def border_bbox(self, image: Image.Image) -> Box | None:
+        """
+        Return the box of the image inside its borders, or `None` if the image is blank.
+
+        The borders are found roughly on a reduced copy of the image, then each
+        edge is found exactly by scanning the full image in strips near it.
+        """
+        background = image.getpixel((0, 0))
+        width, height = image.size
+
+        factor = min(int(math.sqrt(width * height / BORDER_PROXY_PIXELS)), MAX_BORDER_PROXY_FACTOR)
+        if factor < 2 or image.mode not in REDUCIBLE_MODES:
+            return _content_bbox(image, background)
+
+        # a pixel that differs by more than the threshold on its own is averaged over
+        # factor ** 2 pixels of background, so it still differs by at least
+        # threshold // factor ** 2 in the reduced copy after rounding. Backgrounds are
+        # nearly always white or black, so content cannot average back to them.
+        proxy_bbox = _content_bbox(
+            image.reduce(factor), background, BORDER_THRESHOLD // factor**2 - 1
+        )
+        if proxy_bbox is None:
+            return None
+
+        # the reduced copy errs on the side of finding content, so scan inwards
+        # from one reduced pixel outside of each edge until the content is found
+        left, upper, right, lower = (
+            max(0, (proxy_bbox[0] - 1) * factor),
+            max(0, (proxy_bbox[1] - 1) * factor),
+            min(width, (proxy_bbox[2] + 1) * factor),
+            min(height, (proxy_bbox[3] + 1) * factor),
+        )
+        step = 2 * factor
+
+        for x in range(left, right, step):
+            if bbox := _content_bbox(
+                image.crop((x, upper, min(right, x + step), lower)), background
+            ):
+                left = x + bbox[0]
+                break
+        else:
+            return None
+        for x in range(right, left, -step):
+            if bbox := _content_bbox(
+                image.crop((max(left, x - step), upper, x, lower)), background
+            ):
+                right = max(left, x - step) + bbox[2]
+                break
+        for y in range(upper, lower, step):
+            if bbox := _content_bbox(
+                image.crop((left, y, right, min(lower, y + step))), background
+            ):
+                upper = y + bbox[1]
+                break
+        for y in range(lower, upper, -step):
+            if bbox := _content_bbox(
+                image.crop((left, max(upper, y - step), right, y)), background
+            ):
+                lower = max(upper, y - step) + bbox[3]
+                break
+        return (left, upper, right, lower)
+
     def trim_borders(self, image: Image.Image) -> Image.Image | None:
         """
         Trim the borders of the image.
         """
-        bg = Image.new(image.mode, image.size, image.getpixel((0, 0)))
-        diff = ImageChops.difference(image, bg)
-        diff = ImageChops.add(diff, diff, 2.0, -100)
-        bbox = diff.getbbox()
+        bbox = self.border_bbox(image)
         if bbox:
             return image.crop(bbox)
         return None
 
-    def resize(
-        self,
-        image: Image.Image,
-    ) -> Image.Image | None:
+    def split_tall_pages(self, image: Image.Image) -> tuple[Image.Image, ...] | None:
+        """
+        Cut a page that is much taller than the target size, like a webtoon strip, into
+        pages with the aspect ratio of the target size. Each page is cut at the flattest
+        row in the last quarter of it, so cuts go between panels where possible.
+        """
+        page_height = tall_page_height(image.size, self.config.target_size)
+        if page_height is None:
+            return None
+
+        width, height = image.size
+        cuts = [0]
+        while height - cuts[-1] > page_height * TALL_PAGE_RATIO:
+            top = cuts[-1]
+            # every cut is at least one row below the last one
+            upper = top + max(page_height * 3 // 4, 1)
+            cuts.append(_flattest_row(image, upper, max(top + page_height, upper + 1)))
+        cuts.append(height)
+
+        return tuple(image.crop((0, upper, width, lower)) for upper, lower in pairwise(cuts))
+
+    def grayscale(self, image: Image.Image) -> Image.Image | None:
+        """
+        Convert the image to grayscale, with `grayscale_levels` shades of gray.
+        Transparent areas are put on white.
+        """
+        # `Pipeline.may_change` only knows the mode, so nothing else is looked at
+        if self.config.is_grayscale(image.mode):
+            return None
+
+        if _has_alpha(image):
+            image = _on_white(image, "L")
+        elif image.mode != "L":
+            image = image.convert("L")
+        levels = self.config.grayscale_levels
+        if levels < 256:
+            image = image.point(_gray_levels_lut(levels))
+        return image
+
+    def resize(self, image: Image.Image, box: Box | None = None) -> Image.Image | None:
         """
         Resize the image to a maximum width and height.
+
+        :param `box`: Only resize this region of the image, which
+        is cheaper than cropping it first and resizing the copy
         """
         target_size = self.config.target_size
 
-        if target_size is None or image.size == target_size:
+        if target_size is None or (box is None and image.size == target_size):
             return None
-        return image.resize(target_size, resample=Image.Resampling.LANCZOS)
+
+        if box is not None:
+            # resize(box=...) blends in pixels just outside the box, so shrink the
+            # box by whole factors with reduce, which stays inside it, and crop
+            # only if the box is not much larger than the target
+            factor = (
+                max(1, int((box[2] - box[0]) / target_size[0] / REDUCING_GAP)),
+                max(1, int((box[3] - box[1]) / target_size[1] / REDUCING_GAP)),
+            )
+            image = image.reduce(factor, box) if factor != (1, 1) else image.crop(box)
+
+        # reduce by integer factors first when downscaling a lot, which is much
+        # faster than LANCZOS over the whole image and indistinguishable at this gap
+        return image.resize(
+            target_size, resample=Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP
+        )
 
 
 class OutputProcessContainer:
@@ -130,23 +454,78 @@ class OutputProcessContainer:
     They should all return None.
     """
 
-    def __init__(self, image: Image.Image, filename: str | Path) -> None:
+    def __init__(
+        self,
+        image: Image.Image,
+        filename: str | Path,
+        config: ProcessConfig | None = None,
+        outputs: dict[str, bytes] | None = None,
+    ) -> None:
         self.image = image
         self.filename = filename
+        self.config = config or ProcessConfig()
+        # if set, encoded images are kept here by filename instead of written to disk
+        self.outputs = outputs
+
+    def _save(self, image: Image.Image, path: Path, fmt: str | None = None) -> None:
+        fmt = fmt or Image.registered_extensions().get(path.suffix.lower())
+        options: dict[str, Any] = {}
+        if fmt == "JPEG":
+            options = {
+                "quality": self.config.jpeg_quality,
+                "optimize": self.config.jpeg_optimize,
+                "progressive": self.config.jpeg_progressive,
+            }
+        elif fmt == "PNG":
+            options = {"compress_level": self.config.png_compress_level}
+        elif fmt == "WEBP":
+            options = {"quality": self.config.webp_quality}
+
+        if self.outputs is None:
+            image.save(path, fmt, **options)
+            return
+        buffer = BytesIO()
+        image.save(buffer, fmt, **options)
+        self.outputs[path.as_posix()] = buffer.getvalue()
+
+    def _remove(self, path: Path) -> None:
+        if self.outputs is None:
+            path.unlink(missing_ok=True)
 
     def default(self) -> None:
         """
         Write the image to disk.
         """
-        self.image.save(self.filename)
+        self._save(self.image, Path(self.filename))
 
     def webp_to_png(self) -> None:
         """
         Convert any WEBP images to PNG.
         """
-        if Path(self.filename).suffix != ".webp":
+        path = Path(self.filename)
+        if path.suffix != ".webp":
+            self.default()
             return
 
+        self._save(self.image, path.with_suffix(".png"), "PNG")
+        self._remove(path)
+
+    def webp_to_jpeg(self) -> None:
+        """
+        Convert any WEBP images to JPEG, which is much smaller than PNG
+        for the photographic and painted pages that are usually WEBP.
+        """
         path = Path(self.filename)
-        self.image.save(path.with_suffix(".png"), "PNG")
-        path.unlink()
+        if path.suffix != ".webp":
+            self.default()
+            return
+
+        image = self.image
+        if _has_alpha(image):
+            # JPEG has no transparency
+            image = _on_white(image, "RGB")
+        elif image.mode not in ("RGB", "L", "CMYK"):
+            image = image.convert("RGB")
+
+        self._save(image, path.with_suffix(".jpg"), "JPEG")
+        self._remove(path)
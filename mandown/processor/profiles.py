@@ -7,6 +7,8 @@ class OutputProfile:
     id: str
     name: str
     size: tuple[int, int]
+    grayscale: bool = True
+    """Whether the device has a grayscale screen, so images are converted to grayscale."""
 
 
 SupportedProfiles = Literal[
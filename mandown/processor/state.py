@@ -0,0 +1,91 @@
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable
+
+PROCESSED_STATE_FILE = "md-processed.json"
+# how often `mark_all` saves the state while processing, in seconds
+SAVE_INTERVAL = 30.0
+
+ImageRecord = tuple[str, int, int]
+
+
+@dataclass(slots=True)
+class ProcessedState:
+    """
+    The images of a comic that were processed and the `Pipeline` they were processed
+    with, so that processing them again with the same pipeline can be skipped.
+
+    :param `comic_path`: The comic folder, which the state is saved in
+    :param `images`: The pipeline fingerprint, modification time and size of each
+    processed image after it was processed, by its path relative to `comic_path`
+    """
+
+    comic_path: Path
+    images: dict[str, ImageRecord] = field(default_factory=dict)
+    _saved_at: float = field(default_factory=time.monotonic, repr=False, compare=False)
+
+    @classmethod
+    def load(cls, comic_path: Path | str) -> "ProcessedState":
+        """
+        Load the state of the comic in `comic_path`, or start a new one if it does not exist.
+        """
+        comic_path = Path(comic_path)
+        try:
+            with open(comic_path / PROCESSED_STATE_FILE, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return cls(comic_path)
+        return cls(comic_path, {key: tuple(record) for key, record in data.items()})
+
+    def save(self) -> None:
+        """
+        Atomically write the state to disk.
+        """
+        path = self.comic_path / PROCESSED_STATE_FILE
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.images, file)
+        os.replace(tmp_path, path)
+        self._saved_at = time.monotonic()
+
+    def _key(self, image: Path) -> str:
+        return image.relative_to(self.comic_path).as_posix()
+
+    def is_processed(self, image: Path, fingerprint: str) -> bool:
+        """
+        Return whether `image` was processed with the pipeline `fingerprint`
+        and has not changed since.
+        """
+        record = self.images.get(self._key(image))
+        if record is None or record[0] != fingerprint:
+            return False
+        try:
+            stat = image.stat()
+        except FileNotFoundError:
+            return False
+        return record[1:] == (stat.st_mtime_ns, stat.st_size)
+
+    def mark(self, image: Path, fingerprint: str) -> None:
+        """
+        Record that `image` is in the state produced by the pipeline `fingerprint`.
+        """
+        try:
+            stat = image.stat()
+        except FileNotFoundError:
+            self.images.pop(self._key(image), None)
+            return
+        self.images[self._key(image)] = (fingerprint, stat.st_mtime_ns, stat.st_size)
+
+    def mark_all(self, images: Iterable[Path], fingerprint: str) -> None:
+        """
+        Record that every image in `images` is in the state produced by
+        the pipeline `fingerprint`. The state is only saved if it was last saved
+        more than `SAVE_INTERVAL` seconds ago, so `save` must be called when done.
+        """
+        for image in images:
+            self.mark(image, fingerprint)
+        if time.monotonic() - self._saved_at >= SAVE_INTERVAL:
+            self.save()
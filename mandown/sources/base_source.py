@@ -57,13 +57,7 @@ class BaseSource:
         """
         chapters = self._fetch_chapter_list()
 
-        chapter_dupes = defaultdict[str, int](lambda: 1)  # slug -> count
-        for i, c in enumerate(chapters):  # this is O(n^2) but n is small
-            if any(c.slug == x.slug or c.title == x.title for x in chapters[:i]):
-                chapter_dupes[c.slug] += 1
-                c.slug = f"{c.slug}-{chapter_dupes[c.slug]}"
-                c.title = f"{c.title} ({chapter_dupes[c.slug]})"
-
+        disambiguate_chapters(chapters)
         return chapters
 
     @final
@@ -102,5 +96,24 @@ class BaseSource:
         raise NotImplementedError("URL checker not overridden")
 
 
+def disambiguate_chapters(chapters: list[BaseChapter]) -> None:
+    """
+    Rename chapters in place whose slug or title collides with that of an earlier chapter.
+
+    Earlier chapters are never modified by later ones, so the seen slugs and titles
+    can be tracked in sets for a single linear pass.
+    """
+    chapter_dupes = defaultdict[str, int](lambda: 1)  # slug -> count
+    seen_slugs: set[str] = set()
+    seen_titles: set[str] = set()
+    for c in chapters:
+        if c.slug in seen_slugs or c.title in seen_titles:
+            chapter_dupes[c.slug] += 1
+            c.slug = f"{c.slug}-{chapter_dupes[c.slug]}"
+            c.title = f"{c.title} ({chapter_dupes[c.slug]})"
+        seen_slugs.add(c.slug)
+        seen_titles.add(c.title)
+
+
 def get_class() -> type[BaseSource]:
     return BaseSource
@@ -1,7 +1,18 @@
+import json
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from typing import Iterator
+
+import pytest
+from lxml import etree
+from PIL import Image
 
 import mandown
-from mandown import BaseChapter, BaseComic, BaseMetadata
+from mandown import BaseChapter, BaseComic, BaseMetadata, Pipeline, ProcessOps
+from mandown.processor import ProcessedState
+from mandown.sources.base_source import BaseSource
 
 
 def test_load_save(tmp_path: Path) -> None:
@@ -21,3 +32,366 @@ def test_load_save(tmp_path: Path) -> None:
     mandown.save_metadata(comic, tmp_path)
     loaded = mandown.load(tmp_path)
     assert comic.asdict() == loaded.asdict()
+
+
+class FakeSource(BaseSource):
+    name = "Fake"
+    domains = ["https://fake.example"]
+    chapter_count = 2
+
+    def _fetch_metadata(self) -> BaseMetadata:
+        return BaseMetadata("Fake Comic", [], self.url, [], "", "")
+
+    def _fetch_chapter_list(self) -> list[BaseChapter]:
+        return [
+            BaseChapter(f"Chapter {i}", f"https://fake.example/{i}", f"{i:03}")
+            for i in range(self.chapter_count)
+        ]
+
+    def _fetch_chapter_image_list(self, chapter: BaseChapter) -> list[str]:
+        return []
+
+
+def test_update(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(mandown.sources, "get_class_for", lambda _: FakeSource)
+    monkeypatch.setattr(FakeSource, "chapter_count", 2)
+
+    for _ in mandown.download_progress("https://fake.example/comic", tmp_path):
+        pass
+    comic_path = tmp_path / "Fake Comic"
+    assert sorted(p.name for p in comic_path.iterdir() if p.is_dir()) == ["000", "001"]
+
+    assert list(mandown.update_progress(comic_path)) == [0]
+
+    # known chapters keep their saved slug
+    comic = mandown.load(comic_path)
+    comic.chapters[0].slug = "000-old"
+    mandown.save_metadata(comic, comic_path)
+
+    monkeypatch.setattr(FakeSource, "chapter_count", 4)
+    assert list(mandown.update_progress(comic_path)) == [2, "Chapter 2", "Chapter 3"]
+    assert [c.slug for c in mandown.load(comic_path).chapters] == ["000-old", "001", "002", "003"]
+
+
+@pytest.fixture
+def image_server(tmp_path: Path) -> Iterator[tuple[str, Path]]:
+    """Serve a folder of images over HTTP on localhost."""
+    root = tmp_path / "server"
+    root.mkdir()
+    handler = partial(SimpleHTTPRequestHandler, directory=str(root))
+    with ThreadingHTTPServer(("127.0.0.1", 0), handler) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield f"http://127.0.0.1:{server.server_address[1]}", root
+        server.shutdown()
+
+
+def test_sync(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, image_server: tuple[str, Path]
+) -> None:
+    base_url, server_root = image_server
+    for name in ["a", "b", "c"]:
+        Image.new("RGB", (4, 4)).save(server_root / f"{name}.png")
+
+    pages = {"000": ["a", "b"], "001": ["c"]}
+
+    def image_list(_: FakeSource, chapter: BaseChapter) -> list[str]:
+        return [f"{base_url}/{name}.png" for name in pages[chapter.slug]]
+
+    monkeypatch.setattr(mandown.sources, "get_class_for", lambda _: FakeSource)
+    monkeypatch.setattr(FakeSource, "_fetch_chapter_image_list", image_list)
+
+    for _ in mandown.download_progress("https://fake.example/comic", tmp_path):
+        pass
+    comic_path = tmp_path / "Fake Comic"
+    fingerprints = [c.fingerprint for c in mandown.load(comic_path).chapters]
+    assert all(fingerprints)
+
+    # nothing changed
+    (comic_path / "001" / "00001.png").write_bytes(b"untouched")
+    mandown.sync(comic_path)
+    assert [c.fingerprint for c in mandown.load(comic_path).chapters] == fingerprints
+    assert (comic_path / "001" / "00001.png").read_bytes() == b"untouched"
+
+    # a page was added to the first chapter
+    pages["000"] = ["a", "c", "b"]
+    (comic_path / "000" / "00001.png").write_bytes(b"stale")
+    mandown.sync(comic_path)
+
+    chapters = mandown.load(comic_path).chapters
+    assert chapters[0].fingerprint != fingerprints[0]
+    assert chapters[1].fingerprint == fingerprints[1]
+    assert sorted(p.name for p in (comic_path / "000").iterdir()) == [
+        "00001.png",
+        "00002.png",
+        "00003.png",
+    ]
+    assert (comic_path / "000" / "00001.png").read_bytes() != b"stale"
+    assert not any(p.name.startswith(".") for p in comic_path.iterdir())
+
+    # chapters downloaded before fingerprints were saved are kept if every image is there,
+    # even if processing split some of them
+    metadata = json.loads((comic_path / "md-metadata.json").read_text())
+    for chapter in metadata["chapters"]:
+        del chapter["fingerprint"]
+    (comic_path / "md-metadata.json").write_text(json.dumps(metadata))
+    (comic_path / "000" / "00001a.png").write_bytes(b"split")
+    (comic_path / "000" / "00002.png").write_bytes(b"processed")
+    (comic_path / "001" / "00002.png").write_bytes(b"not in the chapter")
+    mandown.sync(comic_path)
+
+    synced = [c.fingerprint for c in mandown.load(comic_path).chapters]
+    assert synced == [chapters[0].fingerprint, fingerprints[1]]
+    assert (comic_path / "000" / "00002.png").read_bytes() == b"processed"
+    # but not if the images do not match
+    assert sorted(p.name for p in (comic_path / "001").iterdir()) == ["00001.png"]
+
+
+def test_download_saves_fingerprints(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, image_server: tuple[str, Path]
+) -> None:
+    import json
+    import shutil
+
+    base_url, server_root = image_server
+    Image.new("RGB", (4, 4)).save(server_root / "a.png")
+    monkeypatch.setattr(mandown.sources, "get_class_for", lambda _: FakeSource)
+    monkeypatch.setattr(FakeSource, "_fetch_chapter_image_list", lambda *_: [f"{base_url}/a.png"])
+    for _ in mandown.download_progress("https://fake.example/comic", tmp_path):
+        pass
+
+    # download again a comic loaded from md-metadata.json without fingerprints
+    comic_path = tmp_path / "Fake Comic"
+    metadata_path = comic_path / "md-metadata.json"
+    data = json.loads(metadata_path.read_text())
+    for chapter in data["chapters"]:
+        del chapter["fingerprint"]
+        shutil.rmtree(comic_path / chapter["slug"])
+    metadata_path.write_text(json.dumps(data))
+
+    for _ in mandown.download_progress(mandown.load(comic_path), tmp_path):
+        pass
+    assert all(c.fingerprint for c in mandown.load(comic_path).chapters)
+
+    # chapters whose images already exist may be outdated, so they are not fingerprinted
+    for chapter in data["chapters"]:
+        (comic_path / chapter["slug"] / "00001.png").write_bytes(b"old")
+    metadata_path.write_text(json.dumps(data))
+    for _ in mandown.download_progress(mandown.load(comic_path), tmp_path):
+        pass
+    assert not any(c.fingerprint for c in mandown.load(comic_path).chapters)
+
+
+def test_download_opens_library_once(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, image_server: tuple[str, Path]
+) -> None:
+    base_url, server_root = image_server
+    Image.new("RGB", (4, 4)).save(server_root / "a.png")
+    monkeypatch.setattr(mandown.sources, "get_class_for", lambda _: FakeSource)
+    monkeypatch.setattr(FakeSource, "_fetch_chapter_image_list", lambda *_: [f"{base_url}/a.png"])
+
+    mandown.Library(tmp_path).close()
+    opened: list[Path] = []
+    init = mandown.Library.__init__
+    monkeypatch.setattr(
+        mandown.Library, "__init__", lambda self, root: opened.append(root) or init(self, root)
+    )
+
+    # the library is opened once for all the chapters, and once each time metadata is saved
+    for chapter_count in (2, 6):
+        opened.clear()
+        monkeypatch.setattr(FakeSource, "chapter_count", chapter_count)
+        for _ in mandown.download_progress("https://fake.example/comic", tmp_path):
+            pass
+        assert len(opened) == 3
+
+    comic_path = tmp_path / "Fake Comic"
+    with mandown.Library(tmp_path) as library:
+        assert library.comics()[0]["downloaded_count"] == 6
+
+    # every chapter gains a page
+    Image.new("RGB", (4, 4)).save(server_root / "b.png")
+    monkeypatch.setattr(
+        FakeSource, "_fetch_chapter_image_list", lambda *_: [f"{base_url}/{n}.png" for n in "ab"]
+    )
+    opened.clear()
+    mandown.sync(comic_path)
+    assert len(opened) == 2
+    with mandown.Library(tmp_path) as library:
+        assert {row["image_count"] for row in library.conn.execute("SELECT * FROM chapters")} == {2}
+
+
+def test_process_while_downloading(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, image_server: tuple[str, Path]
+) -> None:
+    base_url, server_root = image_server
+    Image.new("RGB", (300, 200), "white").save(server_root / "wide.png")
+    Image.new("RGB", (200, 300), "white").save(server_root / "tall.jpg")
+    # a PNG served with the wrong extension
+    Image.new("RGB", (300, 200), "white").save(server_root / "lying.jpg", "PNG")
+
+    def image_list(_: FakeSource, chapter: BaseChapter) -> list[str]:
+        return [f"{base_url}/{name}" for name in ["wide.png", "tall.jpg", "lying.jpg"]]
+
+    monkeypatch.setattr(mandown.sources, "get_class_for", lambda _: FakeSource)
+    monkeypatch.setattr(FakeSource, "_fetch_chapter_image_list", image_list)
+    monkeypatch.setattr(FakeSource, "chapter_count", 1)
+
+    with pytest.raises(mandown.ProcessOptionMismatchError):
+        mandown.download("https://fake.example/comic", tmp_path, process_ops=["resize"])
+
+    mandown.download(
+        "https://fake.example/comic",
+        tmp_path,
+        process_ops=[ProcessOps.SPLIT_DOUBLE_PAGES],
+    )
+
+    chapter_path = tmp_path / "Fake Comic" / "000"
+    sizes = {}
+    for image in chapter_path.iterdir():
+        with Image.open(image) as im:
+            sizes[image.name] = im.size
+    assert sizes == {
+        "00001.png": (150, 200),
+        "00001a.png": (150, 200),
+        "00002.jpg": (200, 300),
+        "00003.png": (150, 200),
+        "00003a.png": (150, 200),
+    }
+
+    # images processed while downloading are not processed again
+    state = ProcessedState.load(tmp_path / "Fake Comic")
+    fingerprint = Pipeline([ProcessOps.SPLIT_DOUBLE_PAGES]).fingerprint
+    assert all(state.is_processed(image, fingerprint) for image in chapter_path.iterdir())
+
+
+def make_convertible_comic(comic_path: Path, num_chapters: int) -> None:
+    chapters = [
+        BaseChapter(f"Chapter {i}", f"https://example.com/{i}", f"{i:03}")
+        for i in range(num_chapters)
+    ]
+    mandown.save_metadata(
+        BaseComic(BaseMetadata("Comic", [], "", [], "", ""), chapters), comic_path
+    )
+    if not (comic_path / "cover.png").exists():
+        Image.new("RGB", (20, 30), "white").save(comic_path / "cover.png")
+    for i, chapter in enumerate(chapters):
+        if (comic_path / chapter.slug).exists():
+            continue
+        (comic_path / chapter.slug).mkdir()
+        for j in range(i + 1):
+            Image.new("RGB", (20, 30), "white").save(comic_path / chapter.slug / f"{j:05}.png")
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_convert_split_by_chapters(tmp_path: Path, jobs: int) -> None:
+    import zipfile
+
+    comic_path = tmp_path / "comic"
+    make_convertible_comic(comic_path, 4)
+
+    dest = tmp_path / "out"
+    dest.mkdir()
+    progress = mandown.convert_progress(
+        comic_path, mandown.ConvertFormats.CBZ, dest, split_by_chapters=True, jobs=jobs
+    )
+    assert list(progress) == [4, *(f"Comic #{i:05}: Chapter {i - 1}" for i in range(1, 5))]
+
+    # each chapter is converted from its own folder
+    assert not (comic_path / "comicon.json").exists()
+    outputs = sorted(dest.iterdir())
+    assert len(outputs) == 4
+    for i, output in enumerate(outputs):
+        with zipfile.ZipFile(output) as archive:
+            assert len([n for n in archive.namelist() if n.endswith(".png")]) == i + 2
+
+
+@pytest.mark.parametrize("to", [mandown.ConvertFormats.CBZ, mandown.ConvertFormats.EPUB])
+def test_incremental_convert(tmp_path: Path, to: mandown.ConvertFormats) -> None:
+    import zipfile
+
+    comic_path = tmp_path / "comic"
+    make_convertible_comic(comic_path, 2)
+    dest = tmp_path / f"Comic.{to.value}"
+    assert list(mandown.convert_progress(comic_path, to, tmp_path))[0] == 2
+
+    # only the new chapter is written
+    make_convertible_comic(comic_path, 3)
+    assert list(mandown.convert_progress(comic_path, to, tmp_path)) == [1, "Chapter 2"]
+    with zipfile.ZipFile(dest) as archive:
+        assert archive.testzip() is None
+        names = archive.namelist()
+        assert len(names) == len(set(names))
+        assert len([n for n in names if "002/" in n and n.endswith(".png")]) == 3
+        # the metadata stays after the pages
+        assert not names[-1].endswith(".png")
+        assert any(b"Chapter 2" in archive.read(name) for name in names[-4:])
+
+    # nothing changed, so nothing is converted
+    mtime_ns = dest.stat().st_mtime_ns
+    assert list(mandown.convert_progress(comic_path, to, tmp_path)) == [0]
+    assert dest.stat().st_mtime_ns == mtime_ns
+    assert list(mandown.convert_progress(comic_path, to, tmp_path, force=True))[0] == 3
+
+    appended = dest.read_bytes()
+    make_convertible_comic(comic_path, 4)
+    list(mandown.convert_progress(comic_path, to, tmp_path, incremental=False))
+    rebuilt = dest.read_bytes()
+    assert len(rebuilt) > len(appended)
+
+    # changing an earlier chapter converts everything again
+    Image.new("RGB", (20, 30), "black").save(comic_path / "000" / "00000.png")
+    assert list(mandown.convert_progress(comic_path, to, tmp_path))[0] == 4
+
+
+def test_convert_several_formats(tmp_path: Path) -> None:
+    import zipfile
+
+    comic_path = tmp_path / "comic"
+    make_convertible_comic(comic_path, 3)
+    formats = [mandown.ConvertFormats.CBZ, mandown.ConvertFormats.EPUB]
+
+    progress = list(mandown.convert_progress(comic_path, formats, tmp_path))
+    assert progress[0] == 6
+    assert len(progress) == 7
+    for to in formats:
+        with zipfile.ZipFile(tmp_path / f"Comic.{to.value}") as archive:
+            assert len([n for n in archive.namelist() if n.endswith(".png")]) == 7
+    assert list(mandown.convert_progress(comic_path, formats, tmp_path)) == [0]
+
+    # comic files are read once for every format
+    dest = tmp_path / "out"
+    dest.mkdir()
+    list(
+        mandown.convert_progress(
+            tmp_path / "Comic.cbz", [mandown.ConvertFormats.EPUB, mandown.ConvertFormats.PDF], dest
+        )
+    )
+    assert sorted(file.name for file in dest.iterdir()) == ["Comic.epub", "Comic.pdf"]
+
+
+def test_convert_cbz_stores_images(tmp_path: Path) -> None:
+    import zipfile
+
+    comic_path = tmp_path / "comic"
+    make_convertible_comic(comic_path, 2)
+    index = mandown.ImageIndex.load(comic_path)
+    index.refresh((comic_path / "001").iterdir())
+    index.save()
+
+    list(mandown.convert_progress(comic_path, mandown.ConvertFormats.CBZ, tmp_path))
+    with zipfile.ZipFile(tmp_path / "Comic.cbz") as archive:
+        assert archive.namelist() == [
+            "00001-000/00000.png",
+            "00002-001/00000.png",
+            "00002-001/00001.png",
+            "..cover.png",
+            "ComicInfo.xml",
+            "comicon.json",
+        ]
+        assert {info.compress_type for info in archive.infolist()[:4]} == {zipfile.ZIP_STORED}
+        pages = etree.fromstring(archive.read("ComicInfo.xml")).findall("Pages/Page")
+
+    # only indexed pages have dimensions
+    assert [page.get("image_width") for page in pages] == [None, "20", "20"]
+    assert pages[1].get("bookmark") == "Chapter 1"
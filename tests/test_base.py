@@ -87,3 +87,63 @@ def test_basecomic() -> None:
         "metadata": metadata.asdict(),
         "chapters": [c.asdict() for c in chapters[:5]],
     }
+
+
+def test_chapterindex() -> None:
+    data = [
+        {"title": "Chapter 1", "url": "https://example.com/1", "slug": "chapter-1"},
+        {"title": "Chapter 2", "url": "https://example.com/2"},
+        {"title": "Chapter 3", "url": "https://example.com/3", "slug": "chapter-3"},
+    ]
+    index = mandown.ChapterIndex.from_dicts(data)
+
+    assert len(index) == 3
+    assert index.title(1) == "Chapter 2"
+    assert index.slug(1) == "Chapter 2"
+    assert index[0] == mandown.BaseChapter("Chapter 1", "https://example.com/1", "chapter-1")
+
+    # chapters are cached, so changes stick
+    index[2].title = "Renamed"
+    assert index.title(2) == "Renamed"
+    assert index.asdicts()[2]["title"] == "Renamed"
+
+    sliced = index[1:]
+    assert isinstance(sliced, mandown.ChapterIndex)
+    assert [c.slug for c in sliced] == ["Chapter 2", "chapter-3"]
+
+    # slices share their chapters with the index
+    for chapter in index[None:None]:
+        chapter.fingerprint = "abc"
+    assert [c["fingerprint"] for c in index.asdicts()] == ["abc"] * 3
+
+
+def test_chapterindex_sync_slug_order() -> None:
+    index = mandown.ChapterIndex(["b", "a"], ["", ""], ["", ""])
+    chapters = [mandown.BaseChapter("b", ""), mandown.BaseChapter("a", "")]
+
+    first = index[0]
+    mandown.BaseChapter.sync_slug_order(index)
+    mandown.BaseChapter.sync_slug_order(chapters)
+    assert index.asdicts() == [c.asdict() for c in chapters]
+    assert first.slug == "00001. b"
+
+
+def test_chapterindex_is_lazy(monkeypatch: pytest.MonkeyPatch) -> None:
+    titles = [f"c{i}" for i in range(1000)]
+    index = mandown.ChapterIndex(titles, [""] * 1000, [""] * 1000)
+    slugified: list[str] = []
+    monkeypatch.setattr(
+        "mandown.base.slugify_title", lambda title: slugified.append(title) or title
+    )
+
+    # neither syncing the order nor slicing computes any slugs
+    mandown.BaseChapter.sync_slug_order(index)
+    sliced = index[10:20]
+    assert len(sliced) == 10
+    assert not slugified
+
+    # the order is synced for the whole index once a slug is needed
+    assert sliced.slug(0) == "00011. c10"
+    assert len(slugified) == 1000
+    assert sliced[0] is index[10]
+    assert sliced[::-1][0] is index[19]
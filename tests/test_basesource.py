@@ -1,5 +1,10 @@
+import time
+from collections import defaultdict
+
 import pytest
 
+from mandown import BaseChapter
+from mandown.sources.base_source import disambiguate_chapters
 from mandown.sources.common_source import CommonSource
 
 
@@ -21,3 +26,61 @@ def test_unimplemented() -> None:
 
     with pytest.raises(NotImplementedError):
         testee.chapters  # noqa: B018
+
+
+def _disambiguate_quadratic(chapters: list[BaseChapter]) -> None:
+    """The original O(n^2) disambiguation, kept as a reference."""
+    chapter_dupes = defaultdict[str, int](lambda: 1)
+    for i, c in enumerate(chapters):
+        if any(c.slug == x.slug or c.title == x.title for x in chapters[:i]):
+            chapter_dupes[c.slug] += 1
+            c.slug = f"{c.slug}-{chapter_dupes[c.slug]}"
+            c.title = f"{c.title} ({chapter_dupes[c.slug]})"
+
+
+def _synthetic_chapters(n: int) -> list[BaseChapter]:
+    # lots of repeated titles and slugs, including ones that collide after renaming
+    return [
+        BaseChapter(f"Episode {i % 7}", f"https://example.com/{i}", f"episode-{i % 11}")
+        if i % 3
+        else BaseChapter(f"Episode {i}", f"https://example.com/{i}", f"episode-{i % 5}-2")
+        for i in range(n)
+    ]
+
+
+def test_disambiguate_chapters_matches_reference() -> None:
+    expected = _synthetic_chapters(1500)
+    _disambiguate_quadratic(expected)
+
+    actual = _synthetic_chapters(1500)
+    disambiguate_chapters(actual)
+
+    assert [c.asdict() for c in actual] == [c.asdict() for c in expected]
+
+
+def test_disambiguate_chapters_large() -> None:
+    # mostly unique, like a real long-running webtoon, with a duplicate every so often
+    chapters = [
+        BaseChapter(f"Episode {i - i % 500 // 499}", f"https://example.com/{i}")
+        for i in range(10_000)
+    ]
+
+    start = time.perf_counter()
+    disambiguate_chapters(chapters)
+    BaseChapter.sync_slug_order(chapters)
+    elapsed = time.perf_counter() - start
+
+    # the quadratic version takes several seconds for this many chapters
+    assert elapsed < 1
+    assert chapters[499].title == "Episode 498 (1)"
+    assert chapters[499].slug == "00500. Episode 498-2"
+
+
+def test_sync_slug_order() -> None:
+    chapters = [BaseChapter(f"Chapter {i}", "", f"{i:03}") for i in range(100)]
+    BaseChapter.sync_slug_order(chapters)
+    assert [c.slug for c in chapters] == [f"{i:03}" for i in range(100)]
+
+    chapters = [BaseChapter("b", ""), BaseChapter("a", "")]
+    BaseChapter.sync_slug_order(chapters)
+    assert [c.slug for c in chapters] == ["00001. b", "00002. a"]
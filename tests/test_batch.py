@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from mandown.batch import BatchState, create_session, read_url_list, schedule
+
+
+def test_read_url_list(tmp_path: Path) -> None:
+    url_file = tmp_path / "urls.txt"
+    url_file.write_text("https://a.com/1\n\n# comment\nhttps://b.com/1\nhttps://a.com/1\n")
+    assert read_url_list(url_file) == ["https://a.com/1", "https://b.com/1"]
+
+
+def test_batch_state(tmp_path: Path) -> None:
+    state = BatchState.load(tmp_path / "state.json")
+    state.mark("https://a.com/1", None)
+    state.mark("https://a.com/2", "ValueError: broken")
+
+    loaded = BatchState.load(tmp_path / "state.json")
+    assert loaded.done == {"https://a.com/1"}
+    assert loaded.failed == {"https://a.com/2": "ValueError: broken"}
+
+    loaded.mark("https://a.com/2", None)
+    assert BatchState.load(tmp_path / "state.json").failed == {}
+
+
+def test_schedule_limits() -> None:
+    urls = [f"https://a.com/{i}" for i in range(6)] + [f"https://b.com/{i}" for i in range(6)]
+    lock = threading.Lock()
+    running = Counter[str]()
+    peak_hosts = Counter[str]()
+    peak_total = 0
+
+    def job(url: str) -> None:
+        nonlocal peak_total
+        host = url.split("/")[2]
+        with lock:
+            running[host] += 1
+            peak_hosts[host] = max(peak_hosts[host], running[host])
+            peak_total = max(peak_total, running.total())
+        time.sleep(0.02)
+        with lock:
+            running[host] -= 1
+        if url.endswith("/3"):
+            raise ValueError("broken")
+
+    results = dict(schedule(urls, job, max_jobs=3, max_jobs_per_host=2))
+
+    assert results.keys() == set(urls)
+    assert results["https://a.com/3"] == "ValueError: broken"
+    assert results["https://a.com/0"] is None
+    assert peak_total == 3
+    assert max(peak_hosts.values()) == 2
+
+    with pytest.raises(ValueError):
+        list(schedule(urls, job, max_jobs=0, max_jobs_per_host=1))
+
+
+def test_session_limits_hosts(monkeypatch: pytest.MonkeyPatch) -> None:
+    lock = threading.Lock()
+    running = Counter[str]()
+    peak_hosts = Counter[str]()
+
+    def send(_: HTTPAdapter, request: requests.PreparedRequest, **__: object) -> requests.Response:
+        host = request.url.split("/")[2]
+        with lock:
+            running[host] += 1
+            peak_hosts[host] = max(peak_hosts[host], running[host])
+        time.sleep(0.02)
+        with lock:
+            running[host] -= 1
+        response = requests.Response()
+        response.status_code = 200
+        return response
+
+    monkeypatch.setattr(HTTPAdapter, "send", send)
+    urls = [f"https://{host}.com/{i}.png" for host in "ab" for i in range(8)]
+
+    # requests are limited by the host they are sent to, whatever comic they are for
+    with create_session(16, 3) as session, ThreadPoolExecutor(16) as executor:
+        assert all(r.status_code == 200 for r in executor.map(session.get, urls))
+    assert peak_hosts == {"a.com": 3, "b.com": 3}
@@ -1,10 +1,13 @@
 import sys
+from pathlib import Path
 
 import pytest
 from common import skip_in_ci
 from typer import Exit
+from typer.testing import CliRunner
 
-from mandown import BaseComic, __version_str__, cli
+from mandown import BaseChapter, BaseComic, BaseMetadata, ProcessOps, __version_str__, cli
+from mandown.sources.base_source import BaseSource
 
 
 def assert_expected_output(capsys, input: str, output: str) -> None:
@@ -46,3 +49,34 @@ def test_callbacks(capsys) -> None:
     assert_expected_output(capsys, "mandown --supported-sites", "Webtoons: https://webtoons.com")
 
     assert_expected_output(capsys, "mandown -l", " - Kobo Sage: 'sage'")
+
+
+def test_get_runs_comic_ops_after_download(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    comic = BaseComic(BaseMetadata("Comic", [], "", [], "", ""), [BaseChapter("Chapter 1", "")])
+    monkeypatch.setattr(cli, "cli_query", lambda _: comic)
+    monkeypatch.setattr(cli.sources, "get_class_for", lambda _: BaseSource)
+    monkeypatch.setattr(cli.api, "download_progress", lambda *_, **__: iter(["Chapter 1"]))
+    processed: list[tuple[Path, list[ProcessOps]]] = []
+    monkeypatch.setattr(
+        cli, "cli_process", lambda path, ops, *_: processed.append((path, list(ops)))
+    )
+
+    def get(*options: str) -> None:
+        result = CliRunner().invoke(
+            cli.app, ["get", "https://example.com", str(tmp_path), *options]
+        )
+        assert result.exit_code == 0, result.output
+
+    # dropping duplicate pages needs every chapter, so it runs once they are downloaded
+    get("-p", "drop_duplicate_pages", "-p", "trim_borders")
+    assert processed == [
+        (
+            tmp_path / comic.metadata.title_slug,
+            [ProcessOps.DROP_DUPLICATE_PAGES, ProcessOps.TRIM_BORDERS],
+        )
+    ]
+
+    # other operations only run while downloading
+    processed.clear()
+    get("-p", "trim_borders")
+    assert processed == []
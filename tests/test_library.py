@@ -0,0 +1,89 @@
+from pathlib import Path
+
+import mandown
+from mandown import BaseChapter, BaseComic, BaseMetadata, Library
+
+
+def make_comic(title: str, num_chapters: int) -> BaseComic:
+    return BaseComic(
+        BaseMetadata(
+            title=title,
+            authors=[],
+            url="",
+            genres=[],
+            description="",
+            cover_art="",
+        ),
+        [BaseChapter(f"{i:03}", f"https://example.com/{i}") for i in range(num_chapters)],
+    )
+
+
+def download_chapters(comic_path: Path, slugs: list[str]) -> None:
+    for slug in slugs:
+        (comic_path / slug).mkdir()
+        (comic_path / slug / "00001.png").write_bytes(b"")
+
+
+def test_rebuild(tmp_path: Path) -> None:
+    for title, num_chapters in [("First", 3), ("Second", 2)]:
+        mandown.save_metadata(make_comic(title, num_chapters), tmp_path / title)
+    download_chapters(tmp_path / "First", ["000", "001"])
+    (tmp_path / "not-a-comic").mkdir()
+
+    with Library(tmp_path) as library:
+        library.rebuild(threads=2)
+        rows = {row["folder"]: row for row in library.comics()}
+
+        assert rows.keys() == {"First", "Second"}
+        assert rows["First"]["chapter_count"] == 3
+        assert rows["First"]["downloaded_count"] == 2
+        assert rows["Second"]["downloaded_count"] == 0
+        assert library.missing_chapters(tmp_path / "First") == ["002"]
+
+
+def test_rebuild_reads_partial_metadata(tmp_path: Path) -> None:
+    import json
+
+    # slugs are optional in md-metadata.json
+    mandown.save_metadata(make_comic("First", 2), tmp_path / "First")
+    metadata_path = tmp_path / "First" / "md-metadata.json"
+    data = json.loads(metadata_path.read_text())
+    for chapter in data["chapters"]:
+        del chapter["slug"]
+    metadata_path.write_text(json.dumps(data))
+    download_chapters(tmp_path / "First", ["000"])
+
+    # and a comic with broken metadata is skipped
+    (tmp_path / "Broken").mkdir()
+    (tmp_path / "Broken" / "md-metadata.json").write_text(json.dumps({"metadata": {}}))
+
+    with Library(tmp_path) as library:
+        library.rebuild(threads=2)
+        rows = {row["folder"]: row for row in library.comics()}
+        assert rows.keys() == {"First"}
+        assert rows["First"]["downloaded_count"] == 1
+        assert library.missing_chapters(tmp_path / "First") == ["001"]
+
+
+def test_incremental_updates(tmp_path: Path) -> None:
+    Library(tmp_path).close()
+
+    comic_path = tmp_path / "Comic"
+    mandown.save_metadata(make_comic("Comic", 2), comic_path)
+
+    with Library(tmp_path) as library:
+        assert [row["folder"] for row in library.comics()] == ["Comic"]
+        assert library.unconverted() == []
+
+        library.update_chapter(comic_path, "000", 5)
+        library.update_chapter(comic_path, "001", 5)
+        assert [row["last_downloaded"] for row in library.unconverted()] == [2]
+
+        library.add_output(comic_path, tmp_path / "Comic.cbz", "cbz", 2)
+        assert library.unconverted() == []
+        assert len(library.unconverted("epub")) == 1
+
+    # saving a longer chapter list keeps the download state of existing chapters
+    mandown.save_metadata(make_comic("Comic", 3), comic_path)
+    with Library(tmp_path) as library:
+        assert library.missing_chapters(comic_path) == ["002"]
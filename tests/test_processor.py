@@ -1,8 +1,10 @@
 from pathlib import Path
 
 import pytest
+from PIL import Image
 
-from mandown import ProcessConfig, ProcessOptionMismatchError, Processor
+import mandown
+from mandown import Pipeline, ProcessConfig, ProcessOps, ProcessOptionMismatchError, Processor
 
 SMALL_IMAGE = b"GIF89a\x01\x00\x01\x00\x80\x00\x00\xff\xff\xff\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x01D\x00;"
 
@@ -33,3 +35,537 @@ def test_resize_requires_profile_xor_dims(tmp_path: Path) -> None:
     Processor(small_image_path, config=bad_config).process(
         ["resize", "rotate_double_pages", "split_double_pages", "none"]
     )
+
+
+def make_comic_folder(path: Path, chapters: list[int]) -> None:
+    for i, num_images in enumerate(chapters):
+        chapter = path / f"{i:03}"
+        chapter.mkdir(parents=True)
+        for j in range(num_images):
+            Image.new("RGB", (200, 100), "white").save(chapter / f"{j:05}.png")
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_process_progress(tmp_path: Path, jobs: int) -> None:
+    make_comic_folder(tmp_path, [2, 0, 5, 1])
+
+    progress = list(mandown.process_progress(tmp_path, [ProcessOps.ROTATE_DOUBLE_PAGES], jobs=jobs))
+
+    # one per chapter and one for the cover
+    assert len(progress) == 5
+    for image in tmp_path.glob("*/*.png"):
+        with Image.open(image) as im:
+            assert im.size == (100, 200)
+
+
+def test_draft_size() -> None:
+    from mandown.processor import draft_size
+
+    assert draft_size([ProcessOps.RESIZE], None) is None
+    assert draft_size([ProcessOps.ROTATE_DOUBLE_PAGES], (600, 800)) is None
+    assert draft_size([ProcessOps.RESIZE, ProcessOps.TRIM_BORDERS], (600, 800)) == (600, 800)
+    assert draft_size([ProcessOps.SPLIT_DOUBLE_PAGES, ProcessOps.RESIZE], (600, 800)) == (
+        1200,
+        800,
+    )
+    assert draft_size([ProcessOps.ROTATE_DOUBLE_PAGES, ProcessOps.RESIZE], (600, 800)) == (
+        800,
+        800,
+    )
+
+
+@pytest.mark.parametrize(
+    "ops",
+    [
+        # decoded at exactly the target size, which must still be written
+        [ProcessOps.RESIZE],
+        [ProcessOps.SPLIT_DOUBLE_PAGES, ProcessOps.RESIZE],
+    ],
+)
+def test_resize_large_jpeg(tmp_path: Path, ops: list[ProcessOps]) -> None:
+    image_path = tmp_path / "00001.jpg"
+    Image.new("RGB", (4800, 6400), "gray").save(image_path)
+
+    Processor(image_path, ProcessConfig(output_profile="kindle")).process(ops)
+
+    with Image.open(image_path) as im:
+        assert im.size == mandown.all_profiles["kindle"].size
+
+
+def test_fused_crop_and_resize(tmp_path: Path) -> None:
+    image = Image.new("RGB", (1000, 600), "white")
+    image.paste((255, 0, 0), (100, 50, 500, 550))
+    image.paste((0, 0, 255), (500, 50, 900, 550))
+    image.save(tmp_path / "00001.png")
+
+    config = ProcessConfig(target_size=(40, 80))
+    Processor(tmp_path / "00001.png", config).process(
+        [ProcessOps.TRIM_BORDERS, ProcessOps.SPLIT_DOUBLE_PAGES, ProcessOps.RESIZE]
+    )
+
+    # the left half is trimmed, split and resized in one pass
+    with Image.open(tmp_path / "00001.png") as left:
+        assert left.size == (40, 80)
+        # neither the border nor the other half bleed into the edges
+        assert left.getpixel((0, 0)) == (255, 0, 0)
+        assert left.getpixel((39, 79)) == (255, 0, 0)
+    # and the right half goes through the operations after the split
+    with Image.open(tmp_path / "00001a.png") as right:
+        assert right.size == (40, 80)
+        assert right.getpixel((0, 0)) == (0, 0, 255)
+        assert right.getpixel((39, 79)) == (0, 0, 255)
+
+
+def test_border_bbox_matches_full_resolution() -> None:
+    from PIL import ImageDraw
+
+    from mandown.processor.ops import ProcessContainer, _content_bbox
+
+    # a long webtoon strip, with a thin line that a reduced copy would blur away
+    image = Image.new("RGB", (800, 20000), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((40, 600, 760, 19000), fill="gray")
+    draw.line((13, 300, 13, 19500), fill="black", width=1)
+
+    bbox = ProcessContainer().border_bbox(image)
+    assert bbox == _content_bbox(image, (255, 255, 255)) == (13, 300, 760 + 1, 19500 + 1)
+    assert ProcessContainer().border_bbox(Image.new("RGB", (800, 20000), "white")) is None
+
+
+def test_border_bbox_keeps_single_pixels() -> None:
+    from PIL import ImageDraw
+
+    from mandown.processor.ops import ProcessContainer, _content_bbox
+
+    # a page number or speck of content on its own in the bottom margin
+    image = Image.new("RGB", (1600, 2400), "white")
+    ImageDraw.Draw(image).rectangle((100, 150, 1500, 2100), fill="black")
+    image.putpixel((800, 2340), (0, 0, 0))
+    image.putpixel((3, 1000), (140, 255, 255))
+
+    bbox = ProcessContainer().border_bbox(image)
+    assert bbox == _content_bbox(image, (255, 255, 255)) == (3, 150, 1501, 2341)
+
+
+def test_pipeline(tmp_path: Path) -> None:
+    import pickle
+
+    with pytest.raises(NotImplementedError):
+        Pipeline(["not_an_op"])
+    with pytest.raises(ProcessOptionMismatchError):
+        Pipeline([ProcessOps.RESIZE])
+
+    pipeline = pickle.loads(
+        pickle.dumps(
+            Pipeline(
+                [ProcessOps.ROTATE_DOUBLE_PAGES, ProcessOps.RESIZE],
+                ProcessConfig(target_size=(50, 100)),
+            )
+        )
+    )
+    for i in range(3):
+        Image.new("RGB", (200, 100), "white").save(tmp_path / f"{i:05}.png")
+        assert pipeline.process(tmp_path / f"{i:05}.png")
+        with Image.open(tmp_path / f"{i:05}.png") as im:
+            assert im.size == (50, 100)
+
+    assert not Pipeline([ProcessOps.NO_POSTPROCESSING]).process(tmp_path / "00000.png")
+
+
+def test_processor_closes_image(tmp_path: Path) -> None:
+    (tmp_path / "test.gif").write_bytes(SMALL_IMAGE)
+
+    with Processor(tmp_path / "test.gif") as processor:
+        image = processor.image
+        processor.process([ProcessOps.ROTATE_DOUBLE_PAGES])
+
+    with pytest.raises(ValueError):
+        image.load()
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_process_skips_processed_images(tmp_path: Path, jobs: int) -> None:
+    def sizes() -> dict[str, tuple[int, int]]:
+        return {
+            image.relative_to(tmp_path).as_posix(): Image.open(image).size
+            for image in sorted(tmp_path.glob("*/*.png"))
+        }
+
+    # splitting is not idempotent: a 400x100 page is split into 200x100 pages,
+    # which would be split again into 100x100 pages if they were processed twice
+    chapter = tmp_path / "000"
+    chapter.mkdir()
+    Image.new("RGB", (400, 100), "white").save(chapter / "00001.png")
+
+    mandown.process(tmp_path, [ProcessOps.SPLIT_DOUBLE_PAGES], jobs=jobs)
+    mandown.process(tmp_path, [ProcessOps.SPLIT_DOUBLE_PAGES], jobs=jobs)
+    assert sizes() == {"000/00001.png": (200, 100), "000/00001a.png": (200, 100)}
+    assert (tmp_path / mandown.PROCESSED_STATE_FILE).is_file()
+
+    # new and changed images are processed
+    Image.new("RGB", (400, 100), "white").save(chapter / "00002.png")
+    Image.new("RGB", (400, 100), "white").save(chapter / "00001a.png")
+    mandown.process(tmp_path, [ProcessOps.SPLIT_DOUBLE_PAGES], jobs=jobs)
+    assert sizes() == {
+        "000/00001.png": (200, 100),
+        "000/00001a.png": (200, 100),
+        "000/00001aa.png": (200, 100),
+        "000/00002.png": (200, 100),
+        "000/00002a.png": (200, 100),
+    }
+
+    # different operations process everything again
+    mandown.process(tmp_path, [ProcessOps.ROTATE_DOUBLE_PAGES], jobs=jobs)
+    assert set(sizes().values()) == {(100, 200)}
+
+
+def test_process_saves_state_once(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    from mandown.processor import ProcessedState
+
+    make_comic_folder(tmp_path, [1, 2, 1, 3])
+    saves: list[int] = []
+    save = ProcessedState.save
+    monkeypatch.setattr(
+        ProcessedState, "save", lambda self: saves.append(len(self.images)) or save(self)
+    )
+
+    # the state is saved when processing finishes, not after every chapter
+    mandown.process(tmp_path, [ProcessOps.ROTATE_DOUBLE_PAGES], jobs=1)
+    assert saves == [7]
+    assert len(ProcessedState.load(tmp_path).images) == 7
+
+    # and also if processing stops early
+    saves.clear()
+    for image in tmp_path.glob("*/*.png"):
+        Image.new("RGB", (200, 100), "white").save(image)
+    progress = mandown.process_progress(tmp_path, [ProcessOps.ROTATE_DOUBLE_PAGES], jobs=1)
+    next(progress)
+    next(progress)
+    progress.close()
+    assert saves == [7]
+
+
+def test_image_index(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    from mandown import ImageIndex
+
+    make_comic_folder(tmp_path, [2, 1])
+    Image.new("RGB", (100, 200), "white").save(tmp_path / "001" / "00001.png")
+    images = sorted(tmp_path.glob("*/*.png"))
+
+    index = ImageIndex.load(tmp_path)
+    index.refresh(images)
+    index.save()
+    index = ImageIndex.load(tmp_path)
+    assert index.get(images[0]).size == (200, 100)
+    assert index.get(images[2]).format == "PNG"
+
+    # only changed images are read again, and removed images are dropped
+    Image.new("RGB", (300, 100), "white").save(images[0])
+    monkeypatch.setattr(
+        "mandown.image_index.read_image_info",
+        lambda path: pytest.fail(f"{path} did not change") if path != images[0] else None,
+    )
+    index.refresh(images[:2])
+    assert index.get(images[0]) is None
+    assert index.get(images[2]) is None
+    assert index.get(images[1]).size == (200, 100)
+    monkeypatch.undo()
+
+    # the portrait page is never opened by processing
+    processed: list[Path] = []
+    monkeypatch.setattr(Pipeline, "process", lambda _, image: processed.append(image))
+    mandown.process(tmp_path, [ProcessOps.SPLIT_DOUBLE_PAGES], jobs=1)
+    assert processed == images[:3]
+
+
+def test_output_encoders(tmp_path: Path) -> None:
+    with pytest.raises(ValueError):
+        ProcessConfig(jpeg_quality=0)
+
+    # a transparent WEBP is put on white
+    image = Image.new("RGBA", (200, 300), (0, 0, 0, 0))
+    image.paste((255, 0, 0, 255), (50, 50, 150, 250))
+    image.save(tmp_path / "00001.webp")
+    # other images are left alone unless they are changed
+    Image.new("RGB", (200, 300), "white").save(tmp_path / "00002.png")
+    mtime = (tmp_path / "00002.png").stat().st_mtime_ns
+
+    pipeline = Pipeline([ProcessOps.WEBP_TO_JPEG], ProcessConfig(jpeg_quality=50))
+    assert pipeline.process(tmp_path / "00001.webp")
+    assert not pipeline.process(tmp_path / "00002.png")
+
+    assert not (tmp_path / "00001.webp").exists()
+    with Image.open(tmp_path / "00001.jpg") as jpeg:
+        assert jpeg.mode == "RGB"
+        assert jpeg.getpixel((0, 0)) == (255, 255, 255)
+    assert (tmp_path / "00002.png").stat().st_mtime_ns == mtime
+
+    # encoder settings are used when writing
+    sizes = []
+    for quality in [10, 95]:
+        Image.effect_noise((300, 300), 64).convert("RGB").save(tmp_path / "noise.jpg")
+        Pipeline(
+            [ProcessOps.RESIZE], ProcessConfig(target_size=(200, 200), jpeg_quality=quality)
+        ).process(tmp_path / "noise.jpg")
+        sizes.append((tmp_path / "noise.jpg").stat().st_size)
+    assert sizes[0] < sizes[1]
+
+
+def test_grayscale(tmp_path: Path) -> None:
+    gradient = Image.linear_gradient("L").resize((200, 300)).convert("RGB")
+    gradient.save(tmp_path / "00001.png")
+    gradient.save(tmp_path / "00002.jpg")
+
+    Pipeline([ProcessOps.GRAYSCALE], ProcessConfig(grayscale_levels=16)).process(
+        tmp_path / "00001.png"
+    )
+    with Image.open(tmp_path / "00001.png") as im:
+        assert im.mode == "L"
+        assert {value for _, value in im.getcolors()} <= set(range(0, 256, 17))
+
+    # grayscale device profiles convert images without being asked to
+    assert not Pipeline([ProcessOps.RESIZE], ProcessConfig(target_size=(100, 150))).draft_mode
+    pipeline = Pipeline([ProcessOps.RESIZE], ProcessConfig(output_profile="kindle"))
+    assert [op for op, _ in pipeline.steps] == [ProcessOps.GRAYSCALE, ProcessOps.RESIZE]
+    assert pipeline.process(tmp_path / "00002.jpg")
+    with Image.open(tmp_path / "00002.jpg") as im:
+        assert im.mode == "L"
+
+    pipeline = Pipeline(
+        [ProcessOps.RESIZE], ProcessConfig(output_profile="kindle", grayscale=False)
+    )
+    assert [op for op, _ in pipeline.steps] == [ProcessOps.RESIZE]
+
+    # transparent areas are put on white instead of turning black
+    for mode in ("RGBA", "LA"):
+        page = Image.new(mode, (200, 300), 0)
+        page.paste(Image.new(mode, (100, 100), (0,) * (len(mode) - 1) + (255,)), (50, 50))
+        page.save(tmp_path / "00003.png")
+        assert Pipeline([ProcessOps.GRAYSCALE], ProcessConfig()).process(tmp_path / "00003.png")
+        with Image.open(tmp_path / "00003.png") as im:
+            assert im.mode == "L"
+            assert im.getpixel((0, 0)) == 255
+            assert im.getpixel((100, 100)) == 0
+
+
+def test_profile_skips_grayscale_pages(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    chapter = tmp_path / "000"
+    chapter.mkdir()
+    size = mandown.all_profiles["kindle"].size
+    for name, mode in (("00001.png", "L"), ("00002.png", "1"), ("00003.png", "RGB")):
+        Image.new(mode, size, "white").save(chapter / name)
+
+    # pages that are already grayscale and the right size are never opened,
+    # but black and white pages are still converted
+    processed: list[Path] = []
+    monkeypatch.setattr(Pipeline, "process", lambda _, image: processed.append(image))
+    config = ProcessConfig(output_profile="kindle")
+    mandown.process(tmp_path, [ProcessOps.RESIZE], config, jobs=1)
+    assert processed == [chapter / "00002.png", chapter / "00003.png"]
+
+    # unless they have more shades than asked for
+    processed.clear()
+    config = ProcessConfig(output_profile="kindle", grayscale_levels=16)
+    mandown.process(tmp_path, [ProcessOps.RESIZE], config, jobs=1)
+    assert processed == sorted(chapter.iterdir())
+
+
+def test_split_tall_pages(tmp_path: Path) -> None:
+    # a webtoon strip of noisy panels 450px tall with 50px white gutters between them
+    strip = Image.new("RGB", (400, 5000), "white")
+    for top in range(50, 5000, 500):
+        strip.paste(Image.effect_noise((350, 450), 64).convert("RGB"), (25, top))
+    strip.save(tmp_path / "00001.png", compress_level=1)
+
+    config = ProcessConfig(target_size=(600, 800), png_compress_level=1)
+    # pages of the target aspect ratio are 533px tall
+    assert Pipeline([ProcessOps.SPLIT_TALL_PAGES], config).process(tmp_path / "00001.png")
+
+    pages = sorted(tmp_path.glob("*.png"))
+    assert len(pages) == 10
+    assert sum(Image.open(page).height for page in pages) == 5000
+    for page in pages:
+        with Image.open(page) as im:
+            assert im.width == 400
+            assert im.height <= 533 * 1.2
+            # every cut goes through a gutter
+            assert im.getpixel((200, 0)) == (255, 255, 255)
+
+    # later operations run on every page
+    Image.new("RGB", (400, 2000), "white").save(tmp_path / "00002.png")
+    Pipeline([ProcessOps.SPLIT_TALL_PAGES, ProcessOps.RESIZE], config).process(
+        tmp_path / "00002.png"
+    )
+    pages = sorted(tmp_path.glob("00002*.png"))
+    assert len(pages) == 4
+    assert {Image.open(page).size for page in pages} == {(600, 800)}
+
+    # very narrow strips, like spacers, are left whole
+    pipeline = Pipeline([ProcessOps.SPLIT_TALL_PAGES], config)
+    for size in ((1, 50), (1, 5000), (20, 5000)):
+        Image.new("RGB", size, "white").save(tmp_path / "00003.png")
+        assert not pipeline.may_change(size)
+        assert not pipeline.process(tmp_path / "00003.png")
+    assert len(list(tmp_path.glob("00003*.png"))) == 1
+
+    # and the narrowest strips that are cut still end up in pages
+    Image.new("RGB", (24, 5000), "white").save(tmp_path / "00004.png")
+    assert pipeline.process(tmp_path / "00004.png")
+    pages = sorted(tmp_path.glob("00004*.png"))
+    assert sum(Image.open(page).height for page in pages) == 5000
+
+
+def test_output_profiles(tmp_path: Path) -> None:
+    with pytest.raises(ValueError):
+        ProcessConfig(target_size=(600, 800), output_profiles=("kindle", "paper"))
+    with pytest.raises(KeyError):
+        ProcessConfig(output_profiles=("kindle", "not_a_profile"))
+
+    comic_path = tmp_path / "comic"
+    make_comic_folder(comic_path, [2, 2])
+    for image in comic_path.glob("*/*"):
+        # a page with a thick white border around it
+        page = Image.new("RGB", (1000, 1300), "white")
+        page.paste(Image.effect_noise((900, 1200), 64).convert("RGB"), (50, 50))
+        page.save(image)
+
+    profiles = ("kindle", "paper", "voyage")
+    config = ProcessConfig(output_profiles=profiles)
+    pipeline = Pipeline([ProcessOps.TRIM_BORDERS, ProcessOps.RESIZE], config)
+    # trimming runs once, and each profile resizes the trimmed page
+    assert [op for op, _ in pipeline.steps] == [ProcessOps.GRAYSCALE, ProcessOps.TRIM_BORDERS]
+    assert [op for op, _ in pipeline.variants["kindle"].steps] == [ProcessOps.RESIZE]
+
+    originals = {image: image.read_bytes() for image in comic_path.glob("*/*")}
+    mandown.process(comic_path, [ProcessOps.TRIM_BORDERS, ProcessOps.RESIZE], config, jobs=1)
+    assert {image: image.read_bytes() for image in comic_path.glob("*/*")} == originals
+
+    for profile in profiles:
+        variant_path = mandown.io.variant_path(comic_path, profile)
+        width, height = mandown.all_profiles[profile].size
+        images = sorted(image.relative_to(variant_path) for image in variant_path.glob("*/*"))
+        assert images == sorted(image.relative_to(comic_path) for image in originals)
+        for image in images:
+            with Image.open(variant_path / image) as im:
+                assert im.mode == "L"
+                # the trimmed 900x1200 page fits the profile's screen
+                assert im.width <= width and im.height <= height
+                assert width in im.size or height in im.size
+                assert abs(im.width / im.height - 0.75) < 0.01
+
+
+def test_drop_duplicate_pages(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    from mandown import PageHashIndex
+    from mandown.page_hashes import dhash
+
+    def blotchy_page() -> Image.Image:
+        return Image.effect_noise((12, 16), 80).resize((300, 400), Image.Resampling.BICUBIC)
+
+    credits, recruitment = blotchy_page().convert("RGB"), blotchy_page()
+    for i in range(5):
+        chapter = tmp_path / f"{i:03}"
+        chapter.mkdir()
+        for j in range(2):
+            Image.effect_noise((300, 400), 64).convert("RGB").save(chapter / f"{j:05}.jpg")
+        # the same credits page, scanned slightly differently in every chapter
+        credits.point(lambda v, i=i: min(v + 3 * i, 255)).resize((300 - 4 * i, 400 - 4 * i)).save(
+            chapter / "00002.jpg", quality=50 + 5 * i
+        )
+    # a page that only appears in a few chapters is kept
+    for i in range(2):
+        recruitment.save(tmp_path / f"{i:03}" / "00003.png")
+
+    mandown.process(tmp_path, [ProcessOps.DROP_DUPLICATE_PAGES], ProcessConfig(max_page_repeats=3))
+    assert not list(tmp_path.glob("*/00002.jpg"))
+    assert len(list(tmp_path.glob("*/*.jpg"))) == 10
+    assert len(list(tmp_path.glob("*/00003.png"))) == 2
+    # dropped pages are moved aside, not deleted
+    assert len(list((tmp_path / mandown.REPEATED_PAGES_FOLDER).glob("*/00002.jpg"))) == 5
+
+    # hashes are cached, so only new pages are hashed again
+    credits.save(tmp_path / "004" / "00002.png")
+    monkeypatch.setattr(
+        "mandown.page_hashes.dhash",
+        lambda path: dhash(path) if path.suffix == ".png" else pytest.fail(f"{path} was hashed"),
+    )
+    mandown.process(tmp_path, [ProcessOps.DROP_DUPLICATE_PAGES], jobs=1)
+    index = PageHashIndex.load(tmp_path)
+    assert index.get(tmp_path / "004" / "00002.png") == dhash(tmp_path / "004" / "00002.png")
+    assert (tmp_path / "004" / "00002.png").exists()
+
+
+def test_drop_duplicate_pages_keeps_sparse_pages(tmp_path: Path) -> None:
+    from PIL import ImageDraw
+
+    # different pages of text on white, which all hash to nearly 0
+    for i in range(30):
+        chapter = tmp_path / f"{i:03}"
+        chapter.mkdir()
+        page = Image.new("RGB", (600, 900), "white")
+        ImageDraw.Draw(page).text((20 + 10 * i, 40 * i), f"Chapter {i} afterword", fill="black")
+        page.save(chapter / "00000.png")
+
+    mandown.process(tmp_path, [ProcessOps.DROP_DUPLICATE_PAGES], jobs=1)
+    assert len(list(tmp_path.glob("*/00000.png"))) == 30
+
+
+def test_find_repeated_pages_does_not_chain(tmp_path: Path) -> None:
+    from mandown import PageHashIndex
+    from mandown.page_hashes import find_repeated_pages
+
+    # each hash is 4 bits from the next, but the first and last are 8 bits apart
+    first = (1 << 32) - 1
+    hashes = [first, first | 0xF << 32, first | 0xFF << 32]
+    chapters = [[tmp_path / f"{i:03}" / "00000.png"] for i in range(3)]
+    index = PageHashIndex(
+        tmp_path,
+        {f"{i:03}/00000.png": (page_hash, 0, 0) for i, page_hash in enumerate(hashes)},
+    )
+
+    assert find_repeated_pages(chapters, index, 1) == chapters[0] + chapters[1]
+    assert find_repeated_pages(chapters, index, 2) == []
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_process_archive(tmp_path: Path, jobs: int) -> None:
+    import io
+    import zipfile
+
+    def encode(image: Image.Image, fmt: str) -> bytes:
+        buffer = io.BytesIO()
+        image.save(buffer, fmt)
+        return buffer.getvalue()
+
+    archive_path = tmp_path / "comic.cbz"
+    with zipfile.ZipFile(archive_path, "w") as archive:
+        archive.writestr("ComicInfo.xml", "<ComicInfo />")
+        archive.writestr("000/00001.png", encode(Image.new("RGB", (200, 100), "white"), "PNG"))
+        archive.writestr("000/00002.png", encode(Image.new("RGB", (100, 200), "white"), "PNG"))
+        archive.writestr("001/00001.webp", encode(Image.new("RGB", (100, 200), "red"), "WEBP"))
+    original = archive_path.read_bytes()
+
+    ops = [ProcessOps.SPLIT_DOUBLE_PAGES, ProcessOps.WEBP_TO_JPEG]
+    progress = list(
+        mandown.process_archive_progress(archive_path, ops, dest=tmp_path / "new.cbz", jobs=jobs)
+    )
+    assert progress == [3, "000/00001.png", "000/00002.png", "001/00001.webp"]
+    assert archive_path.read_bytes() == original
+
+    with zipfile.ZipFile(tmp_path / "new.cbz") as archive:
+        # entries stay in order, and split pages follow the page they were split from
+        assert archive.namelist() == [
+            "ComicInfo.xml",
+            "000/00001.png",
+            "000/00001a.png",
+            "000/00002.png",
+            "001/00001.jpg",
+        ]
+        assert archive.read("ComicInfo.xml") == b"<ComicInfo />"
+        assert Image.open(archive.open("000/00001a.png")).size == (100, 100)
+        assert Image.open(archive.open("001/00001.jpg")).format == "JPEG"
+
+    # archives are replaced in place by default
+    mandown.process_archive(archive_path, ops, jobs=jobs)
+    with zipfile.ZipFile(archive_path) as archive:
+        assert len(archive.namelist()) == 5
+    assert not list(tmp_path.glob(".*.tmp"))